@@ -14,11 +14,13 @@ import json
 
 import jmespath
 
+from .helpers.generic import condition_status
+
 
 CLUSTER_TABLE_FORMAT = """\
 {
     name: metadata.name,
-    phase: status.phase,
+    phase: status.phase || error.code,
     created: metadata.creationTimestamp,
     namespace: metadata.namespace
 }
@@ -26,12 +28,189 @@ CLUSTER_TABLE_FORMAT = """\
 
 CLUSTERS_LIST_TABLE_FORMAT = f"items[].{CLUSTER_TABLE_FORMAT}"
 
+CLUSTERS_TABLE_FORMAT = f"[].{CLUSTER_TABLE_FORMAT}"
+
+# Keeps only the fields that CLUSTER_TABLE_FORMAT reads, so the table transformer still applies
+# but managedFields, annotations, spec and status conditions are dropped as early as possible.
+# "error" is only present on the not-found entries returned when showing several clusters.
+CLUSTER_LEAN_FORMAT = """\
+{
+    apiVersion: apiVersion,
+    kind: kind,
+    metadata: {
+        name: metadata.name,
+        namespace: metadata.namespace,
+        creationTimestamp: metadata.creationTimestamp
+    },
+    status: {
+        phase: status.phase
+    },
+    error: error
+}
+"""
+
+CLUSTERS_LIST_LEAN_FORMAT = f"{{apiVersion: apiVersion, kind: kind, items: items[].{CLUSTER_LEAN_FORMAT}}}"
+
+# Clusters listed across several management clusters carry the kubectl context they were found in.
+CONTEXT_CLUSTER_TABLE_FORMAT = """\
+{
+    context: context,
+    name: metadata.name,
+    phase: status.phase,
+    created: metadata.creationTimestamp,
+    namespace: metadata.namespace
+}
+"""
+
+CONTEXT_CLUSTERS_LIST_TABLE_FORMAT = f"items[].{CONTEXT_CLUSTER_TABLE_FORMAT}"
+
+CONTEXT_CLUSTER_LEAN_FORMAT = """\
+{
+    context: context,
+    metadata: {
+        name: metadata.name,
+        namespace: metadata.namespace,
+        creationTimestamp: metadata.creationTimestamp
+    },
+    status: {
+        phase: status.phase
+    }
+}
+"""
+
+# The columns of "az capi list --watch", which prints a cluster's row again only when one of them changes.
+WATCH_COLUMNS = {
+    "name": 32,
+    "namespace": 16,
+    "phase": 14,
+    "ready": 8,
+    "controlPlaneReady": 18,
+    "infrastructureReady": 20,
+}
+
+WATCH_CONDITIONS = {
+    "ready": "Ready",
+    "controlPlaneReady": "ControlPlaneReady",
+    "infrastructureReady": "InfrastructureReady",
+}
+
+# Parse each expression once at import instead of on every call to jmespath.search().
+_CLUSTER_TABLE_EXPRESSION = jmespath.compile(CLUSTER_TABLE_FORMAT)
+_CLUSTERS_LIST_TABLE_EXPRESSION = jmespath.compile(CLUSTERS_LIST_TABLE_FORMAT)
+_CLUSTERS_TABLE_EXPRESSION = jmespath.compile(CLUSTERS_TABLE_FORMAT)
+_CLUSTER_LEAN_EXPRESSION = jmespath.compile(CLUSTER_LEAN_FORMAT)
+_CLUSTERS_LIST_LEAN_EXPRESSION = jmespath.compile(CLUSTERS_LIST_LEAN_FORMAT)
+_CONTEXT_CLUSTER_TABLE_EXPRESSION = jmespath.compile(CONTEXT_CLUSTER_TABLE_FORMAT)
+_CONTEXT_CLUSTERS_LIST_TABLE_EXPRESSION = jmespath.compile(CONTEXT_CLUSTERS_LIST_TABLE_FORMAT)
+_CONTEXT_CLUSTER_LEAN_EXPRESSION = jmespath.compile(CONTEXT_CLUSTER_LEAN_FORMAT)
+
 
 def output_for_tsv(s):
     """Return JSON data to output a cluster in tab-separated format."""
-    return jmespath.search(CLUSTER_TABLE_FORMAT, json.loads(s))
+    return _CLUSTER_TABLE_EXPRESSION.search(json.loads(s))
 
 
 def output_list_for_tsv(s):
     """Return JSON data to output a list of clusters in tab-separated format."""
-    return jmespath.search(CLUSTERS_LIST_TABLE_FORMAT, json.loads(s))
+    return _CLUSTERS_LIST_TABLE_EXPRESSION.search(json.loads(s))
+
+
+def output_for_table(s):
+    """Return JSON data with only the cluster fields needed for table format."""
+    return _CLUSTER_LEAN_EXPRESSION.search(json.loads(s))
+
+
+def output_list_for_table(s):
+    """Return JSON data with only the cluster list fields needed for table format."""
+    return _CLUSTERS_LIST_LEAN_EXPRESSION.search(json.loads(s))
+
+
+def output_clusters_list_table(result):
+    """Return table rows for a list of clusters, with a context column if it spans several contexts."""
+    if "contexts" in result:
+        return _CONTEXT_CLUSTERS_LIST_TABLE_EXPRESSION.search(result)
+    return _CLUSTERS_LIST_TABLE_EXPRESSION.search(result)
+
+
+def project_context_cluster(cluster, projection=None):
+    """Return a cluster found in a kubectl context reduced to the fields needed by "tsv" or "table" output."""
+    if projection == "tsv":
+        return _CONTEXT_CLUSTER_TABLE_EXPRESSION.search(cluster)
+    if projection == "table":
+        return _CONTEXT_CLUSTER_LEAN_EXPRESSION.search(cluster)
+    return cluster
+
+
+def output_clusters_table(result):
+    """Return table rows for a single cluster or for a list of clusters and not-found entries."""
+    if isinstance(result, list):
+        if result and "nodePools" in result[0]:
+            return output_cluster_details_table(result)
+        return _CLUSTERS_TABLE_EXPRESSION.search(result)
+    if "nodePools" in result:
+        return output_cluster_details_table([result])
+    return _CLUSTER_TABLE_EXPRESSION.search(result)
+
+
+def output_cluster_details_table(details):
+    """
+    Return table rows that draw each cluster from "az capi show --details" as a tree of its control
+    plane, node pools and machines, with readiness and replica counts.
+    """
+    rows = []
+
+    def add_row(node, prefix):
+        replicas = ""
+        if "replicas" in node:
+            replicas = f"{node['readyReplicas']}/{node['replicas'] if node['replicas'] is not None else '?'}"
+        rows.append({
+            "name": f"{prefix}{node['kind']}/{node['name']}",
+            "ready": node.get("ready") or "",
+            "replicas": replicas,
+            "phase": node.get("phase") or "",
+            "node": node.get("nodeName") or "",
+        })
+
+    for cluster in details:
+        add_row(cluster, "")
+        children = ([cluster["controlPlane"]] if cluster.get("controlPlane") else []) + cluster["nodePools"]
+        for i, child in enumerate(children):
+            last_child = i == len(children) - 1
+            add_row(child, "└─" if last_child else "├─")
+            indent = "  " if last_child else "│ "
+            for j, machine in enumerate(child["machines"]):
+                add_row(machine, indent + ("└─" if j == len(child["machines"]) - 1 else "├─"))
+    return rows
+
+
+def project_cluster(cluster, projection=None):
+    """Return a parsed cluster reduced to the fields needed by "tsv" or "table" output."""
+    if projection == "tsv":
+        return _CLUSTER_TABLE_EXPRESSION.search(cluster)
+    if projection == "table":
+        return _CLUSTER_LEAN_EXPRESSION.search(cluster)
+    return cluster
+
+
+def cluster_watch_row(cluster):
+    """Return the fields of a cluster shown by "az capi list --watch"."""
+    metadata, status = cluster.get("metadata") or {}, cluster.get("status") or {}
+    row = {"name": metadata.get("name"), "namespace": metadata.get("namespace"), "phase": status.get("phase")}
+    for column, condition_type in WATCH_CONDITIONS.items():
+        row[column] = condition_status(cluster, condition_type)
+    return row
+
+
+def format_watch_header():
+    """Return the header line of "az capi list --watch" in table format."""
+    return format_watch_row({column: column[0].upper() + column[1:] for column in WATCH_COLUMNS}, "table")
+
+
+def format_watch_row(row, output):
+    """Return a line of "az capi list --watch": aligned columns for table, tab-separated or JSON."""
+    values = ["" if row.get(column) is None else str(row[column]) for column in WATCH_COLUMNS]
+    if output == "table":
+        return " ".join(f"{value:<{width}}" for value, width in zip(values, WATCH_COLUMNS.values())).rstrip()
+    if output == "tsv":
+        return "\t".join(values)
+    return json.dumps(row)
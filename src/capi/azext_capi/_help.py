@@ -70,6 +70,18 @@ parameters:
     type: string
     long-summary: |
         If not specified, the value of --name will be used
+  - name: --no-wait
+    type: bool
+    short-summary: Return once the workload cluster configuration is applied.
+    long-summary: |
+        Use "az capi wait --nodes-ready" to fetch the kubeconfig, deploy the CNI and wait
+        for the nodes later, adding --windows for a Windows cluster. Can't be used with --pivot.
+  - name: --resume
+    type: bool
+    short-summary: Continue a failed or interrupted create from its last incomplete step.
+    long-summary: |
+        Completed steps are recorded per cluster in $HOME/.azure/capi/journals and are
+        only skipped if the arguments match the run being resumed.
   - name: --ssh-public-key
     type: string
     short-summary: Public key contents to install on node VMs for SSH access.
@@ -91,6 +103,49 @@ type: command
 short-summary: Delete a workload cluster.
 long-summary: |
     See https://capz.sigs.k8s.io/ for more information.
+parameters:
+  - name: --no-wait
+    type: bool
+    short-summary: Return once the deletion is requested.
+    long-summary: |
+        Use "az capi wait --deleted" to wait for the deletion to finish.
+"""
+
+helps['capi wait'] = """
+type: command
+short-summary: Wait for a workload cluster to reach a state.
+long-summary: |
+    Pairs with --no-wait on "az capi create" and "az capi delete", so many operations
+    can be started and then waited on. Exactly one condition is required. --created and
+    --deleted only wait, while --nodes-ready also changes the workload cluster.
+parameters:
+  - name: --created
+    type: bool
+    short-summary: Wait until the Cluster object is Ready.
+  - name: --deleted
+    type: bool
+    short-summary: Wait until the Cluster object is deleted.
+    long-summary: |
+        With --resource-group, waits for the resource group to be deleted instead. This is
+        required for a self-managed cluster, which can't report its own deletion.
+  - name: --nodes-ready
+    type: bool
+    short-summary: Wait until the cluster is created, then finish setting it up.
+    long-summary: |
+        Finishes what a create without --no-wait does, so it changes the workload cluster:
+        writes its kubeconfig, deploys the CNI (add --windows for Windows Calico) and waits
+        for all machines and nodes to be ready.
+  - name: --timeout
+    type: integer
+    short-summary: Seconds to wait for the Cluster object.
+  - name: --windows -w
+    type: bool
+    short-summary: With --nodes-ready, also deploy Windows Calico support.
+examples:
+  - name: Create several workload clusters, then wait for all of them.
+    text: |
+        az capi create -n cluster1 --no-wait -y && az capi create -n cluster2 --no-wait -y
+        az capi wait -n cluster1 --nodes-ready && az capi wait -n cluster2 --nodes-ready
 """
 
 helps['capi install'] = """
@@ -103,9 +158,32 @@ parameters:
 
 helps['capi show'] = """
 type: command
-short-summary: Show details of a workload cluster.
+short-summary: Show details of one or more workload clusters.
 long-summary: |
     See https://capz.sigs.k8s.io/ for more information.
+parameters:
+  - name: --name -n
+    type: string
+    short-summary: Names of the workload clusters.
+    long-summary: |
+        When more than one cluster is requested, all of them are fetched with a single
+        list call and returned in the order given. Clusters that don't exist are
+        reported as entries with a "NotFound" error.
+  - name: --names-from-file
+    type: string
+    short-summary: Path to a file with one workload cluster name per line.
+  - name: --details
+    type: bool
+    short-summary: Show each cluster's control plane, node pools and machines, like "clusterctl describe".
+    long-summary: |
+        Clusters, control planes, machine deployments, machine pools and machines are each
+        fetched with one list call, concurrently, and joined by cluster name. With
+        --output table the result is drawn as a tree with readiness and replica counts.
+examples:
+  - name: Show several workload clusters at once.
+    text: az capi show -n cluster1 cluster2 cluster3
+  - name: Show the machines of a workload cluster as a tree.
+    text: az capi show -n cluster1 --details -o table
 """
 
 helps['capi list'] = """
@@ -113,6 +191,30 @@ type: command
 short-summary: List workload clusters.
 long-summary: |
     See https://capz.sigs.k8s.io/ for more information.
+parameters:
+  - name: --contexts
+    type: string
+    short-summary: Kubectl contexts of the management clusters to list, separated by commas or spaces.
+    long-summary: |
+        The management clusters are queried concurrently, and each cluster is listed with
+        its context. Contexts that can't be reached are reported without failing the command.
+  - name: --all-contexts
+    type: bool
+    short-summary: List workload clusters in every context of the kubeconfig.
+  - name: --timeout
+    type: integer
+    short-summary: Seconds to wait for each context with --contexts or --all-contexts.
+  - name: --watch -w
+    type: bool
+    short-summary: After listing, print a cluster again each time its phase or readiness changes.
+    long-summary: |
+        Follows a watch of the management cluster instead of listing repeatedly, and reconnects
+        when the watch expires. Press Ctrl+C to stop.
+examples:
+  - name: List workload clusters of the management clusters in two regions.
+    text: az capi list --contexts capi-eastus,capi-westeurope -o table
+  - name: Follow workload clusters as they provision.
+    text: az capi list --watch -o table
 """
 
 helps['capi update'] = """
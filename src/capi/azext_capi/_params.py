@@ -38,10 +38,29 @@ def load_arguments(self, _):
         ctx.argument('windows', options_list=['--windows', '-w'])
         ctx.argument('yes', options_list=['--yes', '-y'], help="Do not prompt for confirmation")
         ctx.argument('user_provided_template', options_list=['--template'])
+        ctx.argument('no_wait', options_list=['--no-wait'], help="Do not wait for the operation to finish")
+        ctx.argument('resume', options_list=['--resume'])
         ctx.argument('management_cluster_resource_group_name',
                      options_list=['--management-cluster-resource-group-name', '-mg'],
                      help="Resource group name of management cluster")
 
+    with self.argument_context('capi show') as ctx:
+        ctx.argument('capi_name', nargs='+')
+        ctx.argument('names_from_file', options_list=['--names-from-file'])
+        ctx.argument('details', options_list=['--details'])
+
+    with self.argument_context('capi list') as ctx:
+        ctx.argument('contexts', nargs='+', options_list=['--contexts'])
+        ctx.argument('all_contexts', options_list=['--all-contexts'])
+        ctx.argument('timeout', type=int, options_list=['--timeout'])
+        ctx.argument('watch', options_list=['--watch', '-w'])
+
+    with self.argument_context('capi wait') as ctx:
+        ctx.argument('created', options_list=['--created'])
+        ctx.argument('deleted', options_list=['--deleted'])
+        ctx.argument('nodes_ready', options_list=['--nodes-ready'])
+        ctx.argument('timeout', type=int, options_list=['--timeout'])
+
     with self.argument_context('capi install') as ctx:
         ctx.argument('all_tools', capi_name_type, options_list=['--all', '-a'])
 
@@ -9,7 +9,8 @@
 # pylint: disable=invalid-name
 
 from ._format import CLUSTER_TABLE_FORMAT
-from ._format import CLUSTERS_LIST_TABLE_FORMAT
+from ._format import output_clusters_list_table
+from ._format import output_clusters_table
 
 
 def load_command_table(self, _):
@@ -20,10 +21,11 @@ def load_command_table(self, _):
                          table_transformer=CLUSTER_TABLE_FORMAT)
         g.custom_command('delete', 'delete_workload_cluster')
         g.custom_command('list', 'list_workload_clusters',
-                         table_transformer=CLUSTERS_LIST_TABLE_FORMAT)
+                         table_transformer=output_clusters_list_table)
         g.custom_command('show', 'show_workload_cluster',
-                         table_transformer=CLUSTER_TABLE_FORMAT)
+                         table_transformer=output_clusters_table)
         g.custom_command('update', 'update_workload_cluster')
+        g.custom_command('wait', 'wait_for_workload_cluster')
         g.custom_command('install', 'install_tools')
 
     with self.command_group('capi management', is_preview=True) as g:
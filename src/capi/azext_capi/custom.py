@@ -5,16 +5,21 @@
 
 """This module implements the behavior of `az capi` commands."""
 
-# pylint: disable=missing-docstring
+# pylint: disable=missing-docstring,too-many-lines
 
 import base64
 import json
 import os
 import subprocess
 import time
-import re
+from concurrent.futures import ThreadPoolExecutor
 
+import azext_capi.helpers.cache as cache_helpers
+import azext_capi.helpers.describe as describe_helpers
+import azext_capi.helpers.journal as journal_helpers
 import azext_capi.helpers.kubectl as kubectl_helpers
+import azext_capi.helpers.manifest as manifest_helpers
+import azext_capi.helpers.preflight as preflight_helpers
 
 from azure.cli.core import get_default_cli
 from azure.cli.core.api import get_config_dir
@@ -24,12 +29,13 @@ from azure.core.exceptions import ResourceNotFoundError as ResourceNotFoundExcep
 from azure.cli.core.azclierror import ResourceNotFoundError
 from azure.cli.core.azclierror import UnclassifiedUserFault
 from azure.cli.core.azclierror import MutuallyExclusiveArgumentError
-from jinja2 import Environment, PackageLoader, StrictUndefined
-from jinja2.exceptions import UndefinedError
 from knack.prompting import prompt_choice_list, prompt_y_n
 from msrestazure.azure_exceptions import CloudError
+import yaml
 
-from ._format import output_for_tsv, output_list_for_tsv
+from ._format import output_for_table, output_for_tsv, output_list_for_table, output_list_for_tsv, project_cluster
+from ._format import output_cluster_details_table, project_context_cluster
+from ._format import cluster_watch_row, format_watch_header, format_watch_row
 from .helpers.generic import has_kind_prefix
 from .helpers.logger import logger
 from .helpers.spinner import Spinner
@@ -37,9 +43,14 @@ from .helpers.run_command import run_shell_command, try_command_with_spinner
 from .helpers.binary import check_clusterctl, check_kubectl, check_kind
 from .helpers.prompt import get_cluster_name_by_user_prompt, get_user_prompt_or_default
 from .helpers.generic import match_output
-from .helpers.os import set_environment_variables, write_to_file
-from .helpers.network import urlretrieve
-from .helpers.constants import MANAGEMENT_RG_NAME
+from .helpers.os import atomic_file
+from .helpers.network import fetch_cached
+from .helpers.template import find_missing_builtin_template_args, generate_builtin_jinja_template
+from .helpers.template import render_custom_cluster_template
+from .helpers.constants import CALICO_MANIFEST, CAPZ_ADDONS_URL, CNI_MANIFEST_CACHE_MAX_AGE, CNI_MANIFESTS_VERSION
+from .helpers.constants import LIST_CONTEXT_TIMEOUT, MANAGEMENT_RG_NAME, WINDOWS_CALICO_MANIFEST
+from .helpers.constants import WORKLOAD_CLUSTER_WAIT_TIMEOUT
+from .helpers.kubeconfig import get_cluster_identity, is_same_cluster, load_kubeconfig
 
 
 def init_environment(cmd, prompt=True, management_cluster_name=None,
@@ -92,27 +103,35 @@ https://cluster-api.sigs.k8s.io/user/concepts.html
     return True
 
 
-def _create_azure_identity_secret(cmd, kubeconfig=None):
+def _azure_identity_secret_command(kubeconfig=None):
     secret_name = os.environ["AZURE_CLUSTER_IDENTITY_SECRET_NAME"]
     secret_namespace = os.environ["AZURE_CLUSTER_IDENTITY_SECRET_NAMESPACE"]
     azure_client_secret = os.environ["AZURE_CLIENT_SECRET"]
+    command = ["kubectl", "create", "secret", "generic", secret_name, "--from-literal",
+               f"clientSecret={azure_client_secret}", "--namespace", secret_namespace]
+    return command + kubectl_helpers.add_kubeconfig_to_command(kubeconfig)
+
+
+def _create_azure_identity_secret(cmd, kubeconfig=None):
     begin_msg = "Creating Cluster Identity Secret"
     end_msg = "✓ Created Cluster Identity Secret"
     error_msg = "Can't create Cluster Identity Secret"
-    command = ["kubectl", "create", "secret", "generic", secret_name, "--from-literal",
-               f"clientSecret={azure_client_secret}", "--namespace", secret_namespace]
-    command += kubectl_helpers.add_kubeconfig_to_command(kubeconfig)
+    command = _azure_identity_secret_command(kubeconfig)
     try_command_with_spinner(cmd, command, begin_msg, end_msg, error_msg, True)
 
 
-def _install_capi_provider_components(cmd, kubeconfig=None):
+def _capi_provider_components_command(kubeconfig=None):
     os.environ["EXP_MACHINE_POOL"] = "true"
     os.environ["EXP_CLUSTER_RESOURCE_SET"] = "true"
+    command = ["clusterctl", "init", "--infrastructure", "azure"]
+    return command + kubectl_helpers.add_kubeconfig_to_command(kubeconfig)
+
+
+def _install_capi_provider_components(cmd, kubeconfig=None):
     begin_msg = "Initializing management cluster"
     end_msg = "✓ Initialized management cluster"
     error_msg = "Couldn't install CAPI provider components in current cluster"
-    command = ["clusterctl", "init", "--infrastructure", "azure"]
-    command += kubectl_helpers.add_kubeconfig_to_command(kubeconfig)
+    command = _capi_provider_components_command(kubeconfig)
     try_command_with_spinner(cmd, command, begin_msg, end_msg, error_msg)
 
 
@@ -175,8 +194,9 @@ def create_aks_management_cluster(cmd, cluster_name, resource_group_name=None, l
     return True
 
 
-def create_new_management_cluster(cmd, cluster_name=None, resource_group_name=None,
-                                  location=None, pre_prompt_text=None, prompt=True):
+# The arguments are the management cluster options shared by "az capi create" and "az capi management create"
+def create_new_management_cluster(cmd, cluster_name=None,  # pylint: disable=too-many-arguments
+                                  resource_group_name=None, location=None, pre_prompt_text=None, prompt=True):
     choices = ["azure - a management cluster in the Azure cloud",
                "local - a local Docker container-based management cluster",
                "exit - don't create a management cluster"]
@@ -214,6 +234,8 @@ def delete_management_cluster(cmd, yes=False):  # pylint: disable=unused-argumen
     if not yes and not prompt_y_n(msg, default="n"):
         return
 
+    cache_helpers.invalidate_management_cluster()
+    cache_helpers.invalidate_applied_manifest_digests()
     command = ["clusterctl", "delete", "--all",
                "--include-crd", "--include-namespace"]
     try:
@@ -250,14 +272,8 @@ def show_management_cluster(_cmd, yes=False):
     path = os.path.join(get_config_dir(), "capi")
     if not os.path.exists(path):
         os.makedirs(path)
-    command = ["kubectl", "config", "get-contexts",
-               "--no-headers", "--output", "name"]
-    try:
-        output = run_shell_command(command)
-        contexts = output.splitlines()
-        logger.info(contexts)
-    except subprocess.CalledProcessError as err:
-        raise UnclassifiedUserFault from err
+    contexts = list(load_kubeconfig().entries["contexts"])
+    logger.info(contexts)
 
     msg = path + "ok"
     if not yes and prompt_y_n(msg, default="n"):
@@ -272,6 +288,7 @@ def update_management_cluster(cmd, yes=False):
         return
     # Check for clusterctl tool
     check_prereqs(cmd, install=yes)
+    cache_helpers.invalidate_management_cluster()
     command = [
         "clusterctl",
         "upgrade",
@@ -297,58 +314,48 @@ def set_azure_identity_secret_env_vars():
 
 
 def generate_workload_cluster_configuration(cmd, filename, args, user_provided_template=None):
-    end_msg = f'✓ Generated workload cluster configuration at "{filename}"'
-    with Spinner(cmd, "Generating workload cluster configuration", end_msg):
-        manifest = None
-        try:
-            if user_provided_template:
-                manifest = render_custom_cluster_template(user_provided_template, filename, args)
-            else:
-                manifest = render_builtin_jinja_template(args)
-            write_to_file(filename, manifest)
-        except subprocess.CalledProcessError as err:
-            msg = "Could not generate workload cluster configuration."
-            raise UnclassifiedUserFault(msg) from err
-
-
-def render_builtin_jinja_template(args):
     """
-    Use the built-in template and process it with Jinja
+    Renders the workload cluster manifest, writes it to filename and returns it as a Manifest,
+    so later steps reuse the parsed objects instead of reading the file again.
     """
-    env = Environment(loader=PackageLoader("azext_capi", "templates"),
-                      auto_reload=False, undefined=StrictUndefined)
-    logger.debug("Available templates: %s", env.list_templates())
-    jinja_template = env.get_template("base.jinja")
-    try:
-        return jinja_template.render(args)
-    except UndefinedError as err:
-        msg = f"Could not generate workload cluster configuration.\n{err}"
-        raise RequiredArgumentMissingError(msg) from err
+    end_msg = f'✓ Generated workload cluster configuration at "{filename}"'
+    with Spinner(cmd, "Generating workload cluster configuration", end_msg):
+        if user_provided_template:
+            chunks = [render_custom_cluster_template(user_provided_template, args)]
+        else:
+            chunks = generate_builtin_jinja_template(args)
+        # Stream the rendered template into a temporary file and parse it back from there. The file
+        # only replaces filename once the manifest is valid, so errors and Ctrl-C leave no partial file.
+        with atomic_file(filename, "w+") as manifest_file:
+            manifest_file.writelines(chunks)
+            manifest_file.seek(0)
+            try:
+                manifest = manifest_helpers.Manifest.from_yaml(manifest_file)
+            except yaml.YAMLError as err:
+                raise InvalidArgumentValueError(f"Workload cluster configuration is not valid YAML:\n{err}") from err
+            problems = manifest.validate()
+            if problems:
+                msg = "Workload cluster configuration is not valid:\n" + "\n".join(problems)
+                raise InvalidArgumentValueError(msg)
+    return manifest
 
 
-def render_custom_cluster_template(template, filename, args=None):
+def validate_workload_cluster_args(args, user_provided_template=None):
     """
-    Fetch a user-defined template and process it with "clusterctl generate"
+    Checks the required environment variables and, for the built-in template, that every template
+    variable has an argument. All problems are reported in one error, before any slow work starts.
     """
-    set_environment_variables(args)
-    command = ["clusterctl", "generate", "yaml", "--from"]
-    if not os.path.isfile(template):
-        reg = r"github.com\/[^\/]+?\/[^\/]+?\/blob\/[^\/]+\/[^\/]+?$"
-        if not match_output(template, reg):
-            file_name = f"raw-{filename}"
-            urlretrieve(template, file_name)
-            template = file_name
-    command += [template]
-    try:
-        return run_shell_command(command)
-    except subprocess.CalledProcessError as err:
-        err_command_list = err.args[1]
-        err_command_name = err_command_list[0]
-        if err_command_name == "clusterctl":
-            error_variables = re.search(r"(?<=\[).+?(?=\])", err.stdout)[0]
-            msg = "Could not generate workload cluster configuration."
-            msg += f"\nPlease set the following environment variables:\n{error_variables}"
-        raise RequiredArgumentMissingError(msg) from err
+    problems = []
+    missing_env_vars = find_missing_environment_variables()
+    if missing_env_vars:
+        problems.append(f"Required environment variables were not found: {', '.join(missing_env_vars)}")
+    if not user_provided_template:
+        missing_args = find_missing_builtin_template_args(args)
+        if missing_args:
+            problems.append(f"The built-in template needs values for: {', '.join(missing_args)}")
+    if problems:
+        msg = "Could not generate workload cluster configuration.\n" + "\n".join(problems)
+        raise RequiredArgumentMissingError(msg)
 
 
 # pylint: disable=inconsistent-return-statements
@@ -372,8 +379,14 @@ def create_workload_cluster(  # pylint: disable=unused-argument,too-many-argumen
         windows=False,
         pivot=False,
         user_provided_template=None,
+        no_wait=False,
+        resume=False,
         yes=False):
 
+    if pivot and no_wait:
+        raise MutuallyExclusiveArgumentError('"--pivot" needs the workload cluster to be ready and can\'t be '
+                                             'used with "--no-wait"')
+
     if user_provided_template:
         mutual_exclusive_args = [
             {
@@ -424,11 +437,7 @@ def create_workload_cluster(  # pylint: disable=unused-argument,too-many-argumen
     # Set Azure Identity Secret enviroment variables. This will be used in init_environment
     set_azure_identity_secret_env_vars()
 
-    if not init_environment(cmd, not yes, management_cluster_name, management_cluster_resource_group_name,
-                            location):
-        return
-
-    # Generate the cluster configuration
+    # Collect the cluster configuration
     ssh_public_key_b64 = ""
     if ssh_public_key:
         ssh_public_key_b64 = base64.b64encode(ssh_public_key.encode("utf-8"))
@@ -447,12 +456,12 @@ def create_workload_cluster(  # pylint: disable=unused-argument,too-many-argumen
         "KUBERNETES_VERSION": kubernetes_version,
         "WORKER_MACHINE_COUNT": node_machine_count,
         "NODEPOOL_TYPE": "machinepool" if machinepool else "machinedeployment",
-        "CLUSTER_IDENTITY_NAME": os.environ["CLUSTER_IDENTITY_NAME"],
-        "AZURE_SUBSCRIPTION_ID": os.environ['AZURE_SUBSCRIPTION_ID'],
-        "AZURE_TENANT_ID": os.environ["AZURE_TENANT_ID"],
-        "AZURE_CLIENT_ID": os.environ["AZURE_CLIENT_ID"],
-        "AZURE_CLUSTER_IDENTITY_SECRET_NAME": os.environ["AZURE_CLUSTER_IDENTITY_SECRET_NAME"],
-        "AZURE_CLUSTER_IDENTITY_SECRET_NAMESPACE": os.environ["AZURE_CLUSTER_IDENTITY_SECRET_NAMESPACE"],
+        "CLUSTER_IDENTITY_NAME": os.environ.get("CLUSTER_IDENTITY_NAME"),
+        "AZURE_SUBSCRIPTION_ID": os.environ.get("AZURE_SUBSCRIPTION_ID"),
+        "AZURE_TENANT_ID": os.environ.get("AZURE_TENANT_ID"),
+        "AZURE_CLIENT_ID": os.environ.get("AZURE_CLIENT_ID"),
+        "AZURE_CLUSTER_IDENTITY_SECRET_NAME": os.environ.get("AZURE_CLUSTER_IDENTITY_SECRET_NAME"),
+        "AZURE_CLUSTER_IDENTITY_SECRET_NAMESPACE": os.environ.get("AZURE_CLUSTER_IDENTITY_SECRET_NAMESPACE"),
     }
 
     if not user_provided_template:
@@ -462,87 +471,233 @@ def create_workload_cluster(  # pylint: disable=unused-argument,too-many-argumen
             "EPHEMERAL": ephemeral_disks,
         }
         args.update(jinja_extra_args)
+    validate_workload_cluster_args(args, user_provided_template)
+
+    journal_args = dict(args, PIVOT=pivot, TEMPLATE=user_provided_template, WINDOWS=windows)
+    resume_hint = f'Run the command again with "--resume" to continue creating "{capi_name}"'
+    journal = journal_helpers.Journal.for_operation("create", capi_name, journal_args, resume, resume_hint)
+    with journal:
+        if not journal.done("manifest"):
+            machine_counts = {}
+            for vm_size, count in ((control_plane_machine_type, control_plane_machine_count),
+                                   (node_machine_type, node_machine_count)):
+                machine_counts[vm_size] = machine_counts.get(vm_size, 0) + int(count)
+            run_preflight_checks(cmd, location, machine_counts, kubernetes_version, user_provided_template)
+
+        if not init_journaled_environment(cmd, journal, not yes, management_cluster_name,
+                                          management_cluster_resource_group_name, location):
+            return
+
+        if not journal.done("manifest"):
+            # Generate the cluster configuration
+            filename = capi_name + ".yaml"
+            manifest = generate_workload_cluster_configuration(cmd, filename, args, user_provided_template)
+            apply_workload_cluster_manifest(cmd, capi_name, manifest)
+            journal.record("manifest", filename)
+
+        if no_wait:
+            logger.warning('Run "az capi wait --name %s --nodes-ready%s" to finish setting up the workload cluster',
+                           capi_name, " --windows" if windows else "")
+            return show_workload_cluster(cmd, capi_name)
+
+        workload_cfg = wait_for_workload_cluster_nodes(cmd, capi_name, windows, journal)
+
+        if pivot and not journal.done("pivot"):
+            # The bootstrap cluster is deleted while the workload cluster is read from its new management
+            # cluster. The read uses the target kubeconfig, since the deletion rewrites the default one.
+            bootstrap_deletion = pivot_cluster(cmd, workload_cfg, wait=False)
+            result = get_workload_cluster(cmd, capi_name, kubeconfig=workload_cfg)
+            bootstrap_deletion.result()
+            journal.record("pivot")
+            return result
+        return show_workload_cluster(cmd, capi_name)
+
+
+# Besides the journal, the arguments are passed through to init_environment
+def init_journaled_environment(cmd, journal, prompt, management_cluster_name=None,  # pylint: disable=too-many-arguments
+                               resource_group_name=None, location=None):
+    """
+    Runs the "environment" step of a create operation, or restores what it recorded when resuming.
+    Returns False if the user declined to set up a management cluster.
+    """
+    if journal.done("environment"):
+        management_resource_group = (journal.output("environment") or {}).get("management_resource_group")
+        if management_resource_group:
+            os.environ[MANAGEMENT_RG_NAME] = management_resource_group
+        return True
+    if not init_environment(cmd, prompt, management_cluster_name, resource_group_name, location):
+        return False
+    # The resource group of a new AKS management cluster is needed to delete it after a pivot
+    journal.record("environment", {"management_resource_group": os.environ.get(MANAGEMENT_RG_NAME)})
+    return True
 
-    filename = capi_name + ".yaml"
-    generate_workload_cluster_configuration(cmd, filename, args, user_provided_template)
 
-    # Apply the cluster configuration.
-    attempts, delay = 100, 3
-    begin_msg = f'Creating workload cluster "{capi_name}"'
-    end_msg = f'✓ Created workload cluster "{capi_name}"'
-    with Spinner(cmd, begin_msg, end_msg):
-        command = ["kubectl", "apply", "-f", filename]
-        for _ in range(attempts):
+def run_preflight_checks(cmd, location, machine_counts, kubernetes_version, user_provided_template=None):
+    """
+    Checks VM size availability, vCPU quota and the Kubernetes image in the location, concurrently
+    with probing the management cluster of the current context. All problems are reported in one
+    error, before any slow work starts. A custom template sets its own VM sizes, machine counts and
+    image, so only the management cluster is probed for it.
+    """
+    from ._client_factory import cf_compute_service  # pylint: disable=import-outside-toplevel
+
+    with Spinner(cmd, "Running preflight checks", "✓ Preflight checks passed"):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            # The result is cached, so setting up the environment afterwards doesn't probe again
+            discovery = executor.submit(find_management_cluster)
+            futures = {}
+            if user_provided_template:
+                logger.info("Skipped the Azure preflight checks for custom template %s", user_provided_template)
+            else:
+                try:
+                    compute_client = cf_compute_service(cmd.cli_ctx)
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.warning("Skipped the Azure preflight checks: %s", err)
+                else:
+                    futures["VM size and quota"] = executor.submit(
+                        preflight_helpers.run_vm_checks, compute_client, machine_counts, location)
+                    futures["Kubernetes image"] = executor.submit(
+                        preflight_helpers.check_image_sku, compute_client, kubernetes_version, location)
+            problems = preflight_helpers.collect_problems(futures)
             try:
-                run_shell_command(command)
-                break
-            except subprocess.CalledProcessError as err:
-                logger.info(err)
-                time.sleep(delay)
-        else:
-            msg = "Couldn't apply workload cluster manifest after waiting 5 minutes."
-            raise ResourceNotFoundError(msg)
+                discovery.result()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.info("No management cluster found in the current context: %s", err)
+        if problems:
+            msg = "Preflight checks failed:\n" + "\n".join(f"  {problem}" for problem in problems)
+            raise InvalidArgumentValueError(msg)
+
+
+def wait_for_workload_cluster_nodes(cmd, capi_name, windows=False, journal=None):
+    """
+    Finishes setting up an applied workload cluster: writes its kubeconfig, deploys the CNI and
+    waits for its machines and nodes. Steps already done in the journal are skipped.
+    Returns the path of the workload cluster's kubeconfig.
+    """
+    journal = journal or journal_helpers.Journal.disabled()
+    workload_cfg = capi_name + ".kubeconfig"
 
     # Write the kubeconfig for the workload cluster to a file.
     # Retry this operation several times, then give up and just print the command.
-    attempts, delay = 100, 3
-    with Spinner(cmd, "Waiting for access to workload cluster", "✓ Workload cluster is accessible"):
-        for _ in range(attempts):
-            try:
-                kubectl_helpers.get_kubeconfig(capi_name)
-                break
-            except UnclassifiedUserFault:
-                time.sleep(delay)
-        else:
-            msg = f"""\
+    if not journal.done("kubeconfig") or not os.path.isfile(workload_cfg):
+        attempts, delay = 100, 3
+        with Spinner(cmd, "Waiting for access to workload cluster", "✓ Workload cluster is accessible"):
+            for _ in range(attempts):
+                try:
+                    kubectl_helpers.get_kubeconfig(capi_name)
+                    break
+                except UnclassifiedUserFault:
+                    time.sleep(delay)
+            else:
+                msg = f"""\
 Kubeconfig wasn't available after waiting 5 minutes.
 When the cluster is ready, run this command to fetch the kubeconfig:
 clusterctl get kubeconfig {capi_name}
 """
-            raise ResourceNotFoundError(msg)
-
-    workload_cfg = capi_name + ".kubeconfig"
-    logger.warning('✓ Workload access configuration written to "%s"', workload_cfg)
+                raise ResourceNotFoundError(msg)
+        logger.warning('✓ Workload access configuration written to "%s"', workload_cfg)
+        journal.record("kubeconfig", workload_cfg)
 
     # Install CNI
-    calico_manifest = "https://raw.githubusercontent.com/kubernetes-sigs/cluster-api-provider-azure/master/templates/addons/calico.yaml"  # pylint: disable=line-too-long
-    spinner_enter_message = "Deploying Container Network Interface (CNI) support"
-    spinner_exit_message = "✓ Deployed CNI to workload cluster"
-    error_message = "Couldn't install CNI after waiting 5 minutes."
-
-    apply_calico_manifest(cmd, calico_manifest, workload_cfg, spinner_enter_message,
-                          spinner_exit_message, error_message)
+    if not journal.done("cni"):
+        calico_manifest = get_cni_manifest(CALICO_MANIFEST)
+        spinner_enter_message = "Deploying Container Network Interface (CNI) support"
+        spinner_exit_message = "✓ Deployed CNI to workload cluster"
+        error_message = "Couldn't install CNI after waiting 5 minutes."
+        apply_calico_manifest(cmd, calico_manifest, workload_cfg, spinner_enter_message,
+                              spinner_exit_message, error_message)
+        journal.record("cni")
 
-    if windows:
-        calico_manifest = "https://raw.githubusercontent.com/kubernetes-sigs/cluster-api-provider-azure/main/templates/addons/windows/calico/calico.yaml"  # pylint: disable=line-too-long
+    if windows and not journal.done("windows-cni"):
+        calico_manifest = get_cni_manifest(WINDOWS_CALICO_MANIFEST)
         spinner_enter_message = "Deploying Windows Calico support"
         spinner_exit_message = "✓ Deployed Windows Calico support to worload cluster"
         error_message = "Couldn't install Windows Calico support after waiting 5 minutes."
         apply_calico_manifest(cmd, calico_manifest, workload_cfg, spinner_enter_message,
                               spinner_exit_message, error_message)
+        journal.record("windows-cni")
 
     # Wait for all nodes to be ready before returning
-    with Spinner(cmd, "Waiting for workload cluster nodes to be ready", "✓ Workload cluster is ready"):
-        kubectl_helpers.wait_for_nodes(workload_cfg)
+    if not journal.done("nodes"):
+        with Spinner(cmd, "Waiting for workload cluster nodes to be ready", "✓ Workload cluster is ready") as spinner:
+            kubectl_helpers.wait_for_machines(cluster_name=capi_name, progress=spinner.progress)
+            kubectl_helpers.wait_for_nodes(workload_cfg)
+        journal.record("nodes")
+    return workload_cfg
 
-    if pivot:
-        pivot_cluster(cmd, workload_cfg)
-    return show_workload_cluster(cmd, capi_name)
 
+def apply_workload_cluster_manifest(cmd, capi_name, manifest):
+    """
+    Applies the workload cluster manifest. Objects whose digest matches the last successful apply
+    to the same management cluster are skipped, so re-running "az capi create" is nearly free.
+    """
+    management_key = cache_helpers.get_management_cluster_key()
+    applied_digests = cache_helpers.get_applied_manifest_digests(management_key, capi_name)
+    if applied_digests and not kubectl_helpers.cluster_exists(capi_name):
+        applied_digests = {}
+    changed = manifest.changed(applied_digests)
+    if not changed:
+        logger.warning('✓ Workload cluster "%s" is unchanged', capi_name)
+        return
 
-def pivot_cluster(cmd, target_cluster_kubeconfig):
+    # Apply the cluster configuration.
+    begin_msg = f'Creating workload cluster "{capi_name}"'
+    end_msg = f'✓ Created workload cluster "{capi_name}"'
+    if len(changed) < len(manifest):
+        begin_msg = f'Updating {len(changed)} of {len(manifest)} objects of workload cluster "{capi_name}"'
+        end_msg = f'✓ Updated workload cluster "{capi_name}"'
+    with Spinner(cmd, begin_msg, end_msg):
+        applied, failed = kubectl_helpers.apply_objects(changed)
+        if failed:
+            # Record the objects that were applied, so running the command again only sends the rest.
+            applied_digests = dict(applied_digests)
+            applied_digests.update({obj.key: obj.digest for obj in changed if obj.key in applied})
+            cache_helpers.set_applied_manifest_digests(management_key, capi_name, applied_digests)
+            details = "\n".join(f"  {key}: {error}" for key, error in sorted(failed.items()))
+            msg = f"Couldn't apply {len(failed)} of {len(changed)} workload cluster objects after waiting 5 minutes:"
+            raise ResourceNotFoundError(f"{msg}\n{details}")
+    cache_helpers.set_applied_manifest_digests(management_key, capi_name, manifest.digests())
+
+
+def pivot_cluster(cmd, target_cluster_kubeconfig, wait=True):
+    """
+    Moves Cluster API management from the current cluster to the target cluster.
 
+    Provider installation on the target runs concurrently with waiting for the machines on the source,
+    and the move starts once both are done. The target's kubeconfig is merged before the bootstrap
+    cluster is deleted, so the target is usable as soon as the move completes. With wait=False the
+    deletion continues in the background and a Future is returned that the caller must resolve before
+    using the default kubeconfig again, which the deletion rewrites. Until then, read the target's.
+    """
     logger.warning("Starting Pivot Process")
 
-    begin_msg = "Installing Cluster API components in target management cluster"
-    end_msg = "✓ Installed Cluster API components in target management cluster"
-    with Spinner(cmd, begin_msg, end_msg):
-        set_azure_identity_secret_env_vars()
-        _create_azure_identity_secret(cmd, target_cluster_kubeconfig)
-        _install_capi_provider_components(cmd, target_cluster_kubeconfig)
+    # Find the bootstrap cluster before the merge makes the target cluster the current context, and
+    # first of all, so a bootstrap cluster that can't be deleted fails before anything is changed
+    source_context = kubectl_helpers.find_kubectl_current_context()
+    cluster_name = kubectl_helpers.find_cluster_in_current_context()
+    if has_kind_prefix(cluster_name):
+        delete_bootstrap_cluster = (delete_kind_cluster, cmd, cluster_name[5:])
+    else:
+        resource_group = os.environ.get(MANAGEMENT_RG_NAME, None)
+        if not resource_group:
+            raise UnclassifiedUserFault("Could not delete AKS management cluster, resource group missing")
+        delete_bootstrap_cluster = (delete_aks_cluster, cmd, cluster_name, resource_group, source_context)
 
-    with Spinner(cmd, "Waiting for workload cluster machines to be ready", "✓ Workload cluster machines are ready"):
-        kubectl_helpers.wait_for_machines()
+    set_azure_identity_secret_env_vars()
+    # One spinner on this thread reports both, since the progress controller isn't thread-safe
+    begin_msg = "Waiting for workload cluster machines and installing Cluster API components in target cluster"
+    end_msg = "✓ Workload cluster machines are ready and Cluster API components are installed in target cluster"
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        install = executor.submit(_install_target_management_cluster, target_cluster_kubeconfig)
+        with Spinner(cmd, begin_msg, end_msg) as spinner:
+            def progress(machines):
+                components = "installed" if install.done() else "installing"
+                spinner.progress(f"{machines}, Cluster API components {components}")
+
+            kubectl_helpers.wait_for_machines(progress=progress)
+            if not install.done():
+                spinner.progress("machines ready, Cluster API components installing")
+            install.result()
 
     command = ["clusterctl", "move", "--to-kubeconfig", target_cluster_kubeconfig]
     begin_msg = "Moving cluster objects into target cluster"
@@ -550,22 +705,32 @@ def pivot_cluster(cmd, target_cluster_kubeconfig):
     error_msg = "Could not complete clusterctl move action"
     try_command_with_spinner(cmd, command, begin_msg, end_msg, error_msg, True)
 
-    cluster_name = kubectl_helpers.find_cluster_in_current_context()
-    if has_kind_prefix(cluster_name):
-        delete_kind_cluster_from_current_context(cmd)
-    else:
-        resource_group = os.environ.get(MANAGEMENT_RG_NAME, None)
-        if not resource_group:
-            raise UnclassifiedUserFault("Could not delete AKS management cluster, resource group missing")
-        delete_aks_cluster(cmd, cluster_name, resource_group)
-
     # Merge workload cluster kubeconfig and default kubeconfig.
     # To preverse any previous existing contexts
     kubectl_helpers.merge_kubeconfig(target_cluster_kubeconfig)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    deletion = executor.submit(*delete_bootstrap_cluster)
+    executor.shutdown(wait=False)
+    if not wait:
+        deletion.add_done_callback(lambda _: logger.warning("Completed Pivot Process"))
+        return deletion
+    deletion.result()
     logger.warning("Completed Pivot Process")
     return True
 
 
+def _install_target_management_cluster(kubeconfig):
+    """Creates the identity secret and installs the providers in a cluster, without a spinner of its own."""
+    for command, error_msg in ((_azure_identity_secret_command(kubeconfig), "Can't create Cluster Identity Secret"),
+                               (_capi_provider_components_command(kubeconfig),
+                                "Couldn't install CAPI provider components in target cluster")):
+        try:
+            run_shell_command(command)
+        except subprocess.CalledProcessError as err:
+            raise UnclassifiedUserFault(f"{error_msg}\n{err.stdout}") from err
+
+
 def delete_kind_cluster(cmd, name):
     command = ["kind", "delete", "cluster", "--name", name]
     begin_msg = f"Deleting {name} kind cluster"
@@ -574,15 +739,7 @@ def delete_kind_cluster(cmd, name):
     try_command_with_spinner(cmd, command, begin_msg, end_msg, error_msg)
 
 
-def delete_kind_cluster_from_current_context(cmd):
-    cluster_name = kubectl_helpers.find_cluster_in_current_context()
-    # remove prefix
-    if has_kind_prefix(cluster_name):
-        cluster_name = cluster_name[5:]
-    delete_kind_cluster(cmd, cluster_name)
-
-
-def delete_aks_cluster(cmd, name, resource_group):
+def delete_aks_cluster(cmd, name, resource_group, context=None):
     command = ["az", "aks", "delete", "--name", name, "--resource-group", resource_group, "--yes"]
     begin_msg = f"Deleting {name} AKS cluster"
     end_msg = f"✓ Deleted {name} AKS cluster"
@@ -594,10 +751,33 @@ def delete_aks_cluster(cmd, name, resource_group):
     error_msg = "Could not delete resource group"
     try_command_with_spinner(cmd, command, begin_msg, end_msg, error_msg)
     # Need to clean kubeconfig context
-    kubectl_helpers.reset_current_context_and_attributes()
+    if context:
+        kubectl_helpers.delete_context_and_attributes(context)
+    else:
+        kubectl_helpers.reset_current_context_and_attributes()
     return True
 
 
+def get_cni_manifest(addon_path):
+    """
+    Returns a local path to a CNI manifest from the CAPZ addons templates, pinned to the version in
+    "az config set capi.cni_manifests_version=<version>". A copy bundled with the extension is
+    preferred, then one cached in the $HOME/.azure/capi directory. If neither is available,
+    the URL is returned so kubectl fetches it.
+    """
+    version = get_default_cli().config.get("capi", "cni_manifests_version", fallback=CNI_MANIFESTS_VERSION)
+    bundled = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifests", version,
+                           addon_path.replace("/", "-"))
+    if os.path.isfile(bundled):
+        return bundled
+    url = CAPZ_ADDONS_URL.format(version=version, path=addon_path)
+    try:
+        return fetch_cached(url, max_age=CNI_MANIFEST_CACHE_MAX_AGE)
+    except (OSError, ValueError) as err:
+        logger.warning("Couldn't cache %s: %s", url, err)
+        return url
+
+
 def apply_calico_manifest(cmd, calico_manifest, workload_cfg,
                           spinner_enter_message, spinner_exit_message, error_message):
     attempts, delay = 100, 3
@@ -614,26 +794,88 @@ def apply_calico_manifest(cmd, calico_manifest, workload_cfg,
             raise ResourceNotFoundError(error_message)
 
 
-def delete_workload_cluster(cmd, capi_name, resource_group_name=None, yes=False):
+def delete_workload_cluster(cmd, capi_name, resource_group_name=None, no_wait=False, yes=False):
     exit_if_no_management_cluster()
     msg = f'Do you want to delete this Kubernetes cluster "{capi_name}"?'
     command = ["kubectl", "delete", "cluster", capi_name]
+    if no_wait:
+        command.append("--wait=false")
     is_self_managed = is_self_managed_cluster(capi_name)
     if is_self_managed:
         if not resource_group_name:
             resource_group_name = get_azure_resource_group_from_azure_cluster(capi_name)
         msg = f'Do you want to delete the {capi_name} Kubernetes cluster and {resource_group_name} resource group?'
         command = ["az", "group", "delete", "-n", resource_group_name, '-y']
+        if no_wait:
+            command.append("--no-wait")
     if not yes and not prompt_y_n(msg, default="n"):
         return
     begin_msg = "Deleting workload cluster"
     end_msg = "✓ Deleted workload cluster"
+    if no_wait:
+        end_msg = "✓ Requested deletion of workload cluster"
     err_msg = "Couldn't delete workload cluster"
     try_command_with_spinner(cmd, command, begin_msg, end_msg, err_msg)
+    cache_helpers.invalidate_applied_manifest_digests(capi_name)
+    journal_helpers.discard_journal("create", capi_name)
     if is_self_managed:
         kubectl_helpers.reset_current_context_and_attributes()
 
 
+# The arguments are the parameters of "az capi wait"
+def wait_for_workload_cluster(cmd, capi_name, created=False, deleted=False,  # pylint: disable=too-many-arguments
+                              nodes_ready=False, resource_group_name=None, windows=False,
+                              timeout=WORKLOAD_CLUSTER_WAIT_TIMEOUT):
+    """
+    Waits for a workload cluster started with "az capi create --no-wait" or "az capi delete --no-wait".
+    Waiting for the Cluster object uses a watch through "kubectl wait" rather than polling.
+    With nodes_ready, the cluster is also set up like a blocking create, which deploys the CNI.
+    """
+    conditions = [name for name, value in (("--created", created), ("--deleted", deleted),
+                                           ("--nodes-ready", nodes_ready)) if value]
+    if not conditions:
+        raise RequiredArgumentMissingError('One of "--created", "--deleted" or "--nodes-ready" is required')
+    if len(conditions) > 1:
+        raise MutuallyExclusiveArgumentError(f"Only one of {', '.join(conditions)} can be used")
+    if deleted:
+        wait_for_workload_cluster_deletion(cmd, capi_name, resource_group_name, timeout)
+        return
+
+    exit_if_no_management_cluster()
+    begin_msg = f'Waiting for workload cluster "{capi_name}" to be created'
+    end_msg = f'✓ Workload cluster "{capi_name}" is created'
+    with Spinner(cmd, begin_msg, end_msg):
+        kubectl_helpers.wait_for_condition(f"cluster/{capi_name}", "condition=Ready", timeout)
+    if nodes_ready:
+        wait_for_workload_cluster_nodes(cmd, capi_name, windows)
+
+
+def wait_for_workload_cluster_deletion(cmd, capi_name, resource_group_name=None,
+                                       timeout=WORKLOAD_CLUSTER_WAIT_TIMEOUT):
+    """
+    Waits for the Cluster object to be deleted, or for the resource group if one is given. A self-managed
+    cluster is deleted with its resource group and takes its API server with it, so it is detected from
+    the local kubeconfig files alone and its resource group must be given.
+    """
+    if not resource_group_name:
+        if is_self_managed_cluster(capi_name):
+            msg = (f'Workload cluster "{capi_name}" manages itself, so it can\'t report its own deletion. '
+                   'Use --resource-group to wait for its resource group to be deleted.')
+            raise RequiredArgumentMissingError(msg)
+        exit_if_no_management_cluster()
+    begin_msg = f'Waiting for workload cluster "{capi_name}" to be deleted'
+    end_msg = f'✓ Workload cluster "{capi_name}" is deleted'
+    with Spinner(cmd, begin_msg, end_msg):
+        if resource_group_name:
+            command = ["az", "group", "wait", "--deleted", "--name", resource_group_name, "--timeout", str(timeout)]
+            try:
+                run_shell_command(command)
+            except subprocess.CalledProcessError as err:
+                raise ResourceNotFoundError(f'Resource group "{resource_group_name}" still exists') from err
+        elif kubectl_helpers.cluster_exists(capi_name):
+            kubectl_helpers.wait_for_condition(f"cluster/{capi_name}", "delete", timeout)
+
+
 def get_azure_resource_group_from_azure_cluster(cluster_name, kubeconfig=None):
     output = kubectl_helpers.get_azure_cluster(cluster_name, kubeconfig)
     output = json.loads(output)
@@ -641,42 +883,209 @@ def get_azure_resource_group_from_azure_cluster(cluster_name, kubeconfig=None):
 
 
 def is_self_managed_cluster(cluster_name):
-    management_cluster_ports = kubectl_helpers.get_ports_cluster()
-    workload_cluster_ports = kubectl_helpers.get_ports_cluster(f"{cluster_name}.kubeconfig")
-    return management_cluster_ports == workload_cluster_ports
-
-
-def list_workload_clusters(cmd):  # pylint: disable=unused-argument
+    """
+    Returns True if the workload cluster is also the current management cluster, by comparing
+    the API server and CA data in both kubeconfigs. The API servers aren't contacted.
+    """
+    workload_cfg = f"{cluster_name}.kubeconfig"
+    if not os.path.isfile(workload_cfg):
+        logger.info('No kubeconfig found at "%s", assuming cluster is not self-managed', workload_cfg)
+        return False
+    management_identity = get_cluster_identity()
+    workload_identity = get_cluster_identity(workload_cfg)
+    return is_same_cluster(management_identity, workload_identity)
+
+
+def list_workload_clusters(cmd, contexts=None, all_contexts=False, timeout=LIST_CONTEXT_TIMEOUT, watch=False):
+    if watch:
+        if contexts or all_contexts:
+            raise MutuallyExclusiveArgumentError('"--watch" can\'t be used with "--contexts" or "--all-contexts"')
+        return watch_workload_clusters(cmd)
+    if contexts or all_contexts:
+        return list_workload_clusters_in_contexts(cmd, contexts, all_contexts, timeout)
     exit_if_no_management_cluster()
     command = ["kubectl", "get", "clusters", "-o", "json"]
     try:
         output = run_shell_command(command)
     except subprocess.CalledProcessError as err:
         raise UnclassifiedUserFault("Couldn't list workload clusters") from err
-    if tab_separated_output(cmd):
+    projection = output_projection(cmd)
+    if projection == "tsv":
         return output_list_for_tsv(output)
+    if projection == "table":
+        return output_list_for_table(output)
     return json.loads(output)
 
 
-def tab_separated_output(cmd):
-    """Returns True if "--output tsv" was specified without a "--query" argument."""
+def list_workload_clusters_in_contexts(cmd, contexts=None, all_contexts=False, timeout=LIST_CONTEXT_TIMEOUT):
+    """
+    Lists workload clusters across several management clusters, one kubectl context each, queried
+    concurrently with a timeout per context. Each cluster gets a "context" field. Contexts that
+    can't be listed are logged and returned in "errors" instead of failing the command.
+    """
+    if contexts and all_contexts:
+        raise MutuallyExclusiveArgumentError('Only one of "--contexts" or "--all-contexts" can be used')
+    if all_contexts:
+        contexts = list(load_kubeconfig().entries["contexts"])
+    else:
+        contexts = list(dict.fromkeys(c.strip() for c in ",".join(contexts).split(",") if c.strip()))
+    if not contexts:
+        raise InvalidArgumentValueError("No kubectl contexts to list workload clusters from")
+
+    projection = output_projection(cmd)
+    result = {"apiVersion": "v1", "kind": "List", "contexts": contexts, "items": [], "errors": []}
+    for context, listed in kubectl_helpers.list_in_contexts("clusters", contexts, timeout).items():
+        if isinstance(listed, str):
+            logger.warning('Couldn\'t list workload clusters in context "%s": %s', context, listed)
+            result["errors"].append({"context": context, "error": listed})
+            continue
+        for cluster in listed:
+            cluster["context"] = context
+            result["items"].append(project_context_cluster(cluster, projection))
+    if projection == "tsv":
+        return result["items"]
+    return result
+
+
+def watch_workload_clusters(cmd):
+    """
+    Prints a row for each workload cluster, then follows a watch stream and prints a cluster's row
+    again only when its phase or ready conditions change, until interrupted. Only the last row of
+    each cluster is kept.
+    """
+    exit_if_no_management_cluster()
+    output = cmd.cli_ctx.invocation.data.get("output") or "json"
+    if output == "table":
+        print(format_watch_header(), flush=True)
+    rows = {}
+    try:
+        for event_type, cluster in kubectl_helpers.follow_resources("clusters"):
+            row = cluster_watch_row(cluster)
+            key = (row["namespace"], row["name"])
+            if event_type == "DELETED":
+                row = rows.pop(key, None)
+                if row:
+                    print(format_watch_row(dict(row, phase="Deleted"), output), flush=True)
+            elif rows.get(key) != row:
+                rows[key] = row
+                print(format_watch_row(row, output), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+def output_projection(cmd):
+    """
+    Returns "tsv" or "table" if that output format was specified without a "--query" argument,
+    meaning only the fields shown by that format need to be kept. Otherwise returns None.
+    """
     data = cmd.cli_ctx.invocation.data
-    return "query" not in data and data.get("output") == "tsv"
+    if "query" in data:
+        return None
+    output = data.get("output")
+    return output if output in ("tsv", "table") else None
 
 
-def show_workload_cluster(cmd, capi_name):  # pylint: disable=unused-argument
-    exit_if_no_management_cluster()
-    # TODO: --output=table could print the output of `clusterctl describe` directly.
+def show_workload_cluster(cmd, capi_name=None, names_from_file=None, details=False):
+    names = get_requested_cluster_names(capi_name, names_from_file)
+    if details:
+        return show_workload_cluster_details(cmd, names, single=len(names) == 1 and not names_from_file)
+    if len(names) > 1 or names_from_file:
+        return show_workload_clusters(cmd, names)
+    return get_workload_cluster(cmd, names[0])
+
+
+def get_workload_cluster(cmd, capi_name, kubeconfig=None):
+    """
+    Returns a workload cluster from the management cluster of the current context, or from the
+    management cluster of an explicit kubeconfig, which isn't probed first.
+    """
+    if not kubeconfig:
+        exit_if_no_management_cluster()
     command = ["kubectl", "get", "cluster", capi_name, "--output", "json"]
+    command += kubectl_helpers.add_kubeconfig_to_command(kubeconfig)
     try:
         output = run_shell_command(command)
     except subprocess.CalledProcessError as err:
         raise UnclassifiedUserFault(f"Couldn't get the workload cluster {capi_name}") from err
-    if tab_separated_output(cmd):
+    projection = output_projection(cmd)
+    if projection == "tsv":
         return output_for_tsv(output)
+    if projection == "table":
+        return output_for_table(output)
     return json.loads(output)
 
 
+def show_workload_clusters(cmd, names):
+    """
+    Returns the requested clusters in input order, fetched with a single list call.
+    Names that don't match a cluster are reported as entries with a "NotFound" error, except in
+    tab-separated output, which has no error column, so they are only reported as warnings.
+    """
+    exit_if_no_management_cluster()
+    command = ["kubectl", "get", "clusters", "--output", "json"]
+    try:
+        output = run_shell_command(command)
+    except subprocess.CalledProcessError as err:
+        raise UnclassifiedUserFault("Couldn't list workload clusters") from err
+    requested = set(names)
+    clusters = {}
+    for cluster in json.loads(output).get("items", []):
+        name = cluster["metadata"]["name"]
+        if name in requested:
+            clusters[name] = cluster
+    projection = output_projection(cmd)
+    result = []
+    for name in names:
+        cluster = clusters.get(name)
+        if cluster is None:
+            msg = f'Workload cluster "{name}" was not found'
+            logger.warning(msg)
+            if projection == "tsv":
+                continue
+            cluster = {"metadata": {"name": name}, "error": {"code": "NotFound", "message": msg}}
+        result.append(project_cluster(cluster, projection))
+    return result
+
+
+def show_workload_cluster_details(cmd, names, single=True):
+    """
+    Returns a summary of each requested cluster with its control plane, node pools and machines,
+    like "clusterctl describe cluster". Each kind of object is fetched with one list call, the calls
+    run concurrently, and the objects are joined in memory.
+    """
+    exit_if_no_management_cluster()
+    details = describe_helpers.describe_workload_clusters()
+    if details is None:
+        raise UnclassifiedUserFault("Couldn't list workload clusters")
+    found = {cluster["name"]: cluster for cluster in details}
+    missing = [name for name in names if name not in found]
+    if single and missing:
+        raise ResourceNotFoundError(f'Workload cluster "{missing[0]}" was not found')
+    for name in missing:
+        logger.warning('Workload cluster "%s" was not found', name)
+    details = [found[name] for name in names if name in found]
+    if output_projection(cmd) == "tsv":
+        return output_cluster_details_table(details)
+    return details[0] if single else details
+
+
+def get_requested_cluster_names(capi_name=None, names_from_file=None):
+    """Returns the cluster names given by --name and --names-from-file, in order."""
+    if isinstance(capi_name, str):
+        capi_name = [capi_name]
+    names = list(capi_name or [])
+    if names_from_file:
+        try:
+            with open(names_from_file, encoding="utf-8") as names_file:
+                lines = [line.strip() for line in names_file]
+        except OSError as err:
+            raise InvalidArgumentValueError(f'Could not read cluster names from "{names_from_file}"') from err
+        names += [line for line in lines if line and not line.startswith("#")]
+    if not names:
+        raise RequiredArgumentMissingError("Specify workload cluster names with --name or --names-from-file.")
+    return names
+
+
 def update_workload_cluster(cmd, capi_name):
     raise NotImplementedError
 
@@ -702,9 +1111,13 @@ def check_prereqs(cmd, install=False):
     check_enviroment_variables()
 
 
-def check_enviroment_variables():
+def find_missing_environment_variables():
     required_env_vars = ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_SUBSCRIPTION_ID", "AZURE_TENANT_ID"]
-    missing_env_vars = [v for v in required_env_vars if not check_environment_var(v)]
+    return [v for v in required_env_vars if not check_environment_var(v)]
+
+
+def check_enviroment_variables():
+    missing_env_vars = find_missing_environment_variables()
     missing_vars_len = len(missing_env_vars)
     if missing_vars_len != 0:
         err_msg = f"Required environment variable {missing_env_vars[0]} was not found."
@@ -758,6 +1171,23 @@ def management_cluster_components_missing_matching_expressions(output):
 
 
 def find_management_cluster():
+    """
+    Verifies that the current cluster has all CAPI/CAPZ components running. A successful check
+    is cached per kubectl context and API server, so back-to-back commands skip the probe.
+    """
+    cache_key = cache_helpers.get_management_cluster_key()
+    if cache_helpers.is_management_cluster_verified(cache_key):
+        return
+    try:
+        check_management_cluster_components()
+    except (ResourceNotFoundError, subprocess.CalledProcessError):
+        if cache_key:
+            cache_helpers.invalidate_management_cluster(cache_key)
+        raise
+    cache_helpers.set_management_cluster_verified(cache_key)
+
+
+def check_management_cluster_components():
     kubectl_helpers.find_default_cluster()
     components = [
         {
@@ -13,9 +13,8 @@ from azure.cli.core.azclierror import FileOperationError
 from azure.cli.core.azclierror import InvalidArgumentValueError
 from azure.cli.core.azclierror import ValidationError, UnclassifiedUserFault
 from knack.prompting import prompt_y_n
-from six.moves.urllib.request import urlopen  # pylint: disable=import-error
 
-from azext_capi.helpers.network import ssl_context, urlretrieve
+from azext_capi.helpers.network import urlopen, urlretrieve
 from azext_capi._params import _get_default_install_location
 from azext_capi.helpers.logger import logger
 from azext_capi.helpers.spinner import Spinner
@@ -141,7 +140,7 @@ def install_kubectl(cmd, client_version="latest", install_location=None, source_
             source_url = "https://mirror.azure.cn/kubernetes/kubectl"
 
     if client_version == "latest":
-        with urlopen(source_url + "/stable.txt", context=ssl_context()) as f:
+        with urlopen(source_url + "/stable.txt") as f:
             client_version = f.read().decode("utf-8").strip()
     else:
         client_version = f"v{client_version}"
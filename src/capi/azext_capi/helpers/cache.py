@@ -0,0 +1,164 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module contains helper functions to cache data in the az CLI configuration directory.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import yaml
+from azure.cli.core import get_default_cli
+from azure.cli.core.api import get_config_dir
+
+from .kubeconfig import load_kubeconfig
+from .logger import logger
+
+MANAGEMENT_CACHE_FILE = "management_clusters.json"
+MANIFEST_DIGESTS_FILE = "manifest_digests.json"
+DEFAULT_MANAGEMENT_CACHE_TTL = 300
+DEFAULT_URL_CACHE_MAX_AGE = 0
+
+
+def get_cache_path(*parts):
+    """Returns a path inside the $HOME/.azure/capi directory, creating parent directories as needed."""
+    path = os.path.join(get_config_dir(), "capi", *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def load_json_cache(path):
+    """Returns the JSON object stored at path, or an empty dict if it is missing or unreadable."""
+    try:
+        with open(path, encoding="utf-8") as cache_file:
+            data = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_json_cache(path, data):
+    """Writes data as JSON to path, replacing any previous contents atomically."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as cache_file:
+        json.dump(data, cache_file)
+    os.replace(tmp_path, path)
+
+
+def get_management_cache_ttl():
+    """
+    Returns how many seconds a verified management cluster is trusted without probing it again.
+    Set with "az config set capi.management_cache_ttl=<seconds>" or AZURE_CAPI_MANAGEMENT_CACHE_TTL.
+    """
+    config = get_default_cli().config
+    try:
+        return config.getint("capi", "management_cache_ttl", fallback=DEFAULT_MANAGEMENT_CACHE_TTL)
+    except ValueError:
+        return DEFAULT_MANAGEMENT_CACHE_TTL
+
+
+def get_url_cache_max_age():
+    """
+    Returns how many seconds a downloaded --template is reused before it is revalidated.
+    Set with "az config set capi.url_cache_max_age=<seconds>" or AZURE_CAPI_URL_CACHE_MAX_AGE.
+    """
+    config = get_default_cli().config
+    try:
+        return config.getint("capi", "url_cache_max_age", fallback=DEFAULT_URL_CACHE_MAX_AGE)
+    except ValueError:
+        return DEFAULT_URL_CACHE_MAX_AGE
+
+
+def get_management_cluster_key():
+    """
+    Returns a key identifying the management cluster of the current kubectl context by
+    context name and API server URL, or None if there is no usable current context.
+    """
+    try:
+        kubeconfig = load_kubeconfig()
+    except (OSError, yaml.YAMLError):
+        return None
+    context = kubeconfig.current_context
+    cluster = kubeconfig.cluster(kubeconfig.find_attribute_in_context(context, "cluster"))
+    server = cluster.get("server") if cluster else None
+    if not server:
+        return None
+    return hashlib.sha256(f"{context}\n{server}".encode("utf-8")).hexdigest()
+
+
+def is_management_cluster_verified(key):
+    """Returns True if the management cluster identified by key was verified within the TTL."""
+    if not key:
+        return False
+    entry = load_json_cache(get_cache_path(MANAGEMENT_CACHE_FILE)).get(key)
+    if entry and entry.get("expires", 0) > time.time():
+        logger.info("Using cached verification of management cluster")
+        return True
+    return False
+
+
+def set_management_cluster_verified(key):
+    """Records that the management cluster identified by key has all required components."""
+    ttl = get_management_cache_ttl()
+    if not key or ttl <= 0:
+        return
+    path = get_cache_path(MANAGEMENT_CACHE_FILE)
+    entries = load_json_cache(path)
+    now = time.time()
+    entries = {k: v for k, v in entries.items() if v.get("expires", 0) > now}
+    entries[key] = {"expires": now + ttl}
+    save_json_cache(path, entries)
+
+
+def invalidate_management_cluster(key=None):
+    """Forgets the verification of the management cluster identified by key, or of all clusters."""
+    path = get_cache_path(MANAGEMENT_CACHE_FILE)
+    entries = load_json_cache(path)
+    if key is None and entries:
+        entries = {}
+    elif key is not None and key in entries:
+        del entries[key]
+    else:
+        return
+    save_json_cache(path, entries)
+
+
+def get_applied_manifest_digests(management_key, cluster_name):
+    """
+    Returns the object digests of the manifest last applied for a workload cluster
+    through the management cluster identified by management_key.
+    """
+    if not management_key:
+        return {}
+    entries = load_json_cache(get_cache_path(MANIFEST_DIGESTS_FILE))
+    return entries.get(management_key, {}).get(cluster_name, {})
+
+
+def set_applied_manifest_digests(management_key, cluster_name, digests):
+    """Records the object digests of a manifest that was applied successfully."""
+    if not management_key:
+        return
+    path = get_cache_path(MANIFEST_DIGESTS_FILE)
+    entries = load_json_cache(path)
+    entries.setdefault(management_key, {})[cluster_name] = digests
+    save_json_cache(path, entries)
+
+
+def invalidate_applied_manifest_digests(cluster_name=None):
+    """Forgets the applied manifest digests of a workload cluster, or of all clusters."""
+    path = get_cache_path(MANIFEST_DIGESTS_FILE)
+    entries = load_json_cache(path)
+    if cluster_name is None:
+        changed = bool(entries)
+        entries = {}
+    else:
+        changed = False
+        for clusters in entries.values():
+            changed = clusters.pop(cluster_name, None) is not None or changed
+    if changed:
+        save_json_cache(path, entries)
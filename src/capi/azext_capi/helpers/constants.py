@@ -5,3 +5,27 @@
 
 MANAGEMENT_RG_NAME = "MANAGEMENT_RG_NAME"
 KUBECONFIG = "KUBECONFIG"
+
+# Calico CNI manifests from the CAPZ addons templates, pinned to a CAPZ release
+CAPZ_ADDONS_URL = "https://raw.githubusercontent.com/kubernetes-sigs/cluster-api-provider-azure/{version}/templates/addons/{path}"  # pylint: disable=line-too-long
+CNI_MANIFESTS_VERSION = "v1.4.0"
+CALICO_MANIFEST = "calico.yaml"
+WINDOWS_CALICO_MANIFEST = "windows/calico/calico.yaml"
+CNI_MANIFEST_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Machines get a base deadline to become Running, plus time for each machine
+MACHINE_READY_TIMEOUT = 5 * 60
+MACHINE_READY_TIMEOUT_PER_MACHINE = 30
+
+# How long "az capi wait" waits for a workload cluster by default
+WORKLOAD_CLUSTER_WAIT_TIMEOUT = 60 * 60
+
+# How long "az capi list --contexts" waits for each management cluster by default
+LIST_CONTEXT_TIMEOUT = 30
+
+# "az capi list --watch" reconnects after a failed watch with a growing delay, up to this many times in a row
+WATCH_MAX_RETRIES = 5
+WATCH_RETRY_MAX_DELAY = 30
+
+# Seconds "az capi list --watch" waits before reconnecting after a watch ends cleanly
+WATCH_RECONNECT_MIN_DELAY = 1
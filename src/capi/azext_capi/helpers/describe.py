@@ -0,0 +1,111 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module joins Cluster API objects into a summary of each workload cluster, similar to
+`clusterctl describe cluster`, from lists fetched once instead of one lookup per object.
+"""
+
+from .generic import condition_status
+from .kubectl import list_resources, machine_owner
+
+CLUSTER_NAME_LABEL = "cluster.x-k8s.io/cluster-name"
+
+# The resources listed to describe workload clusters, with the kinds of their objects
+CONTROL_PLANE_RESOURCES = {"kubeadmcontrolplanes": "KubeadmControlPlane"}
+NODE_POOL_RESOURCES = {"machinedeployments": "MachineDeployment", "machinepools": "MachinePool"}
+
+
+def cluster_name_of(obj):
+    """Returns the name of the workload cluster an object belongs to, from its label or spec."""
+    labels = obj.get("metadata", {}).get("labels") or {}
+    return labels.get(CLUSTER_NAME_LABEL) or (obj.get("spec") or {}).get("clusterName")
+
+
+def index_by_cluster(objects):
+    """Returns a dict of workload cluster name to the objects that belong to it."""
+    index = {}
+    for obj in objects:
+        index.setdefault(cluster_name_of(obj), []).append(obj)
+    return index
+
+
+def describe_machine(machine):
+    """Summarizes a machine with its phase, readiness and node."""
+    status = machine.get("status") or {}
+    return {
+        "kind": "Machine",
+        "name": machine["metadata"]["name"],
+        "phase": status.get("phase"),
+        "ready": condition_status(machine),
+        "nodeName": (status.get("nodeRef") or {}).get("name"),
+        "version": (machine.get("spec") or {}).get("version"),
+    }
+
+
+def describe_machine_owner(obj, machines_by_owner):
+    """Summarizes a control plane or node pool with its replica counts and machines."""
+    kind, name = obj.get("kind"), obj["metadata"]["name"]
+    spec, status = obj.get("spec") or {}, obj.get("status") or {}
+    machines = machines_by_owner.get(f"{kind}/{name}", [])
+    return {
+        "kind": kind,
+        "name": name,
+        "phase": status.get("phase"),
+        "ready": condition_status(obj),
+        "replicas": spec.get("replicas"),
+        "readyReplicas": status.get("readyReplicas") or 0,
+        "machines": [describe_machine(m) for m in sorted(machines, key=lambda m: m["metadata"]["name"])],
+    }
+
+
+def describe_clusters(clusters, control_planes, node_pools, machines):
+    """
+    Returns a summary of each cluster with its control plane, node pools and their machines.
+    The other objects are joined to their cluster through an index on the cluster-name label.
+    """
+    control_planes_by_cluster = index_by_cluster(control_planes)
+    node_pools_by_cluster = index_by_cluster(node_pools)
+    machines_by_cluster = index_by_cluster(machines)
+    result = []
+    for cluster in clusters:
+        name = cluster["metadata"]["name"]
+        machines_by_owner = {}
+        for machine in machines_by_cluster.get(name, []):
+            machines_by_owner.setdefault(machine_owner(machine), []).append(machine)
+        control_plane_ref = (cluster.get("spec") or {}).get("controlPlaneRef") or {}
+        control_plane = None
+        for candidate in control_planes_by_cluster.get(name, []) + control_planes_by_cluster.get(None, []):
+            if candidate["metadata"]["name"] == control_plane_ref.get("name"):
+                control_plane = describe_machine_owner(candidate, machines_by_owner)
+                break
+        pools = sorted(node_pools_by_cluster.get(name, []), key=lambda p: (p.get("kind"), p["metadata"]["name"]))
+        result.append({
+            "kind": "Cluster",
+            "name": name,
+            "namespace": cluster["metadata"].get("namespace"),
+            "phase": (cluster.get("status") or {}).get("phase"),
+            "ready": condition_status(cluster),
+            "controlPlane": control_plane,
+            "nodePools": [describe_machine_owner(pool, machines_by_owner) for pool in pools],
+        })
+    return result
+
+
+def describe_workload_clusters(kubeconfig=None):
+    """
+    Returns a summary of every workload cluster of a management cluster, or None if the clusters
+    couldn't be listed. Each kind of object is fetched with one list call, and the calls run concurrently.
+    """
+    resource_types = ["clusters", "machines"] + list(CONTROL_PLANE_RESOURCES) + list(NODE_POOL_RESOURCES)
+    objects = list_resources(resource_types, kubeconfig)
+    if objects["clusters"] is None:
+        return None
+
+    def objects_of(resources):
+        return [obj for resource_type in resources for obj in objects[resource_type] or []]
+
+    return describe_clusters(objects["clusters"], objects_of(CONTROL_PLANE_RESOURCES),
+                             objects_of(NODE_POOL_RESOURCES), objects["machines"] or [])
@@ -0,0 +1,143 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module substitutes variables in clusterctl-style templates in-process, like "clusterctl generate yaml".
+"""
+
+import os
+import re
+from collections import namedtuple
+
+import yaml
+
+# The start of ${VAR}, ${VAR:=default}, ${VAR:-default}, ${VAR=default}, ${VAR-default} and $VAR.
+# The end of a braced reference is found by matching braces, so defaults can contain references.
+REFERENCE_START = re.compile(
+    r"\$\{\s*(?P<name>[A-Za-z_][A-Za-z0-9_]*)\s*(?P<operator>:?[=-])?"
+    r"|\$(?P<bare_name>[A-Za-z_][A-Za-z0-9_]*)"
+)
+
+Reference = namedtuple("Reference", ["start", "end", "name", "operator", "default"])
+
+
+def _find_closing_brace(template, pos):
+    """Returns the index of the brace that closes a reference whose default starts at pos, or -1."""
+    depth = 1
+    while pos < len(template):
+        if template.startswith("${", pos):
+            depth += 1
+            pos += 2
+            continue
+        if template[pos] == "}":
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    return -1
+
+
+def _references(template):
+    """Yields the top-level variable references of a template. Unclosed references are left as text."""
+    pos = 0
+    while True:
+        match = REFERENCE_START.search(template, pos)
+        if match is None:
+            return
+        if match.group("bare_name"):
+            yield Reference(match.start(), match.end(), match.group("bare_name"), None, None)
+            pos = match.end()
+            continue
+        if match.group("operator") is None:
+            end = match.end() if template.startswith("}", match.end()) else -1
+        else:
+            end = _find_closing_brace(template, match.end())
+        if end == -1:
+            pos = match.start() + 1
+            continue
+        default = template[match.end():end] if match.group("operator") else None
+        yield Reference(match.start(), end + 1, match.group("name"), match.group("operator"), default)
+        pos = end + 1
+
+
+def _uses_default(reference, variables):
+    """Returns True if a reference resolves to its default instead of the variable's value."""
+    if reference.operator is None:
+        return False
+    value = variables.get(reference.name)
+    return value is None or (reference.operator.startswith(":") and value == "")
+
+
+def get_variables(template):
+    """Returns the names of all variables referenced by a template, in order of first use."""
+    names = {}
+    for reference in _references(template):
+        names.setdefault(reference.name, None)
+        for name in get_variables(reference.default or ""):
+            names.setdefault(name, None)
+    return list(names)
+
+
+def find_missing_variables(template, variables):
+    """Returns the sorted names of variables the template references without a value or default."""
+    missing = set()
+    for reference in _references(template):
+        if _uses_default(reference, variables):
+            missing.update(find_missing_variables(reference.default, variables))
+        elif variables.get(reference.name) is None:
+            missing.add(reference.name)
+    return sorted(missing)
+
+
+def envsubst(template, variables):
+    """
+    Returns the template with every variable reference replaced by its value from the variables
+    dict or its default, which may itself contain references. References without either are
+    replaced with an empty string, so callers should check find_missing_variables() first.
+    """
+    parts, pos = [], 0
+    for reference in _references(template):
+        parts.append(template[pos:reference.start])
+        if _uses_default(reference, variables):
+            parts.append(envsubst(reference.default, variables))
+        else:
+            parts.append(variables.get(reference.name) or "")
+        pos = reference.end
+    parts.append(template[pos:])
+    return "".join(parts)
+
+
+def get_clusterctl_config_path():
+    """
+    Returns the path of clusterctl's configuration file: $XDG_CONFIG_HOME/cluster-api/clusterctl.yaml,
+    or the legacy $HOME/.cluster-api/clusterctl.yaml if that exists instead.
+    """
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    path = os.path.join(config_home, "cluster-api", "clusterctl.yaml")
+    legacy_path = os.path.join(os.path.expanduser("~"), ".cluster-api", "clusterctl.yaml")
+    if not os.path.exists(path) and os.path.exists(legacy_path):
+        return legacy_path
+    return path
+
+
+def load_clusterctl_variables(path=None):
+    """
+    Returns the variables defined in clusterctl's configuration file, which "clusterctl generate yaml"
+    uses when they aren't set in the environment. Settings that aren't scalars, like "providers",
+    are skipped. Returns an empty dict if the file doesn't exist.
+    """
+    path = path or get_clusterctl_config_path()
+    try:
+        with open(path, encoding="utf-8") as config_file:
+            config = yaml.safe_load(config_file) or {}
+    except FileNotFoundError:
+        return {}
+    variables = {}
+    for name, value in config.items() if isinstance(config, dict) else []:
+        if isinstance(value, bool):
+            variables[str(name)] = str(value).lower()
+        elif isinstance(value, (str, int, float)):
+            variables[str(name)] = str(value)
+    return variables
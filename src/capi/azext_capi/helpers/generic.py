@@ -18,3 +18,11 @@ def has_kind_prefix(inpt_str):
 def match_output(output, regexp=None):
     """Returns regex search result against given parameter"""
     return re.search(regexp, output) if regexp is not None else None
+
+
+def condition_status(obj, condition_type="Ready"):
+    """Returns the status of a condition, "True", "False" or "Unknown", or None if it isn't reported."""
+    for condition in (obj.get("status") or {}).get("conditions") or []:
+        if condition.get("type") == condition_type:
+            return condition.get("status")
+    return None
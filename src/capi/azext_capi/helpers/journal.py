@@ -0,0 +1,106 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module records the completed steps of long-running operations, so they can be resumed.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from .cache import get_cache_path, load_json_cache, save_json_cache
+from .logger import logger
+
+JOURNALS_DIR = "journals"
+
+
+def args_digest(args):
+    """Returns a digest of the arguments of an operation, to tell if a journal belongs to them."""
+    text = json.dumps(args, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_journal_path(operation, cluster_name):
+    """Returns the path of the journal of an operation on a cluster."""
+    return get_cache_path(JOURNALS_DIR, f"{operation}-{cluster_name}.json")
+
+
+def discard_journal(operation, cluster_name):
+    """Forgets the completed steps of an operation on a cluster, e.g. after the cluster is deleted."""
+    Journal(get_journal_path(operation, cluster_name)).discard()
+
+
+class Journal():
+    """
+    The steps of one operation on one cluster that have completed, and their outputs. Each step is
+    written to $HOME/.azure/capi/journals as soon as it completes. A journal without a path, such as
+    Journal.disabled(), is kept in memory only.
+
+    Used as a context manager, the journal is discarded when the operation completes. If it fails,
+    the completed steps are kept and a hint to resume is logged.
+    """
+
+    def __init__(self, path=None, args=None, resume_hint=None):
+        self.path = path
+        self.digest = args_digest(args) if args is not None else None
+        self.resume_hint = resume_hint
+        self.steps = {}
+
+    @classmethod
+    def for_operation(cls, operation, cluster_name, args, resume=False, resume_hint=None):
+        """
+        Returns the journal of an operation on a cluster. With resume, steps completed by an earlier
+        run with the same args are kept, otherwise the journal starts empty.
+        """
+        journal = cls(get_journal_path(operation, cluster_name), args, resume_hint)
+        if not resume:
+            journal.discard()
+            return journal
+        data = load_json_cache(journal.path)
+        if not data.get("steps"):
+            logger.warning("Nothing to resume, starting from the beginning")
+        elif data.get("args") != journal.digest:
+            logger.warning("The arguments changed since the last run, starting from the beginning")
+            journal.discard()
+        else:
+            journal.steps = data["steps"]
+            logger.warning("Resuming after %s", ", ".join(journal.steps))
+        return journal
+
+    @classmethod
+    def disabled(cls):
+        """Returns a journal that isn't saved, for callers that don't resume."""
+        return cls()
+
+    def done(self, step):
+        """Returns True if the step completed in this run or in the run being resumed."""
+        return step in self.steps
+
+    def output(self, step, default=None):
+        """Returns the output recorded for a completed step."""
+        return self.steps.get(step, {}).get("output", default)
+
+    def record(self, step, output=None):
+        """Records that a step completed, with a JSON-serializable output."""
+        self.steps[step] = {"output": output, "time": time.time()}
+        if self.path:
+            save_json_cache(self.path, {"args": self.digest, "steps": self.steps})
+
+    def discard(self):
+        """Forgets every step."""
+        self.steps = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        if _type is None:
+            self.discard()
+        elif self.steps and self.resume_hint:
+            logger.warning(self.resume_hint)
@@ -0,0 +1,287 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module reads and edits kubeconfig files in-process, following the merge rules of kubectl.
+"""
+
+import base64
+import os
+from urllib.parse import urlparse
+
+import yaml
+
+from .constants import KUBECONFIG
+from .os import file_lock, write_to_file
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# Maps each kubeconfig section to the key that holds an entry's body, e.g. {"name": ..., "cluster": {...}}
+SECTIONS = {"clusters": "cluster", "contexts": "context", "users": "user"}
+
+# Fields that reference files, and the fields that hold their contents inline after flattening
+FILE_REFERENCES = {
+    "clusters": {"certificate-authority": "certificate-authority-data"},
+    "users": {"client-certificate": "client-certificate-data", "client-key": "client-key-data"},
+}
+
+_loaded = {}
+_identities = {}
+
+
+def get_default_kubeconfig_path():
+    """Returns the path of the default kubeconfig file, $HOME/.kube/config"""
+    return os.path.join(os.path.expanduser("~"), ".kube", "config")
+
+
+def get_kubeconfig_paths(kubeconfig=None):
+    """Returns the kubeconfig file chain used by kubectl, in order of precedence."""
+    if kubeconfig:
+        return [kubeconfig]
+    env_value = os.environ.get(KUBECONFIG)
+    if not env_value:
+        return [get_default_kubeconfig_path()]
+    paths = []
+    for path in env_value.split(os.pathsep):
+        if path and path not in paths:
+            paths.append(path)
+    return paths
+
+
+class KubeConfig():  # pylint: disable=too-many-instance-attributes
+    """
+    The merged view of a kubeconfig file chain. Clusters, contexts and users are indexed by name,
+    and the first file that defines a name or sets current-context wins, as with kubectl.
+    Mutations update the merged view and are recorded for the file that defined each entry, then
+    replayed on that file by save().
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.current_context = None
+        self.preferences = {}
+        self.extensions = {}
+        self.entries = {section: {} for section in SECTIONS}
+        self._sources = {section: {} for section in SECTIONS}
+        self._current_context_source = None
+        self._changes = {}
+        for path in paths:
+            document = read_kubeconfig_file(path)
+            if document is not None:
+                self._merge(path, document)
+
+    def _merge(self, path, document):
+        if self._current_context_source is None and document.get("current-context"):
+            self.current_context = document["current-context"]
+            self._current_context_source = path
+        for key, value in (document.get("preferences") or {}).items():
+            self.preferences.setdefault(key, value)
+        for extension in document.get("extensions") or []:
+            if extension.get("name") is not None:
+                self.extensions.setdefault(extension["name"], extension.get("extension"))
+        for section, body_key in SECTIONS.items():
+            for entry in document.get(section) or []:
+                name = entry.get("name")
+                if name is None or name in self.entries[section]:
+                    continue
+                self.entries[section][name] = entry.get(body_key) or {}
+                self._sources[section][name] = path
+
+    def context(self, name):
+        """Returns the body of the named context, or None"""
+        return self.entries["contexts"].get(name)
+
+    def cluster(self, name):
+        """Returns the body of the named cluster, or None"""
+        return self.entries["clusters"].get(name)
+
+    def user(self, name):
+        """Returns the body of the named user, or None"""
+        return self.entries["users"].get(name)
+
+    def find_attribute_in_context(self, context_name, attribute="cluster"):
+        """Returns the cluster, user or namespace of the named context, or None"""
+        context = self.context(context_name)
+        return context.get(attribute) if context else None
+
+    def delete(self, attribute, name, missing_ok=False):
+        """Deletes a cluster, context or user by name, like "kubectl config delete-<attribute>"."""
+        section = f"{attribute}s"
+        path = self._sources[section].pop(name, None)
+        if path is None:
+            if missing_ok:
+                return
+            raise KeyError(f"cannot delete {attribute} {name}, not in kubeconfig")
+        del self.entries[section][name]
+        self._change(path, _remove_entry, section, name)
+
+    def unset_current_context(self):
+        """Unsets current-context, like "kubectl config unset current-context"."""
+        if self._current_context_source is None:
+            return
+        self._change(self._current_context_source, _unset_current_context)
+        self.current_context = None
+        self._current_context_source = None
+
+    def _change(self, path, change, *args):
+        """Records a change to the document of path for save()."""
+        self._changes.setdefault(path, []).append((change, args))
+
+    def save(self):
+        """
+        Atomically writes back every kubeconfig file that was modified. Each file is read again under
+        its lock and the changes are replayed on it, so edits made since it was loaded are kept.
+        """
+        for path in sorted(self._changes):
+            with file_lock(path):
+                document = read_kubeconfig_file(path) or {}
+                for change, args in self._changes[path]:
+                    change(document, *args)
+                write_to_file(path, dump_kubeconfig(document))
+        self._changes.clear()
+
+    def to_document(self, flatten=False):
+        """
+        Returns the merged view as a single kubeconfig document. With flatten, referenced
+        certificate and key files are embedded, like "kubectl config view --flatten".
+        """
+        document = {
+            "apiVersion": "v1",
+            "kind": "Config",
+            "preferences": dict(self.preferences),
+            "current-context": self.current_context or "",
+        }
+        if self.extensions:
+            document["extensions"] = [{"name": name, "extension": extension}
+                                      for name, extension in self.extensions.items()]
+        for section, body_key in SECTIONS.items():
+            entries = []
+            for name, body in self.entries[section].items():
+                if flatten:
+                    body = self.flattened(section, name)
+                entries.append({"name": name, body_key: body})
+            document[section] = entries
+        return document
+
+    def flattened(self, section, name):
+        """Returns the body of the named entry with referenced files embedded as base64 data."""
+        base_dir = os.path.dirname(os.path.abspath(self._sources[section][name]))
+        return flatten_entry(section, self.entries[section][name], base_dir)
+
+
+def _remove_entry(document, section, name):
+    document[section] = [e for e in document.get(section) or [] if e.get("name") != name]
+
+
+def _unset_current_context(document):
+    document["current-context"] = ""
+
+
+def flatten_entry(section, body, base_dir):
+    """Returns a copy of an entry body with referenced files embedded as base64 data."""
+    body = dict(body)
+    for file_field, data_field in FILE_REFERENCES.get(section, {}).items():
+        file_path = body.pop(file_field, None)
+        if file_path and not body.get(data_field):
+            with open(os.path.join(base_dir, os.path.expanduser(file_path)), "rb") as referenced_file:
+                body[data_field] = base64.b64encode(referenced_file.read()).decode("ascii")
+    return body
+
+
+def read_kubeconfig_file(path):
+    """Returns the parsed contents of a kubeconfig file, or None if it doesn't exist or is empty."""
+    try:
+        with open(path, encoding="utf-8") as kubeconfig_file:
+            document = yaml.load(kubeconfig_file, Loader=SafeLoader)
+    except FileNotFoundError:
+        return None
+    return document if isinstance(document, dict) else None
+
+
+def dump_kubeconfig(document):
+    """Returns a kubeconfig document serialized as YAML."""
+    return yaml.dump(document, Dumper=SafeDumper, default_flow_style=False)
+
+
+def _fingerprint(paths):
+    result = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            result.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            result.append((path, None, None))
+    return tuple(result)
+
+
+def load_kubeconfig(kubeconfig=None):
+    """
+    Returns the KubeConfig for the given file, or for the KUBECONFIG chain if None.
+    Files are parsed once and reused until one of them changes on disk.
+    """
+    paths = get_kubeconfig_paths(kubeconfig)
+    fingerprint = _fingerprint(paths)
+    config = _loaded.get(fingerprint)
+    if config is None or config._changes:  # pylint: disable=protected-access
+        config = KubeConfig(paths)
+        if len(_loaded) >= 8:
+            _loaded.clear()
+        _loaded[fingerprint] = config
+    return config
+
+
+def merge_kubeconfig_files(kubeconfig, target=None):
+    """
+    Merges kubeconfig into target, $HOME/.kube/config by default. Entries and current-context from
+    kubeconfig take precedence. The target is locked while it is read and atomically replaced.
+    """
+    target = target or get_default_kubeconfig_path()
+    with file_lock(target):
+        merged = KubeConfig([kubeconfig, target]).to_document(flatten=True)
+        write_to_file(target, dump_kubeconfig(merged))
+
+
+def normalize_server_url(server):
+    """Returns an API server URL in a canonical form for comparison"""
+    url = urlparse(server.strip())
+    scheme = (url.scheme or "https").lower()
+    port = url.port or (443 if scheme == "https" else 80)
+    return f"{scheme}://{(url.hostname or '').lower()}:{port}{url.path.rstrip('/')}"
+
+
+def get_cluster_identity(kubeconfig=None):
+    """
+    Returns (server URL, CA data) for the cluster of the current context, read from the kubeconfig
+    without contacting the API server, or None if there is no such cluster. Results are cached
+    per kubeconfig file until it changes on disk.
+    """
+    fingerprint = _fingerprint(get_kubeconfig_paths(kubeconfig))
+    if fingerprint in _identities:
+        return _identities[fingerprint]
+    config = load_kubeconfig(kubeconfig)
+    identity = None
+    cluster_name = config.find_attribute_in_context(config.current_context, "cluster")
+    cluster = config.cluster(cluster_name) if cluster_name else None
+    if cluster and cluster.get("server"):
+        try:
+            ca_data = config.flattened("clusters", cluster_name).get("certificate-authority-data")
+        except OSError:
+            ca_data = None
+        identity = (normalize_server_url(cluster["server"]), ca_data)
+    if len(_identities) >= 8:
+        _identities.clear()
+    _identities[fingerprint] = identity
+    return identity
+
+
+def is_same_cluster(identity, other_identity):
+    """Returns True if two cluster identities refer to the same API server"""
+    if not identity or not other_identity:
+        return False
+    (server, ca_data), (other_server, other_ca_data) = identity, other_identity
+    if server != other_server:
+        return False
+    return not ca_data or not other_ca_data or ca_data == other_ca_data
@@ -7,19 +7,33 @@
 This module contains helper functions for the az capi extension.
 """
 
+import json
 import subprocess
-import os
 import time
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from azure.cli.core import get_default_cli
 from azure.cli.core.azclierror import UnclassifiedUserFault
 from azure.cli.core.azclierror import ResourceNotFoundError
 from azure.cli.core.azclierror import InvalidArgumentValueError
 
+from .constants import MACHINE_READY_TIMEOUT, MACHINE_READY_TIMEOUT_PER_MACHINE
+from .constants import WATCH_MAX_RETRIES, WATCH_RECONNECT_MIN_DELAY, WATCH_RETRY_MAX_DELAY
 from .run_command import run_shell_command
-from .logger import logger
+from .logger import logger, is_verbose
 from .generic import match_output
-from .constants import KUBECONFIG
+from .kubeconfig import load_kubeconfig, merge_kubeconfig_files
+from .manifest import dump_manifest, object_key
+
+FIELD_MANAGER = "az-capi"
+
+# Services whose endpoints must be ready before Cluster API objects pass admission
+WEBHOOK_SERVICES = {
+    "capi-system": "capi-webhook-service",
+    "capi-kubeadm-bootstrap-system": "capi-kubeadm-bootstrap-webhook-service",
+    "capi-kubeadm-control-plane-system": "capi-kubeadm-control-plane-webhook-service",
+    "capz-system": "capz-webhook-service",
+}
 
 
 def add_kubeconfig_to_command(kubeconfig=None):
@@ -29,33 +43,12 @@ def add_kubeconfig_to_command(kubeconfig=None):
 
 def find_kubectl_current_context():
     """Returns kubectl current-context if exists"""
-    command = ["kubectl", "config", "current-context"]
-    output = None
-    try:
-        output = run_shell_command(command)
-        output = output.strip()
-    except subprocess.CalledProcessError as err:
-        if "current-context is not set" not in err.stdout:
-            raise
-    return output
+    return load_kubeconfig().current_context or None
 
 
 def find_attribute_in_context(context_name, attribute="cluster"):
     """Returns specified attribute of provided context"""
-    command = ["kubectl", "config", "get-contexts", context_name, "--no-headers"]
-    result = None
-    try:
-        output = run_shell_command(command)
-        output = output.split()
-        if attribute == "cluster":
-            result = output[2]
-        elif attribute == "user":
-            result = output[3]
-        elif attribute == "namespace":
-            result = output[4]
-    except subprocess.CalledProcessError:
-        pass
-    return result
+    return load_kubeconfig().find_attribute_in_context(context_name, attribute)
 
 
 def find_cluster_in_current_context():
@@ -75,44 +68,32 @@ def find_cluster_in_current_context():
 
 def merge_kubeconfig(kubeconfig):
     """Merges provided kubeconfig with default kubeconfig"""
-    home = os.environ["HOME"]
-    config_path = f"{home}/.kube/config"
-    os.environ[KUBECONFIG] = f"{kubeconfig}:{config_path}"
-    output = get_default_kubeconfig()
-    filename = "config"
-    with open(filename, "w", encoding="utf-8") as kubeconfig_file:
-        kubeconfig_file.write(output)
-    command = ["mv", filename, config_path]
-    run_shell_command(command)
-
-
-def get_default_kubeconfig():
-    """Returns full default kubeconfig"""
-    command = ["kubectl", "config", "view", "--flatten"]
-    return run_shell_command(command)
+    merge_kubeconfig_files(kubeconfig)
 
 
 def reset_current_context_and_attributes():
     """Unsets current-context and deletes context and its attributes"""
-    current_context = find_kubectl_current_context()
-    cluster_name = find_attribute_in_context(current_context, "cluster")
-    user = find_attribute_in_context(current_context, "user")
-    delete_kubeconfig_attribute(cluster_name, "cluster")
-    delete_kubeconfig_attribute(user, "user")
-    delete_kubeconfig_attribute(current_context, "context")
-    unset_kubectl_current_context()
+    kubeconfig = load_kubeconfig()
+    _delete_context_and_attributes(kubeconfig, kubeconfig.current_context)
+    kubeconfig.unset_current_context()
+    kubeconfig.save()
 
 
-def delete_kubeconfig_attribute(name, attribute="context"):
-    """Deletes attribute from default kubeconfig"""
-    command = ["kubectl", "config", f"delete-{attribute}", name]
-    run_shell_command(command)
+def delete_context_and_attributes(context):
+    """Deletes a context and its cluster and user, leaving current-context alone unless it is that context"""
+    kubeconfig = load_kubeconfig()
+    _delete_context_and_attributes(kubeconfig, context)
+    if kubeconfig.current_context == context:
+        kubeconfig.unset_current_context()
+    kubeconfig.save()
 
 
-def unset_kubectl_current_context():
-    """Unsets current-context of default kubeconfig"""
-    command = ["kubectl", "config", "unset", "current-context"]
-    run_shell_command(command)
+def _delete_context_and_attributes(kubeconfig, context):
+    cluster_name = kubeconfig.find_attribute_in_context(context, "cluster")
+    user = kubeconfig.find_attribute_in_context(context, "user")
+    kubeconfig.delete("cluster", cluster_name, missing_ok=True)
+    kubeconfig.delete("user", user, missing_ok=True)
+    kubeconfig.delete("context", context, missing_ok=True)
 
 
 def find_kubectl_resource_names(resource_type, error_msg, kubeconfig=None):
@@ -195,19 +176,276 @@ def wait_for_resource_ready(find_resources, error_msg, kubeconfig=None,):
     raise ResourceNotFoundError(error_msg)
 
 
-def wait_for_machines(kubeconfig=None):
+def wait_for_machines(kubeconfig=None, cluster_name=None, progress=None):
     """
-    Waits for machines of specified cluster to get be ready before proceeding.
-    Timeout: 5 minutes
+    Waits for machines to be Running, reading all of them with one list call per poll. Progress
+    such as "7/12 Running (Provisioning: 5)" is passed to the progress callback whenever it changes.
+    The deadline scales with the number of machines, see get_machine_ready_timeout.
+    """
+    start = time.time()
+    last_message = summary = None
+    while True:
+        try:
+            summary = summarize_machines(get_machines(kubeconfig, cluster_name))
+        except (subprocess.CalledProcessError, ValueError) as err:
+            logger.info(err)
+        if summary is not None:
+            message = format_machine_progress(summary)
+            if progress and message != last_message:
+                progress(message)
+            last_message = message
+            if summary["total"] and summary["running"] == summary["total"]:
+                return summary
+        timeout = get_machine_ready_timeout(summary["total"] if summary else 0)
+        if time.time() >= start + timeout:
+            break
+        time.sleep(5)
+    msg = f"Not all machines are Running after {timeout} seconds"
+    if summary:
+        details = "".join(f"\n  {owner}: {format_machine_progress(counts)}"
+                          for owner, counts in sorted(summary["owners"].items()))
+        msg += f": {format_machine_progress(summary)}{details}"
+    raise ResourceNotFoundError(msg)
+
+
+def wait_for_condition(resource, condition, timeout, kubeconfig=None):
+    """
+    Waits with a watch until a resource such as "cluster/my-cluster" meets a "kubectl wait" condition,
+    e.g. "condition=Ready" or "delete", or until timeout seconds pass.
+    """
+    command = ["kubectl", "wait", resource, "--for", condition, "--timeout", f"{timeout}s"]
+    command += add_kubeconfig_to_command(kubeconfig)
+    try:
+        run_shell_command(command)
+    except subprocess.CalledProcessError as err:
+        msg = f"{resource} didn't meet {condition} after {timeout} seconds:\n{err.output}"
+        raise ResourceNotFoundError(msg) from err
+
+
+def get_machine_ready_timeout(machine_count):
+    """
+    Returns how many seconds to wait for machine_count machines to be Running. Set the base and the
+    time added per machine with "az config set capi.machine_ready_timeout=<seconds>" and
+    "az config set capi.machine_ready_timeout_per_machine=<seconds>".
+    """
+    config = get_default_cli().config
+    try:
+        base = config.getint("capi", "machine_ready_timeout", fallback=MACHINE_READY_TIMEOUT)
+        per_machine = config.getint("capi", "machine_ready_timeout_per_machine",
+                                    fallback=MACHINE_READY_TIMEOUT_PER_MACHINE)
+    except ValueError:
+        base, per_machine = MACHINE_READY_TIMEOUT, MACHINE_READY_TIMEOUT_PER_MACHINE
+    return base + per_machine * machine_count
+
+
+def list_resources(resource_types, kubeconfig=None, max_workers=8):
+    """
+    Lists several resource types with concurrent "kubectl get" calls. Returns a dict of resource type
+    to its objects, or to None if it couldn't be listed, for example because its CRD isn't installed.
+    """
+    def list_resource(resource_type):
+        command = ["kubectl", "get", resource_type, "--output", "json"]
+        command += add_kubeconfig_to_command(kubeconfig)
+        return json.loads(run_shell_command(command)).get("items") or []
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(resource_types))) as executor:
+        futures = {resource_type: executor.submit(list_resource, resource_type) for resource_type in resource_types}
+        for resource_type, future in futures.items():
+            try:
+                results[resource_type] = future.result()
+            except (subprocess.CalledProcessError, ValueError) as err:
+                logger.info("Couldn't list %s: %s", resource_type, err)
+                results[resource_type] = None
+    return results
+
+
+def iter_json_documents(lines):
+    """
+    Yields each JSON document from a stream of lines, such as the concatenated objects written by
+    "kubectl get --watch --output json". Only the current document is buffered, and decoding is only
+    attempted on lines that can end a document: those that start and end with a brace.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    for line in lines:
+        buffer += line
+        if line[:1] not in ("{", "}") or not line.rstrip().endswith("}"):
+            continue
+        try:
+            document, _ = decoder.raw_decode(buffer.strip())
+        except ValueError:
+            continue
+        buffer = ""
+        yield document
+
+
+def watch_resources(resource_type, kubeconfig=None):
+    """
+    Yields (event type, object) pairs from "kubectl get --watch", which starts by reporting every
+    existing object as ADDED. Returns when kubectl exits, for example when the API server expires
+    the watch, and raises subprocess.CalledProcessError if kubectl failed. Closing the generator
+    stops kubectl.
+    """
+    command = ["kubectl", "get", resource_type, "--watch", "--output-watch-events", "--output", "json"]
+    command += add_kubeconfig_to_command(kubeconfig)
+    stderr = None if is_verbose() else subprocess.DEVNULL
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, universal_newlines=True) as process:
+        try:
+            for event in iter_json_documents(process.stdout):
+                yield event.get("type"), event.get("object") or {}
+        finally:
+            if process.poll() is None:
+                process.terminate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def _object_key(obj):
+    metadata = obj.get("metadata") or {}
+    return metadata.get("namespace"), metadata.get("name")
+
+
+def _watch_once(resource_type, known, kubeconfig=None):
+    """Yields the events of one watch and tracks the keys of existing objects. An ERROR event raises ValueError."""
+    events = watch_resources(resource_type, kubeconfig)
+    try:
+        for event_type, obj in events:
+            if event_type == "ERROR":
+                raise ValueError(obj.get("message") or "The watch reported an error")
+            if event_type == "DELETED":
+                known.discard(_object_key(obj))
+            else:
+                known.add(_object_key(obj))
+            yield event_type, obj
+    finally:
+        events.close()
+
+
+def _list_deleted(resource_type, known, kubeconfig=None):
+    """Yields a DELETED event with the key of each known object that no longer exists."""
+    command = ["kubectl", "get", resource_type, "--output", "json"]
+    command += add_kubeconfig_to_command(kubeconfig)
+    existing = {_object_key(obj) for obj in json.loads(run_shell_command(command)).get("items") or []}
+    for namespace, name in [key for key in known if key not in existing]:
+        known.discard((namespace, name))
+        yield "DELETED", {"metadata": {"namespace": namespace, "name": name}}
+
+
+def follow_resources(resource_type, kubeconfig=None, max_retries=WATCH_MAX_RETRIES):
+    """
+    Yields (event type, object) pairs from watch_resources() until the caller stops, reconnecting
+    when the watch expires. A new watch replays existing objects as ADDED, so one list first reports
+    objects deleted while disconnected. Only the keys of existing objects are kept. A failed watch,
+    including an ERROR event, is retried with a growing delay, up to max_retries times in a row.
+    Every reconnect waits at least WATCH_RECONNECT_MIN_DELAY, so a server that keeps closing the
+    watch isn't listed and watched again in a tight loop.
     """
-    error_msg = "Not all machines are Ready after 5 minutes."
-    wait_for_resource_ready(find_machines, error_msg, kubeconfig)
+    known = set()
+    failures = 0
+    reconnecting = False
+    while True:
+        try:
+            if reconnecting:
+                yield from _list_deleted(resource_type, known, kubeconfig)
+            yield from _watch_once(resource_type, known, kubeconfig)
+            failures = 0
+            time.sleep(WATCH_RECONNECT_MIN_DELAY)
+        except (subprocess.CalledProcessError, ValueError) as err:
+            failures += 1
+            if failures > max_retries:
+                raise UnclassifiedUserFault(f"Couldn't watch {resource_type}") from err
+            delay = min(2 ** failures, WATCH_RETRY_MAX_DELAY)
+            logger.warning("Watching %s failed, retrying in %d seconds: %s", resource_type, delay, err)
+            time.sleep(delay)
+        logger.info("Reconnecting to watch %s", resource_type)
+        reconnecting = True
+
+
+def list_in_contexts(resource_type, contexts, timeout, max_workers=8):
+    """
+    Lists a resource type in several kubectl contexts concurrently, with a timeout in seconds for
+    each context. Returns a dict of context to its objects, or to the reason it couldn't be listed.
+    """
+    def list_context(context):
+        command = ["kubectl", "get", resource_type, "-o", "json", "--context", context,
+                   "--request-timeout", f"{timeout}s"]
+        # --request-timeout only bounds each HTTP request, so kubectl itself is stopped at the
+        # timeout too, e.g. when an exec credential plugin hangs before any request is made.
+        try:
+            output = run_shell_command(command, timeout=timeout)
+        except subprocess.TimeoutExpired as err:
+            raise ValueError(f"Timed out after {timeout}s") from err
+        return json.loads(output).get("items") or []
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(contexts))) as executor:
+        futures = {context: executor.submit(list_context, context) for context in contexts}
+        for context, future in futures.items():
+            try:
+                results[context] = future.result()
+            except (subprocess.CalledProcessError, ValueError) as err:
+                results[context] = (getattr(err, "output", None) or str(err)).strip()
+    return results
+
+
+def get_machines(kubeconfig=None, cluster_name=None):
+    """Returns the Machine objects of the management cluster, optionally only those of one cluster"""
+    command = ["kubectl", "get", "machines", "--all-namespaces", "--output", "json"]
+    if cluster_name:
+        command += ["--selector", f"cluster.x-k8s.io/cluster-name={cluster_name}"]
+    command += add_kubeconfig_to_command(kubeconfig)
+    return json.loads(run_shell_command(command)).get("items") or []
+
+
+def machine_owner(machine):
+    """Returns the owner of a machine as "<kind>/<name>", e.g. its MachineDeployment or KubeadmControlPlane"""
+    labels = machine.get("metadata", {}).get("labels") or {}
+    if labels.get("cluster.x-k8s.io/deployment-name"):
+        return f"MachineDeployment/{labels['cluster.x-k8s.io/deployment-name']}"
+    if labels.get("cluster.x-k8s.io/control-plane-name"):
+        return f"KubeadmControlPlane/{labels['cluster.x-k8s.io/control-plane-name']}"
+    for owner in machine.get("metadata", {}).get("ownerReferences") or []:
+        return f"{owner.get('kind')}/{owner.get('name')}"
+    return f"Machine/{machine.get('metadata', {}).get('name')}"
+
+
+def is_machine_running(machine):
+    """Returns True if a machine's phase is Running and its Ready condition, if reported, is True"""
+    status = machine.get("status") or {}
+    if status.get("phase") != "Running":
+        return False
+    ready = [c for c in status.get("conditions") or [] if c.get("type") == "Ready"]
+    return not ready or ready[0].get("status") == "True"
 
 
-def find_machines(kubeconfig=None):
-    """Returns machines names of specified cluster"""
-    error_msg = "Couldn't get machines of cluster"
-    return find_kubectl_resource_names("machines", error_msg, kubeconfig)
+def summarize_machines(machines):
+    """
+    Groups machines by phase and by owner. Returns a dict with "total" and "running" counts,
+    "phases" of phase to count, and "owners" of owner to a dict of the same counts.
+    """
+    def new_counts():
+        return {"total": 0, "running": 0, "phases": {}}
+
+    summary = dict(new_counts(), owners={})
+    for machine in machines:
+        phase = (machine.get("status") or {}).get("phase") or "Pending"
+        running = is_machine_running(machine)
+        owner_counts = summary["owners"].setdefault(machine_owner(machine), new_counts())
+        for counts in (summary, owner_counts):
+            counts["total"] += 1
+            counts["running"] += running
+            if not running:
+                counts["phases"][phase] = counts["phases"].get(phase, 0) + 1
+    return summary
+
+
+def format_machine_progress(counts):
+    """Returns machine counts as text, such as 7/12 Running (Provisioning: 4, Pending: 1)"""
+    message = f"{counts['running']}/{counts['total']} Running"
+    if counts["phases"]:
+        message += " (" + ", ".join(f"{phase}: {n}" for phase, n in sorted(counts["phases"].items())) + ")"
+    return message
 
 
 def check_pods_status_by_namespace(namespace, error_message, pod_name):
@@ -233,6 +471,17 @@ def check_pods_status_by_namespace(namespace, error_message, pod_name):
         raise
 
 
+def cluster_exists(cluster_name, kubeconfig=None):
+    """Returns True if the management cluster has a Cluster object with the given name"""
+    command = ["kubectl", "get", "cluster", cluster_name, "--output", "name"]
+    command += add_kubeconfig_to_command(kubeconfig)
+    try:
+        run_shell_command(command)
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+
 def get_azure_cluster(cluster_name, kubeconfig=None):
     """Returns AzureCluster Object"""
     command = ["kubectl", "get", "AzureCluster", cluster_name, "-o", "json"]
@@ -243,19 +492,69 @@ def get_azure_cluster(cluster_name, kubeconfig=None):
         raise InvalidArgumentValueError(f"Could not find {cluster_name}") from err
 
 
-def get_kubectl_cluster_info(kubeconfig=None):
-    """Returns kubectl cluster-info result"""
-    command = ["kubectl", "cluster-info"]
+def server_side_apply(manifest, kubeconfig=None):
+    """Applies a manifest with server-side apply, owning its fields as the az-capi field manager."""
+    command = ["kubectl", "apply", "--server-side", "--field-manager", FIELD_MANAGER, "--force-conflicts",
+               "-f", "-"]
     command += add_kubeconfig_to_command(kubeconfig)
-    return run_shell_command(command)
-
-
-def get_ports_cluster(kubeconfig=None):
-    """Returns dictionary with cluster component ports"""
-    output = get_kubectl_cluster_info(kubeconfig)
-    match = re.findall(r"(?<=is running at )[^\s]{1,}", output)
-    result = {
-        "control_plane": match[0],
-        "coredns": match[1]
-    }
-    return result
+    return run_shell_command(command, manifest)
+
+
+def webhooks_ready(kubeconfig=None):
+    """Returns True if every Cluster API webhook service has at least one ready endpoint"""
+    for namespace, service in WEBHOOK_SERVICES.items():
+        command = ["kubectl", "get", "endpoints", service, "--namespace", namespace, "--output", "json"]
+        command += add_kubeconfig_to_command(kubeconfig)
+        try:
+            subsets = json.loads(run_shell_command(command)).get("subsets") or []
+        except (subprocess.CalledProcessError, ValueError):
+            return False
+        if not any(subset.get("addresses") for subset in subsets):
+            logger.info("Waiting for endpoints of webhook service %s/%s", namespace, service)
+            return False
+    return True
+
+
+def wait_for_webhooks(deadline, kubeconfig=None):
+    """Waits until the Cluster API webhooks are ready or the deadline passes. Returns True if ready."""
+    while not webhooks_ready(kubeconfig):
+        if time.time() >= deadline:
+            return False
+        time.sleep(1)
+    return True
+
+
+def apply_objects(objects, timeout=300, kubeconfig=None, max_workers=8):
+    """
+    Applies Kubernetes objects concurrently, one server-side apply each. Objects that fail are
+    retried once the Cluster API webhooks are ready, until the timeout.
+    Returns a dict of object key to kubectl output for applied objects and a dict of object key
+    to the last error for objects that couldn't be applied.
+    """
+    pending = {object_key(obj): obj for obj in objects}
+    applied, failed = {}, {}
+    deadline = time.time() + timeout
+    delay = 1
+    while pending:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            futures = {executor.submit(server_side_apply, dump_manifest([obj]), kubeconfig): key
+                       for key, obj in pending.items()}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    applied[key] = future.result().strip()
+                except subprocess.CalledProcessError as err:
+                    failed[key] = (err.output or str(err)).strip()
+                    logger.info("Couldn't apply %s: %s", key, failed[key])
+                else:
+                    logger.info("Applied %s: %s", key, applied[key])
+                    failed.pop(key, None)
+                    del pending[key]
+        if not pending or time.time() >= deadline:
+            break
+        # Most failures come from webhooks that aren't serving yet, so wait for them instead of
+        # sleeping blindly. Back off in case the failures have another cause.
+        if wait_for_webhooks(deadline, kubeconfig):
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+    return applied, failed
@@ -0,0 +1,130 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module holds multi-document Kubernetes manifests as lists of objects, with digests to find changed objects.
+"""
+
+import hashlib
+import json
+
+import yaml
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class KubernetesObject(dict):
+    """A Kubernetes object parsed from a manifest, with accessors for its identifying fields."""
+
+    @property
+    def api_version(self):
+        """Returns the apiVersion, or an empty string"""
+        return self.get("apiVersion", "")
+
+    @property
+    def kind(self):
+        """Returns the kind, or an empty string"""
+        return self.get("kind", "")
+
+    @property
+    def name(self):
+        """Returns metadata.name, or an empty string"""
+        return (self.get("metadata") or {}).get("name", "")
+
+    @property
+    def namespace(self):
+        """Returns metadata.namespace, or an empty string for cluster-scoped objects"""
+        return (self.get("metadata") or {}).get("namespace", "")
+
+    @property
+    def key(self):
+        """Returns the key identifying the object by API group, kind, namespace and name"""
+        return object_key(self)
+
+    @property
+    def digest(self):
+        """Returns the SHA-256 digest of the object, independent of key order"""
+        return object_digest(self)
+
+
+class ManifestDumper(SafeDumper):  # pylint: disable=too-many-ancestors
+    """A SafeDumper that also writes KubernetesObject instances, as plain mappings."""
+
+
+ManifestDumper.add_representer(KubernetesObject, yaml.representer.SafeRepresenter.represent_dict)
+
+
+class Manifest():
+    """The objects of a multi-document manifest, in order."""
+
+    def __init__(self, objects=()):
+        self.objects = [o if isinstance(o, KubernetesObject) else KubernetesObject(o) for o in objects]
+
+    @classmethod
+    def from_yaml(cls, text):
+        """Parses a multi-document YAML manifest, a string or an open file, skipping empty documents."""
+        return cls(load_manifest(text))
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def validate(self):
+        """Returns a list of problems, such as objects without a kind or name, or duplicated objects."""
+        problems, seen = [], set()
+        for position, obj in enumerate(self.objects, 1):
+            if not obj.api_version or not obj.kind or not obj.name:
+                problems.append(f"object {position} needs apiVersion, kind and metadata.name")
+            elif obj.key in seen:
+                problems.append(f"{obj.key} is defined more than once")
+            seen.add(obj.key)
+        return problems
+
+    def digests(self):
+        """Returns a dict of object key to digest"""
+        return manifest_digests(self.objects)
+
+    def changed(self, applied_digests):
+        """Returns the objects whose digest differs from the one recorded when they were last applied."""
+        return changed_objects(self.objects, applied_digests)
+
+
+def object_key(obj):
+    """Returns a key identifying a Kubernetes object, e.g. "cluster.x-k8s.io/Cluster/default/my-cluster"."""
+    metadata = obj.get("metadata") or {}
+    group = obj.get("apiVersion", "").rpartition("/")[0]
+    return "/".join([group, obj.get("kind", ""), metadata.get("namespace", ""), metadata.get("name", "")])
+
+
+def object_digest(obj):
+    """
+    Returns the SHA-256 digest of a Kubernetes object, independent of key order. Values JSON can't
+    represent, such as the dates and timestamps YAML parses unquoted, are digested as strings.
+    """
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def load_manifest(text):
+    """Returns the objects of a multi-document YAML manifest, a string or an open file, skipping empty documents."""
+    return [KubernetesObject(obj) for obj in yaml.load_all(text, Loader=SafeLoader) if obj]
+
+
+def dump_manifest(objects):
+    """Returns objects serialized as a multi-document YAML manifest, keeping their key order."""
+    return yaml.dump_all(objects, Dumper=ManifestDumper, default_flow_style=False, explicit_start=True,
+                         sort_keys=False)
+
+
+def manifest_digests(objects):
+    """Returns a dict of object key to digest for each object in a manifest."""
+    return {object_key(obj): object_digest(obj) for obj in objects}
+
+
+def changed_objects(objects, applied_digests):
+    """Returns the objects whose digest differs from the one recorded when they were last applied."""
+    return [obj for obj in objects if applied_digests.get(object_key(obj)) != object_digest(obj)]
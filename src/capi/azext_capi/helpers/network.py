@@ -6,18 +6,42 @@
 """
 This module contains helper functions for the az capi extension.
 """
-from urllib.parse import urlparse
+from functools import lru_cache
+from urllib.parse import urljoin, urlparse, urlsplit, urlunsplit
+from urllib.request import getproxies, proxy_bypass
+import hashlib
+import http.client
+import io
 import platform
+import re
 import ssl
 import sys
+import threading
+import time
 
-from six.moves.urllib.request import urlopen
+from six.moves.urllib.error import HTTPError, URLError  # pylint: disable=import-error
+from six.moves.urllib.request import Request  # pylint: disable=import-error
+from six.moves.urllib.request import urlopen as urllib_urlopen  # pylint: disable=import-error
 
 from azure.cli.core.util import in_cloud_console
 
+from .cache import get_cache_path, load_json_cache, save_json_cache
+from .logger import logger
+from .os import write_to_file
 
+# Idle keep-alive connections kept for each host, and redirects followed for each request
+MAX_IDLE_CONNECTIONS_PER_HOST = 2
+MAX_REDIRECTS = 10
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+USER_AGENT = f"Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+@lru_cache(maxsize=None)
 def ssl_context():
-    """Returns an SSL context appropriate for the python version and environment."""
+    """
+    Returns an SSL context appropriate for the python version and environment. It is created once,
+    so the CA bundle is only loaded for the first download.
+    """
     if sys.version_info < (3, 4) or (in_cloud_console() and platform.system() == "Windows"):
         try:
             # added in python 2.7.13 and 3.6
@@ -28,13 +52,221 @@ def ssl_context():
     return ssl.create_default_context()
 
 
+class ConnectionPool():
+    """
+    Idle HTTP connections kept open by scheme and host, so sequential requests to the same host
+    reuse a connection instead of opening a new TCP connection and TLS session each time. A
+    connection is only used by one request at a time.
+    """
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_CONNECTIONS_PER_HOST):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, host):
+        """Returns an idle connection to the host or a new one, and whether it was reused."""
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, context=ssl_context()), False
+        return http.client.HTTPConnection(host), False
+
+    def release(self, scheme, host, connection):
+        """Keeps a connection for the next request to the host, or closes it if enough are idle."""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Closes every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+_pool = ConnectionPool()
+
+
+class PooledResponse():
+    """
+    A response read from a pooled connection. The connection goes back to the pool when the body
+    has been read completely, and is closed instead if the response is closed before that or the
+    server doesn't keep connections alive.
+    """
+
+    def __init__(self, url, response, scheme, host, connection):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._response = response
+        self._key = (scheme, host)
+        self._connection = connection
+
+    def read(self, amt=None):
+        """Reads up to amt bytes of the body, or all of it, releasing the connection at the end."""
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        """Returns the connection to the pool if the body was read completely, or closes it."""
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        if self._response.isclosed() and not self._response.will_close:
+            _pool.release(*self._key, connection)
+        else:
+            connection.close()
+
+    def geturl(self):
+        """Returns the URL of the response, like urllib's responses."""
+        return self.url
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def uses_proxy(url):
+    """Returns True if urllib would send a request for the URL through a proxy."""
+    parts = urlsplit(url)
+    return parts.scheme in getproxies() and not proxy_bypass(parts.hostname or "")
+
+
+def _pooled_request(url, headers):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise URLError(f"unknown url type: {parts.scheme}")
+    path = urlunsplit(("", "", parts.path or "/", parts.query, ""))
+    while True:
+        connection, reused = _pool.acquire(parts.scheme, parts.netloc)
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, OSError) as err:
+            connection.close()
+            if reused:
+                # the server closed the idle connection, so try again on another one
+                continue
+            raise URLError(err) from err
+        return PooledResponse(url, response, parts.scheme, parts.netloc, connection)
+
+
+def urlopen(request):
+    """
+    Opens a URL, or a urllib Request with headers, like urllib's urlopen: redirects are followed and
+    a status other than 2xx raises HTTPError. Requests share keep-alive connections from a pool, so
+    sequential downloads from the same host skip the handshake, unless a proxy is configured.
+    """
+    url = getattr(request, "full_url", request)
+    if uses_proxy(url):
+        return urllib_urlopen(request, context=ssl_context())  # pylint: disable=consider-using-with
+    headers = {"User-Agent": USER_AGENT}
+    if hasattr(request, "header_items"):
+        headers.update(request.header_items())
+    response = _pooled_request(url, headers)
+    for _ in range(MAX_REDIRECTS):
+        location = response.headers.get("Location")
+        if response.status not in REDIRECT_CODES or not location:
+            break
+        # read the body of the redirect so its connection can be reused
+        response.read()
+        url = urljoin(url, location)
+        response = _pooled_request(url, headers)
+    if not 200 <= response.status < 300:
+        body = response.read()
+        raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+    return response
+
+
 def urlretrieve(url, filename):
     """Retrieves the contents of a URL to a file."""
-    req = urlopen(url, context=ssl_context())  # pylint: disable=consider-using-with
-    with open(filename, "wb") as out:
-        out.write(req.read())
+    req = urlopen(url)
+    try:
+        with open(filename, "wb") as out:
+            out.write(req.read())
+    finally:
+        req.close()
+
+
+def get_github_raw_url(url):
+    """Returns the raw.githubusercontent.com URL for a github.com ".../blob/<ref>/<path>" URL, or url."""
+    match = re.match(r"https?://github\.com/([^/]+)/([^/]+)/blob/(.+)$", url)
+    if not match:
+        return url
+    owner, repo, ref_and_path = match.groups()
+    return f"https://raw.githubusercontent.com/{owner}/{repo}/{ref_and_path}"
 
 
 def get_url_domain_name(url):
     domain = urlparse(url).netloc
     return domain if domain else None
+
+
+def file_sha256(filename):
+    """Returns the SHA-256 digest of a file's contents, or None if it can't be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def fetch_cached(url, max_age=0):
+    """
+    Returns the path of a local copy of a URL, cached in the $HOME/.azure/capi directory.
+    A copy fetched less than max_age seconds ago is used as is. Older copies are revalidated
+    with their ETag and Last-Modified date and only downloaded again if they changed.
+    If the URL can't be reached, a previously cached copy is used.
+    """
+    path = get_cache_path("urls", hashlib.sha256(url.encode("utf-8")).hexdigest())
+    metadata_path = f"{path}.json"
+    metadata = load_json_cache(metadata_path)
+    cached = bool(metadata) and file_sha256(path) == metadata.get("sha256")
+    if cached and time.time() - metadata.get("fetched", 0) < max_age:
+        return path
+
+    headers = {}
+    if cached and metadata.get("etag"):
+        headers["If-None-Match"] = metadata["etag"]
+    if cached and metadata.get("last_modified"):
+        headers["If-Modified-Since"] = metadata["last_modified"]
+    try:
+        with urlopen(Request(url, headers=headers)) as response:
+            content = response.read()
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except (HTTPError, URLError, OSError) as err:
+        if not cached:
+            raise
+        if isinstance(err, HTTPError) and err.code == 304:
+            logger.info("Cached copy of %s is up to date", url)
+            metadata["fetched"] = time.time()
+            save_json_cache(metadata_path, metadata)
+        else:
+            logger.warning("Couldn't reach %s, using cached copy: %s", url, err)
+        return path
+
+    write_to_file(path, content)
+    save_json_cache(metadata_path, {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "fetched": time.time(),
+    })
+    return path
@@ -4,22 +4,81 @@
 # --------------------------------------------------------------------------------------------
 
 import os
+import tempfile
+import time
+from contextlib import contextmanager
 
+from azure.cli.core.azclierror import FileOperationError
 
-def set_environment_variables(dic=None):
+
+def write_to_file(filename, file_input):
     """
-    Sets the key and value items of a dictionary into environment variables.
+    Writes file_input, a string, bytes or an iterable of string chunks such as a Jinja template
+    stream, into file atomically, so an interrupted write never leaves a truncated file behind.
     """
-    if not dic:
-        return
-    for key, value in dic.items():
-        if value:
-            os.environ[key] = f"{value}"
+    with atomic_file(filename, "wb" if isinstance(file_input, bytes) else "w") as output_file:
+        if isinstance(file_input, (str, bytes)):
+            output_file.write(file_input)
+        else:
+            output_file.writelines(file_input)
 
 
-def write_to_file(filename, file_input):
+def _get_umask():
+    """Returns the process umask, which can only be read by setting it."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def atomic_file(filename, mode="w"):
+    """
+    Yields a temporary file next to filename, opened with mode, and renames it into place when the
+    block completes. If the block raises, including KeyboardInterrupt, the temporary file is removed
+    and filename is left untouched. The permissions of an existing file are kept, and a new file gets
+    the usual 0666 less the umask rather than mkstemp's private 0600. If filename is a symlink, the
+    file it points to is replaced and the link is kept, as kubectl does.
+    """
+    filename = os.path.realpath(filename)
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filename)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else "utf-8") as tmp_file:
+            yield tmp_file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(filename).st_mode)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~_get_umask())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(filename, timeout=30):
     """
-    Writes file_input into file
+    Holds an exclusive lock on filename while the block runs. The lock is a "<filename>.lock" file
+    created exclusively, the same convention kubectl uses, so kubectl writes are excluded too.
     """
-    with open(filename, "w", encoding="utf-8") as manifest_file:
-        manifest_file.write(file_input)
+    lock_path = f"{filename}.lock"
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError as err:
+            if time.time() >= deadline:
+                msg = f'Timed out waiting for the lock on "{filename}". Remove "{lock_path}" if it is stale.'
+                raise FileOperationError(msg) from err
+            time.sleep(0.1)
+    try:
+        os.close(fd)
+        yield
+    finally:
+        os.remove(lock_path)
@@ -0,0 +1,115 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module checks a workload cluster's Azure requirements before any slow work starts.
+Each check takes an Azure SDK client and returns a list of problems, empty if there are none.
+"""
+
+import re
+
+from .logger import logger
+
+# The marketplace images CAPZ uses by default, with SKUs like "k8s-1dot22dot8-ubuntu-2004"
+IMAGE_PUBLISHER = "cncf-upstream"
+IMAGE_OFFER = "capi"
+
+
+def get_vm_skus(compute_client, location):
+    """Returns the virtual machine resource SKUs offered in a location, by name."""
+    skus = compute_client.resource_skus.list(filter=f"location eq '{location}'")
+    return {sku.name: sku for sku in skus if sku.resource_type == "virtualMachines"}
+
+
+def sku_capability(sku, name, default=None):
+    """Returns the value of a resource SKU capability, such as "vCPUs"."""
+    for capability in sku.capabilities or []:
+        if capability.name == name:
+            return capability.value
+    return default
+
+
+def is_sku_restricted(sku, location):
+    """Returns True if a resource SKU isn't available to the subscription in the location."""
+    for restriction in sku.restrictions or []:
+        if restriction.type == "Location" and location.lower() in [v.lower() for v in restriction.values or []]:
+            return True
+    return False
+
+
+def check_vm_sizes(vm_skus, machine_counts, location):
+    """Returns problems with VM sizes that aren't offered, or are restricted, in the location."""
+    problems = []
+    for vm_size in sorted(machine_counts):
+        sku = vm_skus.get(vm_size)
+        if sku is None:
+            problems.append(f'VM size "{vm_size}" is not available in {location}')
+        elif is_sku_restricted(sku, location):
+            problems.append(f'VM size "{vm_size}" is restricted for this subscription in {location}')
+    return problems
+
+
+def check_vcpu_quota(compute_client, vm_skus, machine_counts, location):
+    """
+    Returns problems with vCPU quota: the regional total and each VM family must have room
+    for all of the cluster's machines.
+    """
+    required = {"cores": 0}
+    for vm_size, count in machine_counts.items():
+        sku = vm_skus.get(vm_size)
+        if sku is None:
+            continue
+        vcpus = int(sku_capability(sku, "vCPUs", 0)) * count
+        required["cores"] += vcpus
+        if sku.family:
+            required[sku.family] = required.get(sku.family, 0) + vcpus
+    problems = []
+    for usage in compute_client.usage.list(location):
+        needed = required.get(usage.name.value)
+        if needed and usage.current_value + needed > usage.limit:
+            problems.append(f"{usage.name.localized_value or usage.name.value} quota in {location} is too low: "
+                            f"{needed} vCPUs needed, {usage.limit - usage.current_value} of {usage.limit} available")
+    return problems
+
+
+def image_sku_prefix(kubernetes_version):
+    """Returns the prefix of marketplace image SKUs for a Kubernetes version, e.g. "k8s-1dot22dot8-"."""
+    match = re.match(r"v?(\d+)\.(\d+)\.(\d+)$", str(kubernetes_version).strip())
+    if not match:
+        return None
+    return "k8s-{}dot{}dot{}-".format(*match.groups())  # pylint: disable=consider-using-f-string
+
+
+def check_image_sku(compute_client, kubernetes_version, location):
+    """Returns a problem if there is no marketplace image for the Kubernetes version in the location."""
+    prefix = image_sku_prefix(kubernetes_version)
+    if prefix is None:
+        return [f'Kubernetes version "{kubernetes_version}" is not a valid version such as 1.22.8']
+    skus = compute_client.virtual_machine_images.list_skus(location, IMAGE_PUBLISHER, IMAGE_OFFER)
+    if any(sku.name.startswith(prefix) for sku in skus):
+        return []
+    return [f"No {IMAGE_PUBLISHER}/{IMAGE_OFFER} image is published for Kubernetes {kubernetes_version} "
+            f"in {location}"]
+
+
+def run_vm_checks(compute_client, machine_counts, location):
+    """Runs the VM size and quota checks, which share one resource SKU listing."""
+    vm_skus = get_vm_skus(compute_client, location)
+    problems = check_vm_sizes(vm_skus, machine_counts, location)
+    return problems + check_vcpu_quota(compute_client, vm_skus, machine_counts, location)
+
+
+def collect_problems(futures):
+    """
+    Returns the problems reported by a dict of check name to Future. A check that couldn't run,
+    for example because of missing permissions, is logged and doesn't block the operation.
+    """
+    problems = []
+    for name, future in futures.items():
+        try:
+            problems += future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning("Skipped the %s preflight check: %s", name, err)
+    return problems
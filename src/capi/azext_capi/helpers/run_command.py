@@ -13,10 +13,14 @@ from .spinner import Spinner
 from .logger import logger, is_verbose
 
 
-def run_shell_command(command):
+def run_shell_command(command, input_text=None, timeout=None):
     # if --verbose, don't capture stderr
     stderr = None if is_verbose() else subprocess.STDOUT
-    output = subprocess.check_output(command, universal_newlines=True, stderr=stderr)
+    if input_text is None:
+        output = subprocess.check_output(command, universal_newlines=True, stderr=stderr, timeout=timeout)
+    else:
+        output = subprocess.check_output(command, universal_newlines=True, stderr=stderr, input=input_text,
+                                         timeout=timeout)
     logger.info("%s returned:\n%s", " ".join(command), output)
     return output
 
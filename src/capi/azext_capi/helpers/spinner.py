@@ -33,6 +33,11 @@ class Spinner():
     def update(self):
         self._controller.update()
 
+    def progress(self, message):
+        """Shows message after the begin message, for example the number of machines running"""
+        self._controller.add(message=f"{self.begin_msg}: {message}")
+        logger.info("%s: %s", self.begin_msg, message)
+
     def __enter__(self):
         self._controller.begin(message=self.begin_msg)
         logger.info(self.begin_msg)
@@ -0,0 +1,92 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+This module renders workload cluster templates: the built-in Jinja template, and user-provided
+clusterctl-style templates with their variables substituted in-process.
+"""
+
+import os
+from functools import lru_cache
+
+from azure.cli.core.azclierror import RequiredArgumentMissingError
+from jinja2 import Environment, PackageLoader, StrictUndefined, meta, nodes
+from jinja2.exceptions import UndefinedError
+
+from .cache import get_url_cache_max_age
+from .envsubst import envsubst, find_missing_variables, load_clusterctl_variables
+from .network import fetch_cached, get_github_raw_url
+
+
+@lru_cache(maxsize=None)
+def get_builtin_jinja_environment():
+    """Returns the Jinja environment of the built-in templates, so they are loaded and compiled once."""
+    return Environment(loader=PackageLoader("azext_capi", "templates"),
+                       auto_reload=False, undefined=StrictUndefined)
+
+
+@lru_cache(maxsize=None)
+def get_builtin_template_variables(name="base.jinja"):
+    """
+    Returns the variables a built-in template and the templates it includes need from the caller.
+    Names assigned with "set" in any of them, such as SUFFIX, are provided by the templates themselves.
+    """
+    env = get_builtin_jinja_environment()
+    variables, assigned, pending, seen = set(), set(), [name], set()
+    while pending:
+        template_name = pending.pop()
+        seen.add(template_name)
+        ast = env.parse(env.loader.get_source(env, template_name)[0])
+        variables |= meta.find_undeclared_variables(ast)
+        assigned |= {node.name for node in ast.find_all(nodes.Name) if node.ctx == "store"}
+        pending += [t for t in meta.find_referenced_templates(ast) if t and t not in seen]
+    return frozenset(variables - assigned)
+
+
+def find_missing_builtin_template_args(args):
+    """Returns the sorted names of variables used by the built-in template that are not in args."""
+    return sorted(get_builtin_template_variables() - set(args))
+
+
+def render_builtin_jinja_template(args):
+    """
+    Use the built-in template and process it with Jinja
+    """
+    return "".join(generate_builtin_jinja_template(args))
+
+
+def generate_builtin_jinja_template(args):
+    """
+    Renders the built-in template as a stream of text chunks, so it can be written out without
+    holding the whole manifest in memory.
+    """
+    env = get_builtin_jinja_environment()
+    jinja_template = env.get_template("base.jinja")
+    try:
+        yield from jinja_template.generate(args)
+    except UndefinedError as err:
+        msg = f"Could not generate workload cluster configuration.\n{err}"
+        raise RequiredArgumentMissingError(msg) from err
+
+
+def render_custom_cluster_template(template, args=None):
+    """
+    Fetch a user-defined template and substitute its variables like "clusterctl generate yaml".
+    Values come from args, then from environment variables, then from clusterctl's configuration
+    file. Template URLs are cached and revalidated with conditional requests.
+    """
+    if not os.path.isfile(template):
+        template = fetch_cached(get_github_raw_url(template), max_age=get_url_cache_max_age())
+    with open(template, encoding="utf-8") as template_file:
+        content = template_file.read()
+    variables = load_clusterctl_variables()
+    variables.update(os.environ)
+    variables.update({key: f"{value}" for key, value in (args or {}).items() if value})
+    missing = find_missing_variables(content, variables)
+    if missing:
+        msg = "Could not generate workload cluster configuration."
+        msg += f"\nPlease set the following environment variables:\n{', '.join(missing)}"
+        raise RequiredArgumentMissingError(msg)
+    return envsubst(content, variables)
@@ -0,0 +1,134 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+A small pytest-benchmark style fixture. Benchmarks only run when CAPI_BENCHMARK is set:
+
+    CAPI_BENCHMARK=1 python -m pytest azext_capi/tests/benchmarks     # compare against baseline.json
+    CAPI_BENCHMARK=save python -m pytest azext_capi/tests/benchmarks  # record a new baseline.json
+
+A benchmark fails when its median is more than CAPI_BENCHMARK_THRESHOLD (default 0.25, i.e. 25%)
+slower than the baseline, or when the baseline has no entry for it, since there is nothing to compare.
+Baselines are machine-specific, so none is committed: record one on the machine that compares.
+"""
+
+import json
+import os
+import statistics
+import time
+
+import pytest
+
+MODE = os.environ.get("CAPI_BENCHMARK", "")
+BASELINE = os.environ.get("CAPI_BENCHMARK_BASELINE",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"))
+THRESHOLD = float(os.environ.get("CAPI_BENCHMARK_THRESHOLD", "0.25"))
+MIN_SAMPLE_TIME = 0.005
+
+_results = {}
+
+
+def pytest_collection_modifyitems(items):
+    """Skips the benchmarks unless CAPI_BENCHMARK is set."""
+    if MODE:
+        return
+    skip = pytest.mark.skip(reason="set CAPI_BENCHMARK to run benchmarks")
+    for item in items:
+        if "benchmark" in getattr(item, "fixturenames", ()):
+            item.add_marker(skip)
+
+
+def pytest_sessionfinish(session):  # pylint: disable=unused-argument
+    """Adds the medians of this run to the baseline file when CAPI_BENCHMARK=save."""
+    if MODE != "save" or not _results:
+        return
+    baseline = load_baseline()
+    baseline.update(_results)
+    with open(BASELINE, "w", encoding="utf-8") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Prints each benchmark's median and its change against the baseline."""
+    if not _results:
+        return
+    baseline = load_baseline()
+    terminalreporter.section("benchmarks (median)")
+    for name, stats in sorted(_results.items()):
+        line = f"{name:<70}{stats['median'] * 1000:>12.3f}ms"
+        if name in baseline:
+            change = stats["median"] / baseline[name]["median"] - 1
+            line += f"  {change:+.1%} vs baseline"
+        elif MODE != "save":
+            line += "  NO BASELINE"
+        terminalreporter.write_line(line)
+    if MODE != "save" and not baseline:
+        terminalreporter.write_line(f"No baseline found at {BASELINE}; run with CAPI_BENCHMARK=save to record one",
+                                    red=True, bold=True)
+
+
+def load_baseline():
+    """Returns the stored medians by benchmark name, or an empty dict if there is no baseline file."""
+    try:
+        with open(BASELINE, encoding="utf-8") as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+class Benchmark():
+    """Times a callable over several rounds and checks the median against the stored baseline."""
+
+    def __init__(self, name, rounds=20, warmup=1):
+        self.name = name
+        self.rounds = rounds
+        self.warmup = warmup
+        self.stats = None
+
+    def __call__(self, func, *args, **kwargs):
+        for _ in range(self.warmup):
+            result = func(*args, **kwargs)
+        # Fast functions are called in a loop so that each sample takes at least MIN_SAMPLE_TIME
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        iterations = max(1, int(MIN_SAMPLE_TIME / max(time.perf_counter() - start, 1e-9)))
+        samples = []
+        for _ in range(self.rounds):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = func(*args, **kwargs)
+            samples.append((time.perf_counter() - start) / iterations)
+        self.record(samples)
+        return result
+
+    def measure(self, func, rounds=None):
+        """Records the durations returned by func, for benchmarks that time themselves."""
+        self.record([func() for _ in range(rounds or self.rounds)])
+
+    def record(self, samples):
+        """Stores the statistics of samples and fails if the median regressed past the threshold."""
+        self.stats = {
+            "rounds": len(samples),
+            "min": min(samples),
+            "median": statistics.median(samples),
+            "mean": statistics.mean(samples),
+        }
+        _results[self.name] = self.stats
+        if MODE == "save":
+            return
+        expected = load_baseline().get(self.name)
+        if expected is None:
+            pytest.fail(f"{self.name}: no baseline to compare against in {BASELINE}. "
+                        "Record one with CAPI_BENCHMARK=save on this machine.")
+        if self.stats["median"] > expected["median"] * (1 + THRESHOLD):
+            pytest.fail(f"{self.name}: median {self.stats['median'] * 1000:.3f}ms is more than "
+                        f"{THRESHOLD:.0%} slower than the baseline {expected['median'] * 1000:.3f}ms")
+
+
+@pytest.fixture
+def benchmark(request):
+    """Returns a Benchmark named after the test."""
+    return Benchmark(request.node.name)
@@ -0,0 +1,98 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import itertools
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from azext_capi._format import output_list_for_tsv
+from azext_capi.custom import management_cluster_components_missing_matching_expressions
+from azext_capi.helpers.template import render_builtin_jinja_template
+from azext_capi.helpers.binary import which
+from azext_capi.helpers.generic import match_output
+
+TEMPLATE_ARGS = {
+    "AZURE_CONTROL_PLANE_MACHINE_TYPE": "Standard_D2s_v3",
+    "AZURE_LOCATION": "eastus",
+    "AZURE_NODE_MACHINE_TYPE": "Standard_D2s_v3",
+    "AZURE_RESOURCE_GROUP": "bench-rg",
+    "AZURE_SSH_PUBLIC_KEY": "ssh-rsa AAAA bench",
+    "AZURE_SSH_PUBLIC_KEY_B64": "c3NoLXJzYSBBQUFBIGJlbmNo",
+    "AZURE_VNET_NAME": "bench-vnet",
+    "CLUSTER_NAME": "bench-cluster",
+    "CONTROL_PLANE_MACHINE_COUNT": 3,
+    "KUBERNETES_VERSION": "v1.22.4",
+    "WORKER_MACHINE_COUNT": 3,
+    "CLUSTER_IDENTITY_NAME": "cluster-identity",
+    "AZURE_SUBSCRIPTION_ID": "00000000-0000-0000-0000-000000000000",
+    "AZURE_TENANT_ID": "00000000-0000-0000-0000-000000000000",
+    "AZURE_CLIENT_ID": "00000000-0000-0000-0000-000000000000",
+    "AZURE_CLUSTER_IDENTITY_SECRET_NAME": "cluster-identity-secret",
+    "AZURE_CLUSTER_IDENTITY_SECRET_NAMESPACE": "default",
+    "EXTERNAL_CLOUD_PROVIDER": False,
+}
+
+CLASSIFIER_OUTPUTS = [
+    'Error: namespace: capz-system could not be found!',
+    "No resources found in capi-system namespace.",
+    "Error: No Cluster API installation found",
+    "NAME                                       READY   STATUS    RESTARTS   AGE\n" * 50,
+]
+
+
+def synthetic_clusters(count):
+    items = [{
+        "apiVersion": "cluster.x-k8s.io/v1beta1",
+        "kind": "Cluster",
+        "metadata": {"name": f"cluster-{i}", "namespace": "default", "labels": {"team": "bench"}},
+        "spec": {"controlPlaneEndpoint": {"host": f"cluster-{i}.eastus.cloudapp.azure.com", "port": 6443}},
+        "status": {"phase": "Provisioned", "controlPlaneReady": True, "infrastructureReady": True},
+    } for i in range(count)]
+    return json.dumps({"apiVersion": "v1", "kind": "List", "items": items})
+
+
+@pytest.mark.parametrize("windows,ephemeral,nodepool_type", list(itertools.product(
+    [False, True], [False, True], ["machinedeployment", "machinepool"])))
+def test_render_builtin_jinja_template(benchmark, windows, ephemeral, nodepool_type):
+    args = dict(TEMPLATE_ARGS, WINDOWS=windows, EPHEMERAL=ephemeral, NODEPOOL_TYPE=nodepool_type)
+    manifest = benchmark(render_builtin_jinja_template, args)
+    assert "kind: Cluster" in manifest
+
+
+def test_output_list_for_tsv_10k_clusters(benchmark):
+    clusters = synthetic_clusters(10000)
+    result = benchmark(output_list_for_tsv, clusters)
+    assert len(result) == 10000
+
+
+@pytest.mark.parametrize("binary", [os.path.basename(sys.executable), "no-such-binary"])
+def test_which(benchmark, binary):
+    benchmark(which, binary)
+
+
+def test_match_output_classifiers(benchmark):
+    def classify():
+        return [management_cluster_components_missing_matching_expressions(o) for o in CLASSIFIER_OUTPUTS]
+
+    assert benchmark(classify) == [True, True, True, None]
+
+
+def test_match_output_pod_status(benchmark):
+    output = "capi-controller-manager-7d8c6b5b9d-x2x9z   1/1     Running   0          5m\n" * 20
+    assert benchmark(match_output, output, r"capi-controller-manager-.+?Running")
+
+
+def test_extension_import_time(benchmark):
+    script = ("import time; start = time.perf_counter(); import azext_capi.custom; "
+              "print(time.perf_counter() - start)")
+
+    def import_extension():
+        return float(subprocess.check_output([sys.executable, "-c", script], universal_newlines=True))
+
+    benchmark.measure(import_extension, rounds=5)
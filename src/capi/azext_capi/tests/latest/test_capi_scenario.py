@@ -63,12 +63,16 @@ class CapiScenarioTest(ScenarioTest):
             tsv = self.cmd("capi list --output tsv").output
             self.assertEqual(tsv, '2022-05-27T20:53:08Z\tdefault-4377\tdefault\tProvisioned\n2022-05-27T20:58:06Z\ttestcluster1\tdefault\tProvisioned\n')
 
-            self.assertEqual(mock.call_count, 3)
+            table = self.cmd("capi list --output table").output.splitlines()
+            self.assertEqual(table[0].split(), ["Name", "Phase", "Created", "Namespace"])
+            self.assertEqual(table[3].split(), ["testcluster1", "Provisioned", "2022-05-27T20:58:06Z", "default"])
+
+            self.assertEqual(mock.call_count, 4)
 
     @patch('azext_capi.custom.exit_if_no_management_cluster')
     def test_capi_show(self, mock_def):
         # Test that error is raised if no args are passed
-        with self.assertRaises(SystemExit):
+        with self.assertRaises(RequiredArgumentMissingError):
             self.cmd('capi show')
 
         with patch('subprocess.check_output') as mock:
@@ -84,7 +88,31 @@ class CapiScenarioTest(ScenarioTest):
             tsv = self.cmd("capi show --name testcluster1 --output tsv").output
             self.assertEqual(tsv, '2022-05-27T20:58:06Z\ttestcluster1\tdefault\tProvisioned\n')
 
-            self.assertEqual(mock.call_count, 3)
+            table = self.cmd("capi show --name testcluster1 --output table").output.splitlines()
+            self.assertEqual(table[2].split(), ["testcluster1", "Provisioned", "2022-05-27T20:58:06Z", "default"])
+
+            self.assertEqual(mock.call_count, 4)
+
+    @patch('azext_capi.custom.exit_if_no_management_cluster')
+    def test_capi_show_multiple(self, mock_def):
+        with patch('subprocess.check_output') as mock:
+            mock.return_value = AZ_CAPI_LIST_JSON
+            result = self.cmd('capi show -n testcluster1 missing default-4377 --output json').get_output_in_json()
+            self.assertEqual([c['metadata']['name'] for c in result], ['testcluster1', 'missing', 'default-4377'])
+            self.assertEqual(result[0]['kind'], 'Cluster')
+            self.assertEqual(result[1]['error']['code'], 'NotFound')
+            self.assertEqual(mock.call_count, 1)
+            self.assertEqual(mock.call_args[0][0], ["kubectl", "get", "clusters", "--output", "json"])
+
+            tsv = self.cmd('capi show -n testcluster1 missing --output tsv').output
+            self.assertEqual(tsv, '2022-05-27T20:58:06Z\ttestcluster1\tdefault\tProvisioned\n')
+
+            names_file = os.path.join(self.create_temp_dir(), 'names.txt')
+            with open(names_file, 'w') as f:
+                f.write('# dashboard clusters\ndefault-4377\n\ntestcluster1\n')
+            table = self.cmd(f'capi show --names-from-file {names_file} --output table').output.splitlines()
+            self.assertEqual(table[2].split(), ["default-4377", "Provisioned", "2022-05-27T20:53:08Z", "default"])
+            self.assertEqual(table[3].split(), ["testcluster1", "Provisioned", "2022-05-27T20:58:06Z", "default"])
 
     @patch('azext_capi.custom.is_self_managed_cluster', return_value=False)
     @patch('azext_capi.custom.exit_if_no_management_cluster')
@@ -3,22 +3,48 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+import io
+import itertools
+import json
 import subprocess
 import os
 import sys
 import tempfile
+import threading
 import unittest
 from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, Mock
 
+from azure.cli.core.azclierror import FileOperationError
+from azure.cli.core.azclierror import RequiredArgumentMissingError
 from azure.cli.core.azclierror import UnclassifiedUserFault
 from azure.cli.core.azclierror import ResourceNotFoundError
-
+from azure.cli.core.azclierror import MutuallyExclusiveArgumentError
+from azure.cli.core.azclierror import InvalidArgumentValueError
+
+import azext_capi._format as output_format
+import azext_capi.helpers.cache as cache
+import azext_capi.helpers.describe as describe
+import azext_capi.helpers.envsubst as envsubst
+import azext_capi.helpers.journal as journal
+import azext_capi.helpers.kubeconfig as kubeconfig
+import azext_capi.helpers.manifest as manifest
 import azext_capi.helpers.network as network
+from six.moves.urllib.error import HTTPError, URLError  # pylint: disable=import-error
 import azext_capi.helpers.generic as generic
-from azext_capi.custom import create_resource_group, create_new_management_cluster, get_user_prompt_or_default, management_cluster_components_missing_matching_expressions
-from azext_capi.helpers.kubectl import check_kubectl_namespace, find_attribute_in_context, find_kubectl_current_context, find_default_cluster, add_kubeconfig_to_command
+from azext_capi.custom import apply_workload_cluster_manifest, get_cni_manifest, validate_workload_cluster_args
+from azext_capi.helpers.template import find_missing_builtin_template_args, get_builtin_template_variables
+from azext_capi.helpers.template import render_custom_cluster_template
+from azext_capi.custom import list_workload_clusters, run_preflight_checks, wait_for_workload_cluster
+from azext_capi.custom import create_resource_group, create_new_management_cluster, get_user_prompt_or_default, management_cluster_components_missing_matching_expressions, find_management_cluster, is_self_managed_cluster
+from azext_capi.helpers.kubectl import WEBHOOK_SERVICES, apply_objects, wait_for_webhooks
+from azext_capi.helpers.kubectl import get_machine_ready_timeout, summarize_machines, wait_for_machines
+from azext_capi.helpers.kubectl import check_kubectl_namespace, find_attribute_in_context, find_kubectl_current_context, find_default_cluster, add_kubeconfig_to_command, reset_current_context_and_attributes
+from azext_capi.helpers.kubectl import delete_context_and_attributes, follow_resources, iter_json_documents, watch_resources
+from azext_capi.helpers.os import file_lock, write_to_file
 from azext_capi.helpers.run_command import try_command_with_spinner, run_shell_command
+from azext_capi.tests.simulator import fake_compute_client
 
 
 class TestSSLContextHelper(unittest.TestCase):
@@ -41,12 +67,88 @@ class TestSSLContextHelper(unittest.TestCase):
     ]
 
     def test_ssl_context(self):
+        self.addCleanup(network.ssl_context.cache_clear)
         for case in self.cases:
+            network.ssl_context.cache_clear()
             with patch('azure.cli.core.util.in_cloud_console', return_value=case.cloud_console):
                 with patch.object(sys, 'version_info', (case.major, case.minor)):
                     with patch('platform.system', return_value=case.system):
                         self.assertTrue(network.ssl_context())
 
+    # Test that the SSL context is created once and shared
+    def test_ssl_context_is_cached(self):
+        self.assertIs(network.ssl_context(), network.ssl_context())
+
+
+class FakeHTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = []
+
+    def setup(self):
+        super().setup()
+        self.connections.append(self.client_address)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == "/stable.txt":
+            self.send_response(302)
+            self.send_header("Location", "/v1.24.0/stable.txt")
+            body = b""
+        elif self.path == "/v1.24.0/stable.txt":
+            self.send_response(200)
+            body = b"v1.24.0\n"
+        else:
+            self.send_response(404)
+            body = b"not found"
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class PooledUrlopenTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeHTTPHandler.connections = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHTTPHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(network._pool.clear)  # pylint: disable=protected-access
+        proxies_patch = patch('azext_capi.helpers.network.getproxies', return_value={})
+        proxies_patch.start()
+        self.addCleanup(proxies_patch.stop)
+        self.url = f"http://127.0.0.1:{server.server_port}"
+
+    # Test that sequential requests, including redirects, reuse one keep-alive connection
+    def test_keep_alive(self):
+        for _ in range(3):
+            with network.urlopen(self.url + "/stable.txt") as response:
+                self.assertEqual(response.read(), b"v1.24.0\n")
+                self.assertEqual(response.geturl(), self.url + "/v1.24.0/stable.txt")
+        self.assertEqual(len(FakeHTTPHandler.connections), 1)
+
+    # Test that an error status raises HTTPError and the connection is still reused
+    def test_http_error(self):
+        with self.assertRaises(HTTPError) as ctx:
+            network.urlopen(self.url + "/missing")
+        self.assertEqual(ctx.exception.code, 404)
+        self.assertEqual(ctx.exception.read(), b"not found")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "stable.txt")
+            network.urlretrieve(self.url + "/v1.24.0/stable.txt", filename)
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), b"v1.24.0\n")
+        self.assertEqual(len(FakeHTTPHandler.connections), 1)
+
+    # Test that a response closed before its body is read doesn't return its connection to the pool
+    def test_unread_response(self):
+        network.urlopen(self.url + "/v1.24.0/stable.txt").close()
+        with network.urlopen(self.url + "/v1.24.0/stable.txt") as response:
+            self.assertEqual(response.read(), b"v1.24.0\n")
+        self.assertEqual(len(FakeHTTPHandler.connections), 2)
+
 
 class TestURLRetrieveHelper(unittest.TestCase):
 
@@ -150,62 +252,286 @@ class RunShellMethod(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             run_shell_command(self.command)
 
+    # Test that a command running past its timeout is stopped
+    def test_run_command_timeout(self):
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run_shell_command([sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.5)
+
+
+KUBECONFIG_TEMPLATE = """\
+apiVersion: v1
+kind: Config
+current-context: {context}
+clusters:
+- name: {cluster}
+  cluster:
+    server: https://{cluster}.fake:6443
+    certificate-authority-data: {ca}
+contexts:
+- name: {context}
+  context:
+    cluster: {cluster}
+    user: {user}
+    namespace: fake-namespace
+users:
+- name: {user}
+  user:
+    token: fake-token
+"""
+
+
+def write_fake_kubeconfig(directory, filename, context, cluster, user, ca="ZmFrZQ=="):
+    path = os.path.join(directory, filename)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(KUBECONFIG_TEMPLATE.format(context=context, cluster=cluster, user=user, ca=ca))
+    return path
+
+
+class FakeKubeconfigTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.env_patch = patch.dict(os.environ, {"KUBECONFIG": ""})
+        self.env_patch.start()
+        self.addCleanup(self.env_patch.stop)
+
+    def set_kubeconfig_env(self, *paths):
+        os.environ["KUBECONFIG"] = os.pathsep.join(paths)
+
 
-class FindKubectlCurrentContext(unittest.TestCase):
+class FindKubectlCurrentContext(FakeKubeconfigTestCase):
 
     def setUp(self):
+        super().setUp()
         self.context_name = "fake-context"
-        self.run_shell_patch = patch('azext_capi.helpers.kubectl.run_shell_command')
-        self.run_shell_mock = self.run_shell_patch.start()
-        self.run_shell_mock.return_value = None
-        self.addCleanup(self.run_shell_patch.stop)
 
     # Test found current context
     def test_existing_current_context(self):
-        self.run_shell_mock.return_value = self.context_name
+        self.set_kubeconfig_env(write_fake_kubeconfig(self.directory, "config", self.context_name, "c", "u"))
         result = find_kubectl_current_context()
-        self.assertEquals(result, self.context_name)
-
-    # Test found current context with extra space
-    def test_return_value_is_sanitized(self):
-        self.run_shell_mock.return_value = f"  {self.context_name}  "
-        result = find_kubectl_current_context()
-        self.assertEquals(result, self.context_name)
+        self.assertEqual(result, self.context_name)
 
     # Test does not found current context
     def test_no_found_current_context(self):
-        self.run_shell_mock.return_value = None
-        error = subprocess.CalledProcessError(3, ['fakecommand'], output="current-context is not set")
-        self.run_shell_mock.side_effect = error
+        self.set_kubeconfig_env(write_fake_kubeconfig(self.directory, "config", '""', "c", "u"))
         result = find_kubectl_current_context()
         self.assertIsNone(result)
 
+    # Test no kubeconfig file
+    def test_no_kubeconfig_file(self):
+        self.set_kubeconfig_env(os.path.join(self.directory, "missing"))
+        self.assertIsNone(find_kubectl_current_context())
 
-class FindAttributeInContext(unittest.TestCase):
+
+class FindAttributeInContext(FakeKubeconfigTestCase):
 
     def setUp(self):
+        super().setUp()
         self.context_name = "context-name-fake"
-        self.run_shell_patch = patch('azext_capi.helpers.kubectl.run_shell_command')
-        self.run_shell_mock = self.run_shell_patch.start()
-        self.run_shell_mock.return_value = None
-        self.addCleanup(self.run_shell_patch.stop)
+        self.set_kubeconfig_env(write_fake_kubeconfig(self.directory, "config", self.context_name,
+                                                      "cluster-name-fake", "user-name-fake"))
 
     # Test found cluster in context
     def test_existing_context(self):
-        cluster_name = "cluster-name-fake"
-        context_info = f"* {self.context_name} {cluster_name}"
-        self.run_shell_mock.return_value = context_info
-        result = find_attribute_in_context(self.context_name, "cluster")
-        self.assertEquals(result, cluster_name)
+        self.assertEqual(find_attribute_in_context(self.context_name, "cluster"), "cluster-name-fake")
+        self.assertEqual(find_attribute_in_context(self.context_name, "user"), "user-name-fake")
+        self.assertEqual(find_attribute_in_context(self.context_name, "namespace"), "fake-namespace")
 
     # Test does not found context
     def test_no_existing_context(self):
-        self.run_shell_mock.return_value = None
-        self.run_shell_mock.side_effect = subprocess.CalledProcessError(3, ['fakecommand'])
-        result = find_attribute_in_context(self.context_name, "cluster")
+        result = find_attribute_in_context("bogus", "cluster")
         self.assertIsNone(result)
 
 
+class KubeConfigTest(FakeKubeconfigTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.first = write_fake_kubeconfig(self.directory, "first", "ctx-1", "cluster-1", "user-1")
+        self.second = write_fake_kubeconfig(self.directory, "second", "ctx-2", "cluster-2", "user-2")
+        self.set_kubeconfig_env(self.first, self.second)
+
+    def test_merged_file_chain(self):
+        config = kubeconfig.load_kubeconfig()
+        self.assertEqual(config.current_context, "ctx-1")
+        self.assertEqual(sorted(config.entries["contexts"]), ["ctx-1", "ctx-2"])
+        self.assertEqual(config.cluster("cluster-2")["server"], "https://cluster-2.fake:6443")
+        self.assertIs(kubeconfig.load_kubeconfig(), config)
+
+    def test_reset_current_context_and_attributes(self):
+        reset_current_context_and_attributes()
+        first = kubeconfig.read_kubeconfig_file(self.first)
+        self.assertEqual(first["current-context"], "")
+        self.assertEqual(first["clusters"], [])
+        self.assertEqual(first["contexts"], [])
+        self.assertEqual(first["users"], [])
+        config = kubeconfig.load_kubeconfig()
+        self.assertEqual(config.current_context, "ctx-2")
+        self.assertEqual(list(config.entries["contexts"]), ["ctx-2"])
+
+    # Test that deleting another context keeps current-context, as after a pivot merges the target cluster
+    def test_delete_context_and_attributes(self):
+        delete_context_and_attributes("ctx-2")
+        self.assertEqual(kubeconfig.read_kubeconfig_file(self.second)["contexts"], [])
+        config = kubeconfig.load_kubeconfig()
+        self.assertEqual(config.current_context, "ctx-1")
+        self.assertEqual(list(config.entries["clusters"]), ["cluster-1"])
+        self.assertEqual(list(config.entries["users"]), ["user-1"])
+
+    def test_delete_from_defining_file(self):
+        config = kubeconfig.load_kubeconfig()
+        config.delete("user", "user-2")
+        config.save()
+        self.assertEqual(kubeconfig.read_kubeconfig_file(self.second)["users"], [])
+        self.assertEqual(len(kubeconfig.read_kubeconfig_file(self.first)["users"]), 1)
+        with self.assertRaises(KeyError):
+            config.delete("user", "user-2")
+
+    # Test that save re-reads the file under its lock, keeping entries added since it was loaded
+    def test_save_keeps_concurrent_changes(self):
+        config = kubeconfig.load_kubeconfig()
+        config.delete("user", "user-2")
+        with open(self.second, "a", encoding="utf-8") as f:
+            f.write("- name: other-user\n  user:\n    token: fake\n")
+        config.save()
+        users = kubeconfig.read_kubeconfig_file(self.second)["users"]
+        self.assertEqual([user["name"] for user in users], ["other-user"])
+
+
+class MergeKubeconfigTest(FakeKubeconfigTestCase):
+
+    def test_merge_into_target(self):
+        target = write_fake_kubeconfig(self.directory, "config", "mgmt-ctx", "mgmt", "mgmt-user")
+        workload = write_fake_kubeconfig(self.directory, "workload.kubeconfig", "workload-ctx", "workload", "workload-user")
+        with open(os.path.join(self.directory, "ca.crt"), "wb") as f:
+            f.write(b"fake-ca")
+        with open(workload, "a", encoding="utf-8") as f:
+            f.write("- name: file-user\n  user:\n    client-key: ca.crt\n")
+        environ = dict(os.environ)
+        kubeconfig.merge_kubeconfig_files(workload, target)
+        self.assertEqual(dict(os.environ), environ)
+        self.assertFalse(os.path.exists(target + ".lock"))
+        merged = kubeconfig.KubeConfig([target])
+        self.assertEqual(merged.current_context, "workload-ctx")
+        self.assertEqual(sorted(merged.entries["contexts"]), ["mgmt-ctx", "workload-ctx"])
+        self.assertEqual(merged.user("file-user"), {"client-key-data": "ZmFrZS1jYQ=="})
+        self.assertEqual(sorted(f for f in os.listdir(self.directory) if f.startswith(".")), [])
+
+    # Test that merging keeps the target's preferences and extensions
+    def test_merge_keeps_preferences_and_extensions(self):
+        target = write_fake_kubeconfig(self.directory, "config", "mgmt-ctx", "mgmt", "mgmt-user")
+        workload = write_fake_kubeconfig(self.directory, "workload.kubeconfig", "workload-ctx", "workload", "workload-user")
+        with open(target, "a", encoding="utf-8") as f:
+            f.write("preferences:\n  colors: true\nextensions:\n- name: fake-extension\n  extension:\n    key: value\n")
+        kubeconfig.merge_kubeconfig_files(workload, target)
+        merged = kubeconfig.read_kubeconfig_file(target)
+        self.assertEqual(merged["preferences"], {"colors": True})
+        self.assertEqual(merged["extensions"], [{"name": "fake-extension", "extension": {"key": "value"}}])
+
+    def test_lock_timeout(self):
+        target = os.path.join(self.directory, "config")
+        with open(target + ".lock", "w", encoding="utf-8"):
+            pass
+        with self.assertRaises(FileOperationError):
+            with file_lock(target, timeout=0):
+                pass
+        self.assertTrue(os.path.exists(target + ".lock"))
+
+
+class WriteToFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "cluster.yaml")
+
+    # Test that a stream of chunks is written in order
+    def test_write_chunks(self):
+        write_to_file(self.filename, (f"line {i}\n" for i in range(3)))
+        with open(self.filename, encoding="utf-8") as written:
+            self.assertEqual(written.read(), "line 0\nline 1\nline 2\n")
+        self.assertEqual(os.listdir(self.directory), ["cluster.yaml"])
+
+    # Test that bytes are written unchanged
+    def test_write_bytes(self):
+        write_to_file(self.filename, b"line 0\r\n")
+        with open(self.filename, "rb") as written:
+            self.assertEqual(written.read(), b"line 0\r\n")
+
+    # Test that an interrupted write leaves the previous file and no temporary file behind
+    def test_interrupted_write(self):
+        write_to_file(self.filename, "previous\n")
+
+        def chunks():
+            yield "partial\n"
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            write_to_file(self.filename, chunks())
+        with open(self.filename, encoding="utf-8") as written:
+            self.assertEqual(written.read(), "previous\n")
+        self.assertEqual(os.listdir(self.directory), ["cluster.yaml"])
+
+    # Test that a new file gets the umask's permissions, not the temporary file's private ones
+    @unittest.skipIf(sys.platform == "win32", "POSIX permissions only")
+    def test_new_file_mode(self):
+        umask = os.umask(0o022)
+        try:
+            write_to_file(self.filename, "content\n")
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o644)
+
+    # Test that writing through a symlink updates its target and keeps the link
+    @unittest.skipIf(sys.platform == "win32", "symlinks need privileges on Windows")
+    def test_write_through_symlink(self):
+        target = os.path.join(self.directory, "dotfiles", "config")
+        os.makedirs(os.path.dirname(target))
+        write_to_file(target, "previous\n")
+        os.symlink(target, self.filename)
+
+        write_to_file(self.filename, "content\n")
+        self.assertTrue(os.path.islink(self.filename))
+        with open(target, encoding="utf-8") as written:
+            self.assertEqual(written.read(), "content\n")
+        self.assertEqual(os.listdir(os.path.dirname(target)), ["config"])
+
+
+class IsSelfManagedCluster(FakeKubeconfigTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, cwd)
+        self.check_output_patch = patch('subprocess.check_output')
+        self.check_output_mock = self.check_output_patch.start()
+        self.addCleanup(self.check_output_patch.stop)
+
+    def write_management_kubeconfig(self, cluster, ca="ZmFrZQ=="):
+        path = write_fake_kubeconfig(self.directory, "config", "mgmt-ctx", cluster, "mgmt-user", ca)
+        self.set_kubeconfig_env(path)
+
+    def test_same_server_and_ca(self):
+        self.write_management_kubeconfig("fake")
+        write_fake_kubeconfig(self.directory, "fake.kubeconfig", "fake-admin@fake", "fake", "fake-admin")
+        self.assertTrue(is_self_managed_cluster("fake"))
+        self.check_output_mock.assert_not_called()
+
+    def test_different_server(self):
+        self.write_management_kubeconfig("kind-capi-manager")
+        write_fake_kubeconfig(self.directory, "fake.kubeconfig", "fake-admin@fake", "fake", "fake-admin")
+        self.assertFalse(is_self_managed_cluster("fake"))
+
+    def test_different_ca(self):
+        self.write_management_kubeconfig("fake", ca="b3RoZXI=")
+        write_fake_kubeconfig(self.directory, "fake.kubeconfig", "fake-admin@fake", "fake", "fake-admin")
+        self.assertFalse(is_self_managed_cluster("fake"))
+
+    def test_no_workload_kubeconfig(self):
+        self.write_management_kubeconfig("fake")
+        self.assertFalse(is_self_managed_cluster("fake"))
+
+
 class CreateResourceGroup(unittest.TestCase):
 
     def setUp(self):
@@ -406,3 +732,871 @@ class GetUrlDomainName(unittest.TestCase):
         fake_url = "invalid-url"
         result = network.get_url_domain_name(fake_url)
         self.assertIsNone(result)
+
+
+class OutputListForTable(unittest.TestCase):
+
+    def test_keeps_only_table_fields(self):
+        cluster = {
+            "apiVersion": "cluster.x-k8s.io/v1beta1",
+            "kind": "Cluster",
+            "metadata": {
+                "name": "fake-cluster",
+                "namespace": "default",
+                "creationTimestamp": "2022-05-27T20:58:06Z",
+                "annotations": {"fake": "annotation"},
+                "managedFields": [{"manager": "fake"}],
+            },
+            "spec": {"paused": False},
+            "status": {"phase": "Provisioned", "conditions": [{"type": "Ready"}]},
+        }
+        output = '{"apiVersion": "v1", "kind": "List", "items": [%s]}' % json.dumps(cluster)
+        result = output_format.output_list_for_table(output)
+        item = result["items"][0]
+        self.assertEqual(item["metadata"], {"name": "fake-cluster", "namespace": "default",
+                                            "creationTimestamp": "2022-05-27T20:58:06Z"})
+        self.assertEqual(item["status"], {"phase": "Provisioned"})
+        self.assertNotIn("spec", item)
+        self.assertEqual(output_format.output_for_table(json.dumps(cluster)), item)
+
+
+class ListWorkloadClustersInContextsTest(FakeKubeconfigTestCase):
+
+    def setUp(self):
+        super().setUp()
+        first = write_fake_kubeconfig(self.directory, "first", "eastus", "cluster-1", "user-1")
+        second = write_fake_kubeconfig(self.directory, "second", "westus", "cluster-2", "user-2")
+        self.set_kubeconfig_env(first, second)
+        self.cmd = Mock()
+        self.cmd.cli_ctx.invocation.data = {"output": "table"}
+
+    def fake_run_shell_command(self, command, input_text=None, timeout=None):
+        context = command[command.index("--context") + 1]
+        self.assertEqual(command[-2:], ["--request-timeout", "5s"])
+        self.assertEqual(timeout, 5)
+        if context == "westus":
+            raise subprocess.CalledProcessError(1, command, output="Unable to connect to the server: i/o timeout")
+        cluster = {"kind": "Cluster", "metadata": {"name": f"{context}-cluster", "namespace": "default"},
+                   "spec": {"paused": False}, "status": {"phase": "Provisioned"}}
+        return json.dumps({"kind": "List", "items": [cluster]})
+
+    # Test that every context is queried, clusters get a context column and unreachable contexts don't fail
+    def test_all_contexts(self):
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=self.fake_run_shell_command):
+            result = list_workload_clusters(self.cmd, all_contexts=True, timeout=5)
+        self.assertEqual(result["contexts"], ["eastus", "westus"])
+        self.assertEqual(result["errors"], [{"context": "westus",
+                                             "error": "Unable to connect to the server: i/o timeout"}])
+        self.assertEqual(output_format.output_clusters_list_table(result), [
+            {"context": "eastus", "name": "eastus-cluster", "phase": "Provisioned", "created": None,
+             "namespace": "default"}])
+
+    # Test that contexts can be separated by commas, and duplicates are queried once
+    def test_contexts(self):
+        self.cmd.cli_ctx.invocation.data = {"output": "json"}
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=self.fake_run_shell_command) as run_mock:
+            result = list_workload_clusters(self.cmd, contexts=["eastus,eastus"], timeout=5)
+        self.assertEqual(run_mock.call_count, 1)
+        self.assertEqual(result["items"][0]["spec"], {"paused": False})
+        self.assertEqual(result["items"][0]["context"], "eastus")
+
+    # Test that a context whose kubectl hangs, e.g. in an exec credential plugin, is reported as timed out
+    def test_context_timeout(self):
+        def hang_in_westus(command, input_text=None, timeout=None):
+            if "westus" in command:
+                raise subprocess.TimeoutExpired(command, timeout)
+            return self.fake_run_shell_command(command, input_text, timeout)
+
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=hang_in_westus):
+            result = list_workload_clusters(self.cmd, all_contexts=True, timeout=5)
+        self.assertEqual(result["errors"], [{"context": "westus", "error": "Timed out after 5s"}])
+        self.assertEqual([c["context"] for c in result["items"]], ["eastus"])
+
+
+def fake_watch_event(event_type, name, phase, ready=None):
+    conditions = [{"type": "Ready", "status": ready}] if ready else []
+    cluster = {"kind": "Cluster", "metadata": {"name": name, "namespace": "default"},
+               "status": {"phase": phase, "conditions": conditions}}
+    return event_type, cluster
+
+
+class WatchResourcesTest(unittest.TestCase):
+
+    # Test that indented and single-line JSON documents are decoded one at a time from a stream
+    def test_iter_json_documents(self):
+        indented = json.dumps({"type": "ADDED", "object": {"note": "}\n{"}}, indent=4).splitlines(True)
+        lines = indented + ['{"type": "DELETED", "object": {}}\n']
+        self.assertEqual([d["type"] for d in iter_json_documents(iter(lines))], ["ADDED", "DELETED"])
+
+    # Test that events are streamed from kubectl and a failed watch raises
+    def test_watch_resources(self):
+        process = Mock()
+        process.__enter__ = Mock(return_value=process)
+        process.__exit__ = Mock(return_value=False)
+        process.stdout = iter(['{"type": "ADDED", "object": {"metadata": {"name": "c"}}}\n'])
+        process.poll.return_value = 1
+        process.returncode = 1
+        with patch('azext_capi.helpers.kubectl.subprocess.Popen', return_value=process) as popen_mock:
+            events = watch_resources("clusters", kubeconfig="fake")
+            self.assertEqual(next(events), ("ADDED", {"metadata": {"name": "c"}}))
+            with self.assertRaises(subprocess.CalledProcessError):
+                next(events)
+        command = ["kubectl", "get", "clusters", "--watch", "--output-watch-events", "--output", "json",
+                   "--kubeconfig", "fake"]
+        self.assertEqual(popen_mock.call_args[0][0], command)
+
+
+class WatchWorkloadClustersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = Mock()
+        self.cmd.cli_ctx.invocation.data = {"output": "tsv"}
+        self.watches = [
+            [fake_watch_event("ADDED", "first", "Provisioning"), fake_watch_event("ADDED", "second", "Provisioned"),
+             fake_watch_event("MODIFIED", "first", "Provisioning"),
+             fake_watch_event("MODIFIED", "first", "Provisioned", "False")],
+            [fake_watch_event("ADDED", "first", "Provisioned", "True"),
+             fake_watch_event("DELETED", "first", "Deleting", "True")],
+        ]
+
+    def fake_watch_resources(self, resource_type, kubeconfig=None):
+        self.assertEqual(resource_type, "clusters")
+        if not self.watches:
+            raise KeyboardInterrupt
+        yield from self.watches.pop(0)
+
+    # Test that only changed rows are printed, and clusters deleted while reconnecting are reported
+    def test_watch(self):
+        listed = json.dumps({"items": [{"metadata": {"name": "first", "namespace": "default"}}]})
+        with patch('azext_capi.custom.exit_if_no_management_cluster'), \
+                patch('azext_capi.helpers.kubectl.run_shell_command', return_value=listed) as run_mock, \
+                patch('azext_capi.helpers.kubectl.watch_resources', side_effect=self.fake_watch_resources), \
+                patch('azext_capi.helpers.kubectl.time.sleep') as sleep_mock, \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertIsNone(list_workload_clusters(self.cmd, watch=True))
+        self.assertEqual(run_mock.call_count, 2)
+        # Reconnecting after a watch ends cleanly still waits, so a flapping server isn't hammered
+        self.assertEqual([c[0][0] for c in sleep_mock.call_args_list], [1, 1])
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            "first\tdefault\tProvisioning\t\t\t",
+            "second\tdefault\tProvisioned\t\t\t",
+            "first\tdefault\tProvisioned\tFalse\t\t",
+            "second\tdefault\tDeleted\t\t\t",
+            "first\tdefault\tProvisioned\tTrue\t\t",
+            "first\tdefault\tDeleted\tTrue\t\t",
+        ])
+
+    # Test that an ERROR event counts as a failed watch, retried with a growing delay and then given up
+    def test_error_event_is_retried(self):
+        error = ("ERROR", {"kind": "Status", "message": "too old resource version"})
+        self.watches = [[error]] * 3
+        with patch('azext_capi.helpers.kubectl.watch_resources', side_effect=self.fake_watch_resources), \
+                patch('azext_capi.helpers.kubectl.run_shell_command', return_value='{"items": []}'), \
+                patch('azext_capi.helpers.kubectl.time.sleep') as sleep_mock:
+            with self.assertRaises(UnclassifiedUserFault):
+                list(follow_resources("clusters", max_retries=2))
+        self.assertEqual([c[0][0] for c in sleep_mock.call_args_list], [2, 4])
+
+    # Test that --watch can't be combined with --contexts
+    def test_watch_contexts(self):
+        with self.assertRaises(MutuallyExclusiveArgumentError):
+            list_workload_clusters(self.cmd, contexts=["eastus"], watch=True)
+
+
+class DescribeClustersTest(unittest.TestCase):
+
+    CLUSTERS = [
+        {"kind": "Cluster", "metadata": {"name": "fake-cluster", "namespace": "default"},
+         "spec": {"controlPlaneRef": {"kind": "KubeadmControlPlane", "name": "fake-cluster-control-plane"}},
+         "status": {"phase": "Provisioned", "conditions": [{"type": "Ready", "status": "True"}]}},
+        {"kind": "Cluster", "metadata": {"name": "other-cluster"}, "spec": {}, "status": {"phase": "Provisioning"}},
+    ]
+    CONTROL_PLANES = [
+        {"kind": "KubeadmControlPlane", "metadata": {"name": "fake-cluster-control-plane"},
+         "spec": {"replicas": 1}, "status": {"readyReplicas": 1}},
+    ]
+    NODE_POOLS = [
+        {"kind": "MachineDeployment", "metadata": {"name": "fake-cluster-md-0"},
+         "spec": {"clusterName": "fake-cluster", "replicas": 2}, "status": {"readyReplicas": 1}},
+        {"kind": "MachineDeployment", "metadata": {"name": "other-cluster-md-0"},
+         "spec": {"clusterName": "other-cluster", "replicas": 1}},
+    ]
+
+    def setUp(self):
+        self.machines = [
+            fake_machine("cp-0", "Running", control_plane="fake-cluster-control-plane"),
+            fake_machine("md-1", "Provisioning", "False", deployment="fake-cluster-md-0"),
+            fake_machine("md-0", "Running", deployment="fake-cluster-md-0"),
+        ]
+
+    # Test that objects are joined to their cluster by label, spec or control plane reference
+    def test_join(self):
+        details = describe.describe_clusters(self.CLUSTERS, self.CONTROL_PLANES, self.NODE_POOLS, self.machines)
+        fake, other = details
+        self.assertEqual(fake["controlPlane"]["name"], "fake-cluster-control-plane")
+        self.assertEqual([m["name"] for m in fake["controlPlane"]["machines"]], ["cp-0"])
+        self.assertEqual([p["name"] for p in fake["nodePools"]], ["fake-cluster-md-0"])
+        self.assertEqual([m["name"] for m in fake["nodePools"][0]["machines"]], ["md-0", "md-1"])
+        self.assertIsNone(other["controlPlane"])
+        self.assertEqual([p["name"] for p in other["nodePools"]], ["other-cluster-md-0"])
+        self.assertEqual(other["nodePools"][0]["machines"], [])
+
+    # Test that the table output draws each cluster as a tree with replica counts
+    def test_tree_table(self):
+        details = describe.describe_clusters(self.CLUSTERS[:1], self.CONTROL_PLANES, self.NODE_POOLS, self.machines)
+        rows = output_format.output_clusters_table(details[0])
+        self.assertEqual([r["name"] for r in rows], [
+            "Cluster/fake-cluster",
+            "├─KubeadmControlPlane/fake-cluster-control-plane",
+            "│ └─Machine/cp-0",
+            "└─MachineDeployment/fake-cluster-md-0",
+            "  ├─Machine/md-0",
+            "  └─Machine/md-1",
+        ])
+        self.assertEqual(rows[3]["replicas"], "1/2")
+        self.assertEqual(rows[5]["phase"], "Provisioning")
+
+
+class ManagementClusterCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_dir_patch = patch('azext_capi.helpers.cache.get_config_dir', return_value=self.config_dir)
+        self.config_dir_patch.start()
+        self.addCleanup(self.config_dir_patch.stop)
+        self.ttl_patch = patch('azext_capi.helpers.cache.get_management_cache_ttl', return_value=60)
+        self.ttl_mock = self.ttl_patch.start()
+        self.addCleanup(self.ttl_patch.stop)
+        self.key = "fake-key"
+
+    def test_verified_within_ttl(self):
+        self.assertFalse(cache.is_management_cluster_verified(self.key))
+        cache.set_management_cluster_verified(self.key)
+        self.assertTrue(cache.is_management_cluster_verified(self.key))
+        self.assertFalse(cache.is_management_cluster_verified("other-key"))
+
+    def test_expired_entry(self):
+        cache.set_management_cluster_verified(self.key)
+        with patch('time.time', return_value=sys.maxsize):
+            self.assertFalse(cache.is_management_cluster_verified(self.key))
+
+    def test_disabled_with_zero_ttl(self):
+        self.ttl_mock.return_value = 0
+        cache.set_management_cluster_verified(self.key)
+        self.assertFalse(cache.is_management_cluster_verified(self.key))
+
+    def test_invalidate(self):
+        cache.set_management_cluster_verified(self.key)
+        cache.set_management_cluster_verified("other-key")
+        cache.invalidate_management_cluster(self.key)
+        self.assertFalse(cache.is_management_cluster_verified(self.key))
+        self.assertTrue(cache.is_management_cluster_verified("other-key"))
+        cache.invalidate_management_cluster()
+        self.assertFalse(cache.is_management_cluster_verified("other-key"))
+
+    def test_management_cluster_key(self):
+        path = write_fake_kubeconfig(self.config_dir, "config", "fake-context", "fake-cluster", "fake-user")
+        with patch.dict(os.environ, {"KUBECONFIG": path}):
+            self.assertTrue(cache.get_management_cluster_key())
+        with patch.dict(os.environ, {"KUBECONFIG": os.path.join(self.config_dir, "missing")}):
+            self.assertIsNone(cache.get_management_cluster_key())
+
+    @patch('azext_capi.helpers.cache.get_management_cluster_key', return_value="fake-key")
+    def test_find_management_cluster_skips_probe(self, _):
+        with patch('azext_capi.custom.check_management_cluster_components') as probe_mock:
+            find_management_cluster()
+            find_management_cluster()
+            probe_mock.assert_called_once()
+
+    @patch('azext_capi.helpers.cache.get_management_cluster_key', return_value="fake-key")
+    def test_find_management_cluster_failure_invalidates(self, _):
+        cache.set_management_cluster_verified(self.key)
+        with patch('azext_capi.helpers.cache.is_management_cluster_verified', return_value=False):
+            with patch('azext_capi.custom.check_management_cluster_components') as probe_mock:
+                probe_mock.side_effect = ResourceNotFoundError("fake")
+                with self.assertRaises(ResourceNotFoundError):
+                    find_management_cluster()
+        self.assertFalse(cache.is_management_cluster_verified(self.key))
+
+
+class ApplyWorkloadClusterManifestTest(unittest.TestCase):
+
+    MANIFEST = """\
+apiVersion: cluster.x-k8s.io/v1beta1
+kind: Cluster
+metadata:
+  name: fake-cluster
+---
+apiVersion: infrastructure.cluster.x-k8s.io/v1beta1
+kind: AzureMachineTemplate
+metadata:
+  name: fake-cluster-md-0
+spec:
+  template:
+    spec:
+      vmSize: {vm_size}
+"""
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_dir_patch = patch('azext_capi.helpers.cache.get_config_dir', return_value=self.config_dir)
+        self.config_dir_patch.start()
+        self.addCleanup(self.config_dir_patch.stop)
+        self.key_patch = patch('azext_capi.helpers.cache.get_management_cluster_key', return_value="fake-key")
+        self.key_patch.start()
+        self.addCleanup(self.key_patch.stop)
+        self.exists_patch = patch('azext_capi.helpers.kubectl.cluster_exists', return_value=True)
+        self.exists_mock = self.exists_patch.start()
+        self.addCleanup(self.exists_patch.stop)
+        self.spinner_patch = patch('azext_capi.custom.Spinner')
+        self.spinner_patch.start()
+        self.addCleanup(self.spinner_patch.stop)
+        self.cmd = Mock()
+
+    def write_manifest(self, vm_size):
+        self.manifest = manifest.Manifest.from_yaml(self.MANIFEST.format(vm_size=vm_size))
+
+    @staticmethod
+    def apply_all(objects):
+        return {manifest.object_key(obj): "serverside-applied" for obj in objects}, {}
+
+    # Test that the whole manifest is applied once, then skipped while it is unchanged
+    def test_unchanged_manifest_is_skipped(self):
+        self.write_manifest("Standard_D2s_v3")
+        with patch('azext_capi.helpers.kubectl.apply_objects', side_effect=self.apply_all) as apply_mock:
+            apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+            apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+            apply_mock.assert_called_once()
+            self.assertEqual(len(apply_mock.call_args[0][0]), 2)
+
+    # Test that only changed objects are sent to kubectl
+    def test_only_changed_objects_are_applied(self):
+        self.write_manifest("Standard_D2s_v3")
+        with patch('azext_capi.helpers.kubectl.apply_objects', side_effect=self.apply_all) as apply_mock:
+            apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+            self.write_manifest("Standard_D4s_v3")
+            apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+            changed = apply_mock.call_args[0][0]
+            self.assertEqual([obj["kind"] for obj in changed], ["AzureMachineTemplate"])
+            self.assertEqual(changed[0]["spec"]["template"]["spec"]["vmSize"], "Standard_D4s_v3")
+
+    # Test that digests are ignored if the cluster no longer exists or after it was deleted
+    def test_missing_or_deleted_cluster_is_reapplied(self):
+        self.write_manifest("Standard_D2s_v3")
+        with patch('azext_capi.helpers.kubectl.apply_objects', side_effect=self.apply_all) as apply_mock:
+            apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+            self.exists_mock.return_value = False
+            apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+            self.exists_mock.return_value = True
+            cache.invalidate_applied_manifest_digests("fake-cluster")
+            apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+            self.assertEqual(apply_mock.call_count, 3)
+
+    # Test that only the objects that were applied are recorded when others fail
+    def test_failed_objects_are_not_recorded(self):
+        self.write_manifest("Standard_D2s_v3")
+        cluster_key = "cluster.x-k8s.io/Cluster//fake-cluster"
+        result = ({cluster_key: "serverside-applied"}, {"infrastructure.cluster.x-k8s.io/AzureMachineTemplate//fake-cluster-md-0": "webhook error"})
+        with patch('azext_capi.helpers.kubectl.apply_objects', return_value=result):
+            with self.assertRaisesRegex(ResourceNotFoundError, "AzureMachineTemplate//fake-cluster-md-0: webhook error"):
+                apply_workload_cluster_manifest(self.cmd, "fake-cluster", self.manifest)
+        self.assertEqual(list(cache.get_applied_manifest_digests("fake-key", "fake-cluster")), [cluster_key])
+
+
+def fake_machine(name, phase, ready="True", deployment=None, control_plane=None):
+    labels = {"cluster.x-k8s.io/cluster-name": "fake-cluster"}
+    if deployment:
+        labels["cluster.x-k8s.io/deployment-name"] = deployment
+    if control_plane:
+        labels["cluster.x-k8s.io/control-plane-name"] = control_plane
+    return {"kind": "Machine", "metadata": {"name": name, "labels": labels},
+            "status": {"phase": phase, "conditions": [{"type": "Ready", "status": ready}]}}
+
+
+class WaitForMachinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sleep_patch = patch('time.sleep')
+        self.sleep_patch.start()
+        self.addCleanup(self.sleep_patch.stop)
+        self.polls = [
+            [fake_machine("cp-0", "Provisioning", "False", control_plane="fake-cluster-control-plane"),
+             fake_machine("md-0", "Pending", "False", deployment="fake-cluster-md-0"),
+             fake_machine("md-1", "Pending", "False", deployment="fake-cluster-md-0")],
+            [fake_machine("cp-0", "Running", control_plane="fake-cluster-control-plane"),
+             fake_machine("md-0", "Running", "False", deployment="fake-cluster-md-0"),
+             fake_machine("md-1", "Provisioning", "False", deployment="fake-cluster-md-0")],
+            [fake_machine("cp-0", "Running", control_plane="fake-cluster-control-plane"),
+             fake_machine("md-0", "Running", deployment="fake-cluster-md-0"),
+             fake_machine("md-1", "Running", deployment="fake-cluster-md-0")],
+        ]
+        self.commands = []
+
+    def fake_run_shell_command(self, command, input_text=None):
+        self.commands.append(command)
+        items = self.polls.pop(0) if len(self.polls) > 1 else self.polls[0]
+        return json.dumps({"kind": "List", "items": items})
+
+    # Test that machines are grouped by owner and by phase until they are Running
+    def test_summarize_machines(self):
+        summary = summarize_machines(self.polls[1])
+        self.assertEqual((summary["running"], summary["total"]), (1, 3))
+        self.assertEqual(summary["phases"], {"Running": 1, "Provisioning": 1})
+        self.assertEqual(summary["owners"]["KubeadmControlPlane/fake-cluster-control-plane"]["running"], 1)
+        self.assertEqual(summary["owners"]["MachineDeployment/fake-cluster-md-0"]["total"], 2)
+
+    # Test that each poll lists machines once and reports progress only when it changes
+    def test_progress_is_reported(self):
+        progress = []
+        self.polls.insert(1, self.polls[0])
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=self.fake_run_shell_command):
+            wait_for_machines(cluster_name="fake-cluster", progress=progress.append)
+        self.assertEqual(progress, ["0/3 Running (Pending: 2, Provisioning: 1)",
+                                    "1/3 Running (Provisioning: 1, Running: 1)",
+                                    "3/3 Running"])
+        self.assertEqual(len(self.commands), 4)
+        self.assertEqual(self.commands[0], ["kubectl", "get", "machines", "--all-namespaces", "--output", "json",
+                                            "--selector", "cluster.x-k8s.io/cluster-name=fake-cluster"])
+
+    # Test that the deadline scales with the number of machines and the error lists each owner
+    def test_timeout_scales_with_machine_count(self):
+        self.polls = self.polls[:1]
+        clock = itertools.count(step=100)
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=self.fake_run_shell_command), \
+                patch('time.time', side_effect=lambda: next(clock)):
+            with self.assertRaises(ResourceNotFoundError) as context:
+                wait_for_machines()
+        self.assertEqual(get_machine_ready_timeout(3), 300 + 3 * 30)
+        self.assertIn("after 390 seconds: 0/3 Running", context.exception.error_msg)
+        self.assertIn("MachineDeployment/fake-cluster-md-0: 0/2 Running (Pending: 2)", context.exception.error_msg)
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_patch = patch('azext_capi.helpers.cache.get_config_dir', return_value=self.config_dir)
+        self.config_patch.start()
+        self.addCleanup(self.config_patch.stop)
+        self.args = {"CLUSTER_NAME": "fake-cluster", "WORKER_MACHINE_COUNT": 3}
+
+    def record_steps(self):
+        create = journal.Journal.for_operation("create", "fake-cluster", self.args)
+        create.record("environment")
+        create.record("kubeconfig", "fake-cluster.kubeconfig")
+
+    # Test that completed steps and their outputs are kept for a resumed run with the same arguments
+    def test_resume(self):
+        self.record_steps()
+        resumed = journal.Journal.for_operation("create", "fake-cluster", dict(self.args), resume=True)
+        self.assertTrue(resumed.done("environment"))
+        self.assertFalse(resumed.done("cni"))
+        self.assertEqual(resumed.output("kubeconfig"), "fake-cluster.kubeconfig")
+
+    # Test that a run without resume, or with other arguments, starts from the beginning
+    def test_start_over(self):
+        self.record_steps()
+        self.args["WORKER_MACHINE_COUNT"] = 5
+        self.assertFalse(journal.Journal.for_operation("create", "fake-cluster", self.args, resume=True).steps)
+        self.record_steps()
+        self.assertFalse(journal.Journal.for_operation("create", "fake-cluster", self.args).steps)
+
+    # Test that the journal is discarded when the operation completes, and kept when it fails
+    def test_context_manager(self):
+        with self.assertRaises(ValueError):
+            with journal.Journal.for_operation("create", "fake-cluster", self.args) as create:
+                create.record("environment")
+                raise ValueError("interrupted")
+        self.assertTrue(os.path.exists(journal.get_journal_path("create", "fake-cluster")))
+        with journal.Journal.for_operation("create", "fake-cluster", self.args, resume=True) as create:
+            self.assertTrue(create.done("environment"))
+        self.assertFalse(os.path.exists(journal.get_journal_path("create", "fake-cluster")))
+
+
+class PreflightChecksTest(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('azext_capi.custom.Spinner', 'azext_capi.custom.find_management_cluster'):
+            active_patch = patch(target)
+            active_patch.start()
+            self.addCleanup(active_patch.stop)
+
+    def run_checks(self, compute, machine_counts, kubernetes_version="1.22.8", user_provided_template=None):
+        with patch('azext_capi._client_factory.cf_compute_service', return_value=compute):
+            run_preflight_checks(Mock(), "eastus", machine_counts, kubernetes_version, user_provided_template)
+
+    # Test that a cluster that fits passes
+    def test_checks_pass(self):
+        self.run_checks(fake_compute_client(), {"Standard_D2s_v3": 6})
+
+    # Test that every problem is reported in one error
+    def test_problems_are_combined(self):
+        compute = fake_compute_client(cores_limit=10, image_skus=["k8s-1dot21dot2-ubuntu-2004"])
+        with self.assertRaises(InvalidArgumentValueError) as context:
+            self.run_checks(compute, {"Standard_D2s_v3": 6, "Standard_Fake": 1})
+        msg = context.exception.error_msg
+        self.assertIn('VM size "Standard_Fake" is not available in eastus', msg)
+        self.assertIn("cores quota in eastus is too low: 12 vCPUs needed, 10 of 10 available", msg)
+        self.assertIn("standardDSv3Family quota", msg)
+        self.assertIn("No cncf-upstream/capi image is published for Kubernetes 1.22.8", msg)
+
+    # Test that restricted sizes are reported
+    def test_restricted_size(self):
+        compute = fake_compute_client()
+        compute.resource_skus.list.return_value[0].restrictions = [
+            Mock(type="Location", values=["EastUS"], reason_code="NotAvailableForSubscription")]
+        with self.assertRaises(InvalidArgumentValueError) as context:
+            self.run_checks(compute, {"Standard_D2s_v3": 1})
+        self.assertIn("restricted for this subscription", context.exception.error_msg)
+
+    # Test that custom templates skip the Azure checks, since they set their own sizes and image
+    def test_custom_template(self):
+        compute = fake_compute_client(cores_limit=0, image_skus=[])
+        self.run_checks(compute, {"Standard_Fake": 1}, user_provided_template="cluster.yaml")
+        compute.resource_skus.list.assert_not_called()
+        compute.usage.list.assert_not_called()
+        compute.virtual_machine_images.list_skus.assert_not_called()
+
+    # Test that a check that can't run doesn't block the operation
+    def test_failed_check_is_skipped(self):
+        compute = fake_compute_client()
+        compute.resource_skus.list.side_effect = HTTPError("url", 403, "Forbidden", {}, None)
+        self.run_checks(compute, {"Standard_D2s_v3": 1})
+
+
+class WaitForWorkloadClusterTest(unittest.TestCase):
+
+    # Test that exactly one condition is required
+    def test_one_condition_required(self):
+        with self.assertRaises(RequiredArgumentMissingError):
+            wait_for_workload_cluster(Mock(), "fake-cluster")
+        with self.assertRaises(MutuallyExclusiveArgumentError):
+            wait_for_workload_cluster(Mock(), "fake-cluster", created=True, deleted=True)
+
+    # Test that waiting for creation watches the Cluster's Ready condition
+    def test_created_uses_kubectl_wait(self):
+        with patch('azext_capi.custom.exit_if_no_management_cluster'), patch('azext_capi.custom.Spinner'), \
+                patch('azext_capi.helpers.kubectl.run_shell_command') as run_mock:
+            wait_for_workload_cluster(Mock(), "fake-cluster", created=True, timeout=60)
+        run_mock.assert_called_once_with(["kubectl", "wait", "cluster/fake-cluster", "--for", "condition=Ready",
+                                          "--timeout", "60s"])
+
+    # Test that waiting for a self-managed cluster's deletion requires its resource group and doesn't probe it
+    def test_deleted_self_managed(self):
+        with patch('azext_capi.custom.exit_if_no_management_cluster') as exit_mock, \
+                patch('azext_capi.custom.Spinner'), \
+                patch('azext_capi.custom.is_self_managed_cluster', return_value=True), \
+                patch('azext_capi.custom.run_shell_command') as run_mock:
+            with self.assertRaises(RequiredArgumentMissingError):
+                wait_for_workload_cluster(Mock(), "fake-cluster", deleted=True)
+            wait_for_workload_cluster(Mock(), "fake-cluster", deleted=True, resource_group_name="fake-rg", timeout=60)
+        exit_mock.assert_not_called()
+        run_mock.assert_called_once_with(["az", "group", "wait", "--deleted", "--name", "fake-rg",
+                                          "--timeout", "60"])
+
+
+class ApplyObjectsTest(unittest.TestCase):
+
+    OBJECTS = [
+        {"apiVersion": "cluster.x-k8s.io/v1beta1", "kind": "Cluster", "metadata": {"name": "fake-cluster"}},
+        {"apiVersion": "infrastructure.cluster.x-k8s.io/v1beta1", "kind": "AzureCluster", "metadata": {"name": "fake-cluster"}},
+    ]
+
+    def setUp(self):
+        self.sleep_patch = patch('time.sleep')
+        self.sleep_patch.start()
+        self.addCleanup(self.sleep_patch.stop)
+        self.failures = {"AzureCluster": 2}
+        self.applies = []
+        self.webhook_checks = 0
+
+    def fake_run_shell_command(self, command, input_text=None):
+        if command[:3] == ["kubectl", "get", "endpoints"]:
+            self.webhook_checks += 1
+            return json.dumps({"subsets": [{"addresses": [{"ip": "10.0.0.1"}]}]})
+        self.assertEqual(command, ["kubectl", "apply", "--server-side", "--field-manager", "az-capi",
+                                   "--force-conflicts", "-f", "-"])
+        kind = manifest.load_manifest(input_text)[0]["kind"]
+        self.applies.append(kind)
+        if self.failures.get(kind):
+            self.failures[kind] -= 1
+            raise subprocess.CalledProcessError(1, command, output="failed calling webhook")
+        return f"{kind.lower()} serverside-applied\n"
+
+    # Test that only failed objects are retried, after checking the webhooks
+    def test_only_failed_objects_are_retried(self):
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=self.fake_run_shell_command):
+            applied, failed = apply_objects(self.OBJECTS)
+        self.assertEqual(failed, {})
+        self.assertEqual(len(applied), 2)
+        self.assertEqual(sorted(self.applies), ["AzureCluster"] * 3 + ["Cluster"])
+        self.assertEqual(self.webhook_checks, 2 * len(WEBHOOK_SERVICES))
+
+    # Test that objects which never apply are reported with their last error
+    def test_timeout_reports_failed_objects(self):
+        self.failures["AzureCluster"] = sys.maxsize
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=self.fake_run_shell_command):
+            with patch('time.time', side_effect=itertools.count(0, 200)):
+                applied, failed = apply_objects(self.OBJECTS, timeout=300)
+        self.assertEqual(list(applied), ["cluster.x-k8s.io/Cluster//fake-cluster"])
+        self.assertEqual(failed, {"infrastructure.cluster.x-k8s.io/AzureCluster//fake-cluster": "failed calling webhook"})
+
+    # Test that retries wait until every webhook service has ready endpoints
+    def test_wait_for_webhooks(self):
+        outputs = [json.dumps({"subsets": [{"notReadyAddresses": [{"ip": "10.0.0.1"}]}]})]
+        outputs += [json.dumps({"subsets": [{"addresses": [{"ip": "10.0.0.1"}]}]})] * len(WEBHOOK_SERVICES)
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=outputs):
+            self.assertTrue(wait_for_webhooks(sys.maxsize))
+        with patch('azext_capi.helpers.kubectl.run_shell_command', side_effect=subprocess.CalledProcessError(1, "kubectl")):
+            self.assertFalse(wait_for_webhooks(0))
+
+
+class FetchCachedTest(unittest.TestCase):
+
+    URL = "https://example.com/calico.yaml"
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_dir_patch = patch('azext_capi.helpers.cache.get_config_dir', return_value=self.config_dir)
+        self.config_dir_patch.start()
+        self.addCleanup(self.config_dir_patch.stop)
+        self.urlopen_patch = patch('azext_capi.helpers.network.urlopen', side_effect=self.fake_urlopen)
+        self.urlopen_mock = self.urlopen_patch.start()
+        self.addCleanup(self.urlopen_patch.stop)
+        self.content = b"kind: DaemonSet\n"
+        self.requests = []
+
+    def fake_urlopen(self, request, context=None):
+        self.requests.append(request)
+        if request.headers.get("If-none-match") == '"v1"':
+            raise HTTPError(request.full_url, 304, "Not Modified", {}, None)
+        response = io.BytesIO(self.content)
+        response.headers = {"ETag": '"v1"', "Last-Modified": "Mon, 01 Aug 2022 00:00:00 GMT"}
+        return response
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    # Test that a fresh copy is used without any request
+    def test_fresh_copy_is_reused(self):
+        path = network.fetch_cached(self.URL, max_age=60)
+        self.assertEqual(self.read(path), self.content)
+        self.assertEqual(network.fetch_cached(self.URL, max_age=60), path)
+        self.assertEqual(len(self.requests), 1)
+
+    # Test that a stale copy is revalidated with its ETag and Last-Modified date
+    def test_stale_copy_is_revalidated(self):
+        path = network.fetch_cached(self.URL)
+        self.assertEqual(network.fetch_cached(self.URL), path)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1].headers["If-none-match"], '"v1"')
+        self.assertEqual(self.requests[1].headers["If-modified-since"], "Mon, 01 Aug 2022 00:00:00 GMT")
+
+    # Test that a copy whose content hash doesn't match is downloaded again
+    def test_corrupted_copy_is_downloaded(self):
+        path = network.fetch_cached(self.URL, max_age=60)
+        with open(path, "wb") as f:
+            f.write(b"garbage")
+        network.fetch_cached(self.URL, max_age=60)
+        self.assertEqual(self.read(path), self.content)
+        self.assertNotIn("If-none-match", self.requests[1].headers)
+
+    # Test that the cached copy is used when the URL can't be reached
+    def test_offline(self):
+        self.urlopen_mock.side_effect = URLError("no route to host")
+        with self.assertRaises(URLError):
+            network.fetch_cached(self.URL)
+        self.urlopen_mock.side_effect = self.fake_urlopen
+        path = network.fetch_cached(self.URL)
+        self.urlopen_mock.side_effect = URLError("no route to host")
+        self.assertEqual(network.fetch_cached(self.URL), path)
+
+    # Test that CNI manifests are pinned and fall back to the URL if they can't be cached
+    def test_get_cni_manifest(self):
+        path = get_cni_manifest("calico.yaml")
+        self.assertEqual(self.read(path), self.content)
+        self.assertIn("/v1.4.0/templates/addons/calico.yaml", self.requests[0].full_url)
+        self.urlopen_mock.side_effect = URLError("no route to host")
+        url = get_cni_manifest("windows/calico/calico.yaml")
+        self.assertTrue(url.startswith("https://raw.githubusercontent.com/"))
+
+
+class RenderCustomClusterTemplateTest(unittest.TestCase):
+
+    TEMPLATE = "name: ${CLUSTER_NAME}\nreplicas: ${WORKER_MACHINE_COUNT:=3}\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cluster-template.yaml")
+        with open(self.path, "w", encoding="utf-8") as template_file:
+            template_file.write(self.TEMPLATE)
+        self.fetch_patch = patch('azext_capi.helpers.template.fetch_cached', return_value=self.path)
+        self.fetch_mock = self.fetch_patch.start()
+        self.addCleanup(self.fetch_patch.stop)
+        self.config_path = os.path.join(self.directory, "clusterctl.yaml")
+        config_patch = patch('azext_capi.helpers.envsubst.get_clusterctl_config_path', return_value=self.config_path)
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+
+    # Test that template URLs are rendered from the URL cache, with GitHub blob URLs made raw
+    @patch('azext_capi.helpers.template.get_url_cache_max_age', return_value=600)
+    def test_url_is_cached(self, _):
+        url = "https://github.com/org/repo/blob/main/templates/cluster-template.yaml"
+        self.assertEqual(render_custom_cluster_template(url, {"CLUSTER_NAME": "fake"}), "name: fake\nreplicas: 3\n")
+        self.fetch_mock.assert_called_once_with(
+            "https://raw.githubusercontent.com/org/repo/main/templates/cluster-template.yaml", max_age=600)
+
+    # Test that local files are rendered in-process without touching the environment
+    def test_local_file(self):
+        with patch.dict(os.environ, {"WORKER_MACHINE_COUNT": "5"}, clear=True):
+            result = render_custom_cluster_template(self.path, {"CLUSTER_NAME": "fake", "EMPTY": None})
+            self.assertEqual(os.environ, {"WORKER_MACHINE_COUNT": "5"})
+        self.assertEqual(result, "name: fake\nreplicas: 5\n")
+        self.fetch_mock.assert_not_called()
+
+    # Test that clusterctl.yaml supplies variables, with environment variables and args taking precedence
+    def test_clusterctl_config(self):
+        with open(self.config_path, "w", encoding="utf-8") as config_file:
+            config_file.write("CLUSTER_NAME: config\nWORKER_MACHINE_COUNT: 4\nproviders:\n  - name: azure\n")
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(render_custom_cluster_template(self.path), "name: config\nreplicas: 4\n")
+        with patch.dict(os.environ, {"WORKER_MACHINE_COUNT": "5"}, clear=True):
+            result = render_custom_cluster_template(self.path, {"CLUSTER_NAME": "fake"})
+        self.assertEqual(result, "name: fake\nreplicas: 5\n")
+
+    # Test that every missing variable is reported
+    def test_missing_variables(self):
+        with open(self.path, "a", encoding="utf-8") as template_file:
+            template_file.write("location: ${AZURE_LOCATION}\n")
+        with patch.dict(os.environ, {}, clear=True):
+            with self.assertRaisesRegex(RequiredArgumentMissingError, "AZURE_LOCATION, CLUSTER_NAME"):
+                render_custom_cluster_template(self.path)
+
+
+class EnvsubstTest(unittest.TestCase):
+
+    # Test clusterctl's variable forms and default semantics
+    def test_envsubst(self):
+        variables = {"SET": "value", "EMPTY": ""}
+        cases = [
+            ("${SET}", "value"),
+            ("$SET-suffix", "value-suffix"),
+            ("${ SET }", "value"),
+            ("${UNSET:=default}", "default"),
+            ("${UNSET:-default}", "default"),
+            ("${EMPTY:=default}", "default"),
+            ("${EMPTY=default}", ""),
+            ("${EMPTY-default}", ""),
+            ("${SET:=default}", "value"),
+            ("${UNSET=}", ""),
+            ("price: 5$", "price: 5$"),
+            ("${UNSET:=${SET}}", "value"),
+            ("${UNSET:=${ALSO_UNSET:-${SET}-x}}/y", "value-x/y"),
+            ("${SET:=${UNSET}}", "value"),
+            ("${UNSET:=a", "${UNSET:=a"),
+        ]
+        for template, expected in cases:
+            self.assertEqual(envsubst.envsubst(template, variables), expected, template)
+
+    # Test that variables with defaults aren't reported as missing
+    def test_find_missing_variables(self):
+        template = "${B} ${A} $C ${D:=d} ${E-e} ${EMPTY} ${B}"
+        self.assertEqual(envsubst.find_missing_variables(template, {"EMPTY": ""}), ["A", "B", "C"])
+        self.assertEqual(envsubst.get_variables(template), ["B", "A", "C", "D", "E", "EMPTY"])
+        nested = "${A:=${B:-${C}}} ${D:=${E}}"
+        self.assertEqual(envsubst.find_missing_variables(nested, {"D": "d"}), ["C"])
+        self.assertEqual(envsubst.get_variables(nested), ["A", "B", "C", "D", "E"])
+
+
+class BuiltinTemplateVariablesTest(unittest.TestCase):
+
+    # Test that variables are collected from base.jinja and its includes, minus the ones it sets
+    def test_builtin_template_variables(self):
+        variables = get_builtin_template_variables()
+        self.assertIn("CLUSTER_NAME", variables)
+        self.assertIn("AZURE_SSH_PUBLIC_KEY_B64", variables)  # only used in AzureMachinePool.yaml
+        self.assertNotIn("SUFFIX", variables)
+        self.assertIs(get_builtin_template_variables(), variables)
+
+    # Test that every missing argument and environment variable is reported in one error
+    def test_validate_workload_cluster_args(self):
+        args = {name: "value" for name in get_builtin_template_variables()}
+        self.assertEqual(find_missing_builtin_template_args(args), [])
+        del args["WINDOWS"]
+        del args["CLUSTER_NAME"]
+        self.assertEqual(find_missing_builtin_template_args(args), ["CLUSTER_NAME", "WINDOWS"])
+        with patch.dict(os.environ, {"AZURE_CLIENT_ID": "id", "AZURE_TENANT_ID": "tenant"}, clear=True):
+            with self.assertRaises(RequiredArgumentMissingError) as cm:
+                validate_workload_cluster_args(args)
+        msg = cm.exception.error_msg
+        self.assertIn("AZURE_CLIENT_SECRET, AZURE_SUBSCRIPTION_ID", msg)
+        self.assertIn("CLUSTER_NAME, WINDOWS", msg)
+
+    # Test that custom templates only need the environment variables
+    def test_validate_custom_template_args(self):
+        env = {"AZURE_CLIENT_ID": "id", "AZURE_CLIENT_SECRET": "secret", "AZURE_SUBSCRIPTION_ID": "sub", "AZURE_TENANT_ID": "tenant"}
+        with patch.dict(os.environ, env, clear=True):
+            validate_workload_cluster_args({}, user_provided_template="template.yaml")
+            with self.assertRaises(RequiredArgumentMissingError):
+                validate_workload_cluster_args({})
+
+
+class ManifestTest(unittest.TestCase):
+
+    MANIFEST = """\
+apiVersion: cluster.x-k8s.io/v1beta1
+kind: Cluster
+metadata:
+  name: fake-cluster
+  namespace: default
+spec:
+  infrastructureRef:
+    kind: AzureCluster
+    name: fake-cluster
+---
+---
+apiVersion: cluster.x-k8s.io/v1beta1
+kind: MachineDeployment
+metadata:
+  name: fake-cluster-md-0
+---
+apiVersion: cluster.x-k8s.io/v1beta1
+kind: MachineDeployment
+metadata:
+  name: fake-cluster-md-win
+"""
+
+    # Test that objects are parsed in order, skipping empty documents
+    def test_parse(self):
+        parsed = manifest.Manifest.from_yaml(self.MANIFEST)
+        self.assertEqual([o.name for o in parsed], ["fake-cluster", "fake-cluster-md-0", "fake-cluster-md-win"])
+        cluster = parsed.objects[0]
+        self.assertEqual((cluster.kind, cluster.name, cluster.namespace), ("Cluster", "fake-cluster", "default"))
+        self.assertEqual(cluster.key, "cluster.x-k8s.io/Cluster/default/fake-cluster")
+
+    # Test that serializing keeps key order and round-trips
+    def test_dump_manifest(self):
+        parsed = manifest.Manifest.from_yaml(self.MANIFEST)
+        text = manifest.dump_manifest(parsed)
+        self.assertTrue(text.startswith("---\napiVersion: cluster.x-k8s.io/v1beta1\nkind: Cluster\n"))
+        self.assertEqual(manifest.Manifest.from_yaml(text).digests(), parsed.digests())
+
+    # Test that incomplete and duplicated objects are reported
+    def test_validate(self):
+        self.assertEqual(manifest.Manifest.from_yaml(self.MANIFEST).validate(), [])
+        parsed = manifest.Manifest.from_yaml(self.MANIFEST + "---\nkind: Secret\n---\n" + self.MANIFEST.split("---")[0])
+        self.assertEqual(parsed.validate(), [
+            "object 4 needs apiVersion, kind and metadata.name",
+            "cluster.x-k8s.io/Cluster/default/fake-cluster is defined more than once",
+        ])
+
+    # Test that objects with unquoted YAML dates and timestamps can be digested
+    def test_digest_dates(self):
+        parsed = manifest.Manifest.from_yaml(self.MANIFEST + "  annotations:\n    expires: 2026-10-19\n"
+                                             "    updated: 2026-10-19T12:00:00Z\n")
+        digests = parsed.digests()
+        self.assertEqual(len(digests), 3)
+        changed = manifest.Manifest.from_yaml(self.MANIFEST + "  annotations:\n    expires: 2026-10-20\n"
+                                              "    updated: 2026-10-19T12:00:00Z\n")
+        self.assertEqual([o.name for o in changed.changed(digests)], ["fake-cluster-md-win"])
@@ -0,0 +1,130 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import platform
+import unittest
+from unittest.mock import MagicMock, patch
+
+import azext_capi.helpers.journal as journal_helpers
+from azext_capi.helpers.cache import load_json_cache, save_json_cache
+from azext_capi.helpers.constants import MANAGEMENT_RG_NAME
+from azext_capi.tests.simulator import Simulator, count_retries
+from azext_capi.tests.simulator.bench import run_pipeline
+
+
+@unittest.skipIf(platform.system() == "Windows", "The simulator uses POSIX shell shims")
+class SimulatorPipelineTest(unittest.TestCase):
+
+    def test_create_and_delete(self):
+        results = run_pipeline(["create", "delete"], sleep_scale=0)
+        self.assertEqual([r["error"] for r in results], [None, None])
+        self.assertEqual([r["retries"] for r in results], [0, 0])
+        self.assertTrue(all(r["subprocesses"] > 0 for r in results))
+
+    def test_rerun_create_skips_unchanged_manifest(self):
+        results = run_pipeline(["create", "create"], sleep_scale=0)
+        self.assertEqual([r["error"] for r in results], [None, None])
+        self.assertLess(results[1]["subprocesses"], results[0]["subprocesses"])
+
+    def test_create_and_pivot(self):
+        results = run_pipeline(["create", "pivot"], sleep_scale=0)
+        self.assertEqual([r["error"] for r in results], [None, None])
+
+    def test_create_with_pivot_reads_target_kubeconfig(self):
+        # pylint: disable=import-outside-toplevel
+        from azext_capi.custom import create_workload_cluster
+
+        resource_group = MagicMock()
+        resource_group.get.return_value.location = "eastus"
+        with Simulator() as sim, \
+                patch("azext_capi._client_factory.cf_resource_groups", return_value=resource_group):
+            result = create_workload_cluster(sim.cmd, "sim-cluster", location="eastus", pivot=True, yes=True)
+            self.assertEqual(result["metadata"]["name"], "sim-cluster")
+            move = next(i for i, c in enumerate(sim.calls()) if c["args"][:1] == ["move"])
+            reads = [c["args"] for c in sim.calls()[move:] if c["args"][:2] == ["get", "cluster"]]
+            self.assertEqual(reads, [["get", "cluster", "sim-cluster", "--output", "json",
+                                      "--kubeconfig", "sim-cluster.kubeconfig"]])
+
+    def test_no_wait_and_wait(self):
+        # pylint: disable=import-outside-toplevel
+        from azext_capi.custom import create_workload_cluster, delete_workload_cluster, wait_for_workload_cluster
+
+        resource_group = MagicMock()
+        resource_group.get.return_value.location = "eastus"
+        with Simulator() as sim, \
+                patch("azext_capi._client_factory.cf_resource_groups", return_value=resource_group):
+            create_workload_cluster(sim.cmd, "sim-cluster", location="eastus", no_wait=True, yes=True)
+            self.assertFalse(any(c["tool"] == "clusterctl" and c["args"][:1] == ["get"] for c in sim.calls()))
+            self.assertFalse(os.path.exists("sim-cluster.kubeconfig"))
+            wait_for_workload_cluster(sim.cmd, "sim-cluster", nodes_ready=True)
+            self.assertTrue(os.path.exists("sim-cluster.kubeconfig"))
+            self.assertTrue(sim.state()["servers"]["https://sim-cluster.sim.local:6443"]["cni"])
+            delete_workload_cluster(sim.cmd, "sim-cluster", no_wait=True, yes=True)
+            self.assertIn("--wait=false", sim.calls()[-1]["args"])
+            wait_for_workload_cluster(sim.cmd, "sim-cluster", deleted=True)
+
+    def test_resume_skips_completed_steps(self):
+        # pylint: disable=import-outside-toplevel
+        import azext_capi.custom as custom
+        from azure.cli.core.azclierror import ResourceNotFoundError
+
+        resource_group = MagicMock()
+        resource_group.get.return_value.location = "eastus"
+        apply_calico_manifest = custom.apply_calico_manifest
+        failures = [ResourceNotFoundError("Couldn't install CNI after waiting 5 minutes.")]
+
+        def flaky_apply_calico_manifest(*args):
+            if failures:
+                raise failures.pop()
+            apply_calico_manifest(*args)
+
+        with Simulator() as sim, \
+                patch("azext_capi._client_factory.cf_resource_groups", return_value=resource_group), \
+                patch("azext_capi.custom.apply_calico_manifest", side_effect=flaky_apply_calico_manifest):
+            with self.assertRaises(ResourceNotFoundError):
+                custom.create_workload_cluster(sim.cmd, "sim-cluster", location="eastus", yes=True)
+            # The resource group of an AKS management cluster is restored with the skipped environment step
+            journal_path = journal_helpers.get_journal_path("create", "sim-cluster")
+            data = load_json_cache(journal_path)
+            self.assertEqual(data["steps"]["environment"]["output"], {"management_resource_group": None})
+            data["steps"]["environment"]["output"] = {"management_resource_group": "sim-management-rg"}
+            save_json_cache(journal_path, data)
+            first_call = len(sim.calls())
+            with patch.dict(os.environ):
+                os.environ.pop(MANAGEMENT_RG_NAME, None)
+                custom.create_workload_cluster(sim.cmd, "sim-cluster", location="eastus", resume=True, yes=True)
+                self.assertEqual(os.environ[MANAGEMENT_RG_NAME], "sim-management-rg")
+            resumed = [" ".join([c["tool"]] + c["args"]) for c in sim.calls()[first_call:]]
+            self.assertFalse(any(c.startswith("kubectl create secret") for c in resumed))
+            self.assertFalse(any(c.startswith("kubectl apply --server-side") for c in resumed))
+            self.assertFalse(any(c.startswith("clusterctl get kubeconfig") for c in resumed))
+            self.assertTrue(sim.state()["servers"]["https://sim-cluster.sim.local:6443"]["cni"])
+
+    def test_injected_failures_are_retried(self):
+        failures = [{"command": "kubectl apply --server-side", "object": "AzureCluster/sim-cluster", "count": 2}]
+        results = run_pipeline(["create"], sleep_scale=0, failures=failures, kubeconfig_after=1)
+        self.assertIsNone(results[0]["error"])
+        self.assertEqual(results[0]["retries"], 3)
+
+
+class CountRetriesTest(unittest.TestCase):
+
+    def test_count_retries(self):
+        calls = [
+            {"tool": "kubectl", "args": ["apply", "-f", "a.yaml"], "exit_code": 1},
+            {"tool": "kubectl", "args": ["apply", "-f", "a.yaml"], "exit_code": 0},
+            {"tool": "kubectl", "args": ["apply", "-f", "calico.yaml"], "exit_code": 0},
+            {"tool": "clusterctl", "args": ["get", "kubeconfig", "a"], "exit_code": 1},
+            {"tool": "clusterctl", "args": ["get", "kubeconfig", "a"], "exit_code": 0},
+        ]
+        self.assertEqual(count_retries(calls), 2)
+
+    def test_simulator_restores_environment(self):
+        path, cwd = os.environ.get("PATH"), os.getcwd()
+        with Simulator() as sim:
+            self.assertTrue(os.environ["PATH"].startswith(sim.bin_dir))
+        self.assertEqual(os.environ.get("PATH"), path)
+        self.assertEqual(os.getcwd(), cwd)
@@ -0,0 +1,233 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+A local simulator for the kubectl, clusterctl, kind and az executables.
+
+Simulator puts stand-in executables first on the PATH and points HOME, AZURE_CONFIG_DIR and the
+working directory at a scratch directory, so `az capi` pipelines run end to end offline.
+Latency and failures can be injected per command prefix, and failures can be limited to calls
+that read a given object from stdin, for example:
+
+    failures = [{"command": "kubectl apply", "object": "AzureCluster/sim-cluster", "count": 2}]
+    with Simulator(latency={"clusterctl init": 2.0}, failures=failures) as sim:
+        create_workload_cluster(sim.cmd, "sim-cluster", location="eastus", yes=True)
+        print(sim.calls())
+"""
+
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from urllib.error import HTTPError
+
+import yaml
+
+from .fakecli import MANAGEMENT_NAMESPACES, kubeconfig_for
+
+FAKECLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakecli.py")
+TOOLS = ("kubectl", "clusterctl", "kind", "az")
+MANAGEMENT_SERVER = "https://127.0.0.1:6443"
+
+# Served for every URL the extension downloads, such as the Calico manifests
+DOWNLOADED_MANIFEST = b"""\
+apiVersion: apps/v1
+kind: DaemonSet
+metadata:
+  name: calico-node
+  namespace: kube-system
+"""
+
+# The simulator's environment is baked into the shims because some test harnesses replace
+# os.environ with a copy, which child processes don't inherit.
+SHIM = """\
+#!/bin/sh
+export CAPI_SIMULATOR_DIR="{root}" HOME="{home}"
+unset KUBECONFIG
+exec "{python}" "{fakecli}" "$(basename "$0")" "$@"
+"""
+
+
+class Simulator():  # pylint: disable=too-many-instance-attributes
+    """Runs `az capi` commands against simulated executables in a scratch directory. See the module docstring."""
+
+    def __init__(self, latency=0.0, *, failures=None, kubeconfig_after=0,  # pylint: disable=too-many-arguments
+                 management_cluster=True, management_name="capi-manager", root=None):
+        if not isinstance(latency, dict):
+            latency = {"default": latency}
+        self.config = {
+            "latency": latency,
+            "failures": [dict(f) for f in failures or []],
+            "kubeconfig_after": kubeconfig_after,
+            "kind_server": MANAGEMENT_SERVER,
+        }
+        self.management_cluster = management_cluster
+        self.management_name = management_name
+        self.root = root
+        self._owns_root = root is None
+        self._patches = []
+        self._cwd = None
+        self.cmd = fake_cmd()
+        self.compute = fake_compute_client()
+        self.downloads = []
+
+    @property
+    def bin_dir(self):
+        """Holds the stand-in executables, first on the PATH."""
+        return os.path.join(self.root, "bin")
+
+    @property
+    def work_dir(self):
+        """The working directory while the simulator runs."""
+        return os.path.join(self.root, "work")
+
+    @property
+    def home_dir(self):
+        """HOME while the simulator runs, holding .kube/config and .azure."""
+        return os.path.join(self.root, "home")
+
+    def __enter__(self):
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix="capi-sim-")
+        for directory in (self.bin_dir, self.work_dir, self.home_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._write_shims()
+        self._write_state()
+        env = {
+            "PATH": self.bin_dir + os.pathsep + os.environ.get("PATH", ""),
+            "HOME": self.home_dir,
+            "USERPROFILE": self.home_dir,
+            "AZURE_CONFIG_DIR": os.path.join(self.home_dir, ".azure"),
+            "CAPI_SIMULATOR_DIR": self.root,
+            "AZURE_CLIENT_ID": "sim-client-id",
+            "AZURE_CLIENT_SECRET": "sim-client-secret",
+            "AZURE_SUBSCRIPTION_ID": "sim-subscription-id",
+            "AZURE_TENANT_ID": "sim-tenant-id",
+        }
+        for active_patch in (patch.dict(os.environ, env),
+                             patch("azext_capi.helpers.network.urlopen", side_effect=self._urlopen),
+                             patch("azext_capi._client_factory.cf_compute_service", return_value=self.compute)):
+            active_patch.start()
+            self._patches.append(active_patch)
+        os.environ.pop("KUBECONFIG", None)
+        self._cwd = os.getcwd()
+        os.chdir(self.work_dir)
+        return self
+
+    def __exit__(self, *args):
+        os.chdir(self._cwd)
+        for active_patch in reversed(self._patches):
+            active_patch.stop()
+        self._patches = []
+        if self._owns_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+    def _write_shims(self):
+        for tool in TOOLS:
+            path = os.path.join(self.bin_dir, tool)
+            with open(path, "w", encoding="utf-8") as shim:
+                shim.write(SHIM.format(root=self.root, home=self.home_dir, python=sys.executable, fakecli=FAKECLI))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    def _write_state(self):
+        state = {"config": self.config, "servers": {}, "kubeconfig_polls": {}}
+        if self.management_cluster:
+            state["servers"][MANAGEMENT_SERVER] = {
+                "up": True, "namespaces": sorted(MANAGEMENT_NAMESPACES), "secrets": [], "objects": {},
+                "cni": True, "nodes": [f"{self.management_name}-control-plane"],
+            }
+            kubeconfig = yaml.safe_load(kubeconfig_for(self.management_name, MANAGEMENT_SERVER))
+            context = f"kind-{self.management_name}"
+            kubeconfig["clusters"][0]["name"] = context
+            kubeconfig["contexts"][0] = {"name": context, "context": {"cluster": context, "user": context}}
+            kubeconfig["users"][0]["name"] = context
+            kubeconfig["current-context"] = context
+            os.makedirs(os.path.join(self.home_dir, ".kube"), exist_ok=True)
+            with open(os.path.join(self.home_dir, ".kube", "config"), "w", encoding="utf-8") as f:
+                yaml.safe_dump(kubeconfig, f)
+        with open(os.path.join(self.root, "state.json"), "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1)
+
+    def _urlopen(self, request, context=None):  # pylint: disable=unused-argument
+        url = getattr(request, "full_url", request)
+        etag = '"sim-etag"'
+        if getattr(request, "headers", {}).get("If-none-match") == etag:
+            raise HTTPError(url, 304, "Not Modified", {}, None)
+        self.downloads.append(url)
+        response = io.BytesIO(DOWNLOADED_MANIFEST)
+        response.headers = {"ETag": etag}
+        return response
+
+    def state(self):
+        """Returns the current simulated world."""
+        with open(os.path.join(self.root, "state.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def calls(self):
+        """Returns every simulated invocation so far, in order."""
+        try:
+            with open(os.path.join(self.root, "calls.jsonl"), encoding="utf-8") as log:
+                return [json.loads(line) for line in log]
+        except FileNotFoundError:
+            return []
+
+
+def fake_cmd(output="json"):
+    """Returns a stand-in for the knack command object passed to `az capi` commands."""
+    cmd = MagicMock()
+    cmd.cli_ctx.get_progress_controller.return_value.is_running.return_value = False
+    cmd.cli_ctx.invocation.data = {"output": output}
+    cmd.cli_ctx.cloud.name = "AzureCloud"
+    return cmd
+
+
+def fake_compute_client(vm_sizes=("Standard_D2s_v3",), cores_limit=100, image_skus=("k8s-1dot22dot8-ubuntu-2004",)):
+    """Returns a stand-in for the Azure compute client used by the preflight checks."""
+    compute = MagicMock()
+    compute.resource_skus.list.return_value = [
+        SimpleNamespace(name=size, resource_type="virtualMachines", family="standardDSv3Family", restrictions=[],
+                        capabilities=[SimpleNamespace(name="vCPUs", value="2")])
+        for size in vm_sizes
+    ]
+    compute.usage.list.return_value = [
+        SimpleNamespace(name=SimpleNamespace(value=name, localized_value=name), current_value=0, limit=cores_limit)
+        for name in ("cores", "standardDSv3Family")
+    ]
+    compute.virtual_machine_images.list_skus.return_value = [SimpleNamespace(name=sku) for sku in image_skus]
+    return compute
+
+
+def command_key(call):
+    """
+    Returns the tool and sub-command words of a call, e.g. "kubectl apply" or "clusterctl get kubeconfig",
+    followed by the objects read from stdin, if any.
+    """
+    words = [call["tool"]]
+    for arg in call["args"]:
+        if arg.startswith("-") or len(words) == 3:
+            break
+        words.append(arg)
+    words = words[:3] if call["tool"] == "clusterctl" else words[:2]
+    return " ".join(words + call.get("objects", []))
+
+
+def count_retries(calls):
+    """Returns how many calls repeat a command that failed earlier in the same list of calls."""
+    failed, retries = set(), 0
+    for call in calls:
+        key = command_key(call)
+        if key in failed:
+            retries += 1
+        if call["exit_code"] != 0:
+            failed.add(key)
+        else:
+            failed.discard(key)
+    return retries
@@ -0,0 +1,109 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+End-to-end benchmark of `az capi` pipelines against the local simulator.
+
+    python -m azext_capi.tests.simulator.bench create pivot --latency 0.2 --fail "kubectl apply:2"
+
+Each step is run in order in one simulated world and reported with its wall-clock time,
+subprocess count and retry count. Retry delays are real sleeps unless --sleep-scale is given.
+"""
+
+import argparse
+import json
+import sys
+import time
+from unittest.mock import MagicMock, patch
+
+from azext_capi.tests.simulator import Simulator, count_retries
+
+STEPS = ("create", "pivot", "delete")
+
+
+def run_step(sim, step, cluster_name):
+    """Runs one step of the pipeline, "create", "pivot" or "delete", against the simulator."""
+    # pylint: disable=import-outside-toplevel
+    from azext_capi.custom import create_workload_cluster, delete_workload_cluster, pivot_cluster
+
+    if step == "create":
+        create_workload_cluster(sim.cmd, cluster_name, location="eastus", yes=True)
+    elif step == "pivot":
+        pivot_cluster(sim.cmd, f"{cluster_name}.kubeconfig")
+    elif step == "delete":
+        delete_workload_cluster(sim.cmd, cluster_name, resource_group_name=cluster_name, yes=True)
+    else:
+        raise ValueError(f"Unknown step {step}")
+
+
+def run_pipeline(steps, cluster_name="sim-cluster", sleep_scale=1.0, **simulator_args):
+    """Runs the steps in order against one simulator and returns a result dict per step."""
+    results = []
+    real_sleep = time.sleep
+    resource_group = MagicMock()
+    resource_group.get.return_value.location = "eastus"
+    with Simulator(**simulator_args) as sim, \
+            patch("azext_capi._client_factory.cf_resource_groups", return_value=resource_group), \
+            patch("time.sleep", side_effect=lambda seconds: real_sleep(seconds * sleep_scale)):
+        for step in steps:
+            first_call = len(sim.calls())
+            start = time.perf_counter()
+            error = None
+            try:
+                run_step(sim, step, cluster_name)
+            except Exception as err:  # pylint: disable=broad-except
+                error = f"{type(err).__name__}: {err}"
+            wall_clock = time.perf_counter() - start
+            calls = sim.calls()[first_call:]
+            results.append({
+                "step": step,
+                "wall_clock": round(wall_clock, 3),
+                "subprocesses": len(calls),
+                "retries": count_retries(calls),
+                "subprocess_time": round(sum(c["end"] - c["start"] for c in calls), 3),
+                "error": error,
+            })
+            if error:
+                break
+    return results
+
+
+def parse_failure(value):
+    """Parses a --fail value such as "kubectl apply:2" into a simulator failure."""
+    command, _, count = value.rpartition(":")
+    if not command or not count.isdigit():
+        raise argparse.ArgumentTypeError('expected "<command prefix>:<count>"')
+    return {"command": command, "count": int(count)}
+
+
+def main(argv=None):
+    """Runs the pipeline from the command line and prints a summary of each step."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("steps", nargs="*", choices=STEPS, default=["create", "delete"])
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every simulated command")
+    parser.add_argument("--fail", type=parse_failure, action="append", default=[],
+                        help='Fail the first N calls matching a command, e.g. "kubectl apply:2"')
+    parser.add_argument("--kubeconfig-after", type=int, default=0,
+                        help="Number of 'clusterctl get kubeconfig' calls that fail before it is available")
+    parser.add_argument("--sleep-scale", type=float, default=1.0, help="Multiplier for retry delays")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run_pipeline(args.steps, sleep_scale=args.sleep_scale, latency=args.latency,
+                           failures=args.fail, kubeconfig_after=args.kubeconfig_after)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'step':<8}{'wall-clock':>12}{'subprocesses':>14}{'retries':>9}{'in subprocess':>15}")
+        for result in results:
+            print(f"{result['step']:<8}{result['wall_clock']:>11.3f}s{result['subprocesses']:>14}"
+                  f"{result['retries']:>9}{result['subprocess_time']:>14.3f}s")
+            if result["error"]:
+                print(f"  failed: {result['error']}")
+    return 1 if any(r["error"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
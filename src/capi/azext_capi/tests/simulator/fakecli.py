@@ -0,0 +1,506 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+A stand-in for the kubectl, clusterctl, kind and az executables, driven by a JSON state file.
+
+Each invocation is run as "fakecli.py <tool> <args...>" by a small shim named after the tool.
+The simulated world lives in $CAPI_SIMULATOR_DIR/state.json: one entry per API server, keyed by
+server URL, holding namespaces, secrets and applied objects. The server a command talks to is
+found the same way kubectl does, from --kubeconfig/--context, $KUBECONFIG or $HOME/.kube/config.
+Every invocation is appended to calls.jsonl with its timing and exit code.
+
+This module only depends on the standard library and PyYAML so it starts quickly.
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+
+import yaml
+
+MANAGEMENT_NAMESPACES = {
+    "capz-system": "capz-controller-manager",
+    "capi-system": "capi-controller-manager",
+    "capi-kubeadm-bootstrap-system": "capi-kubeadm-bootstrap-controller-manager",
+    "capi-kubeadm-control-plane-system": "capi-kubeadm-control-plane-controller-manager",
+    "cert-manager": "cert-manager",
+}
+
+KINDS = {
+    "cluster": "Cluster",
+    "azurecluster": "AzureCluster",
+    "machine": "Machine",
+    "kubeadmcontrolplane": "KubeadmControlPlane",
+    "kcp": "KubeadmControlPlane",
+    "machinedeployment": "MachineDeployment",
+    "md": "MachineDeployment",
+    "machinepool": "MachinePool",
+    "mp": "MachinePool",
+    "secret": "Secret",
+}
+
+GROUPS = {
+    "Cluster": "cluster.x-k8s.io",
+    "Machine": "cluster.x-k8s.io",
+    "MachineDeployment": "cluster.x-k8s.io",
+    "MachinePool": "cluster.x-k8s.io",
+    "KubeadmControlPlane": "controlplane.cluster.x-k8s.io",
+    "AzureCluster": "infrastructure.cluster.x-k8s.io",
+}
+
+VALUE_FLAGS = {
+    "--output", "-o", "--kubeconfig", "--context", "--namespace", "-n", "--for", "--timeout", "-f",
+    "--filename", "--field-manager", "--request-timeout", "--name", "-l", "--selector", "--to-kubeconfig",
+    "--infrastructure", "--from", "--management-group", "--contract", "-g", "--resource-group", "--location",
+    "--from-literal", "--node-count", "--network-plugin", "--network-policy",
+}
+
+CLUSTER_NAME_LABEL = "cluster.x-k8s.io/cluster-name"
+
+
+class CommandError(Exception):
+    """A simulated command failure, written to stderr with exit code 1."""
+
+
+def parse_args(args):
+    """Returns positional arguments and a dict of flags; repeated flags keep the last value."""
+    positional, flags = [], {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith("-") and arg != "-":
+            if "=" in arg:
+                name, value = arg.split("=", 1)
+                flags[name] = value
+            elif arg in VALUE_FLAGS and i + 1 < len(args):
+                flags[arg] = args[i + 1]
+                i += 1
+            else:
+                flags[arg] = True
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, flags
+
+
+def flag(flags, *names, default=None):
+    """Returns the value of the first of names found in flags, or default."""
+    for name in names:
+        if name in flags:
+            return flags[name]
+    return default
+
+
+def kind_of(resource):
+    """Returns the Kind for a kubectl resource name such as "clusters" or "kcp.controlplane", or None."""
+    resource = resource.split(".")[0].lower()
+    if resource in KINDS:
+        return KINDS[resource]
+    if resource.endswith("s") and resource[:-1] in KINDS:
+        return KINDS[resource[:-1]]
+    return None
+
+
+class World():
+    """The simulated API servers and config, loaded from and saved to state.json."""
+
+    def __init__(self, root):
+        self.root = root
+        self.stdin = ""
+        self.state_path = os.path.join(root, "state.json")
+        with open(self.state_path, encoding="utf-8") as f:
+            self.state = json.load(f)
+        self.config = self.state["config"]
+
+    def save(self):
+        """Atomically writes the state back to state.json."""
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    # Failure injection and latency
+
+    def inject(self, command_line, objects):
+        """Raises CommandError if an injected failure matches the command and the objects it reads."""
+        for failure in self.config.get("failures", []):
+            if failure.get("object") and failure["object"] not in objects:
+                continue
+            if failure.get("count", 0) > 0 and failure["command"] in command_line:
+                failure["count"] -= 1
+                raise CommandError(failure.get("message", f"simulated failure of {failure['command']}"))
+
+    def latency(self, command_line):
+        """Returns the latency of the longest configured prefix of the command, in seconds."""
+        latency = self.config.get("latency", {})
+        best, value = "", latency.get("default", 0)
+        for prefix, seconds in latency.items():
+            if command_line.startswith(prefix) and len(prefix) > len(best):
+                best, value = prefix, seconds
+        return value
+
+    # Kubeconfig resolution
+
+    def kubeconfig_paths(self, flags):
+        """Returns the kubeconfig files a command reads, like kubectl."""
+        kubeconfig = flag(flags, "--kubeconfig")
+        if kubeconfig:
+            return [kubeconfig]
+        env_value = os.environ.get("KUBECONFIG")
+        if env_value:
+            return [p for p in env_value.split(os.pathsep) if p]
+        return [os.path.join(os.path.expanduser("~"), ".kube", "config")]
+
+    def server_url(self, flags):
+        """Returns the API server URL of the context a command uses."""
+        current, contexts, clusters = None, {}, {}
+        for path in self.kubeconfig_paths(flags):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    document = yaml.safe_load(f) or {}
+            except FileNotFoundError:
+                continue
+            current = current or document.get("current-context")
+            for entry in document.get("contexts") or []:
+                contexts.setdefault(entry["name"], entry.get("context") or {})
+            for entry in document.get("clusters") or []:
+                clusters.setdefault(entry["name"], entry.get("cluster") or {})
+        context_name = flag(flags, "--context") or current
+        if not context_name or context_name not in contexts:
+            raise CommandError("error: current-context is not set")
+        cluster = clusters.get(contexts[context_name].get("cluster"), {})
+        return cluster.get("server")
+
+    def server(self, flags):
+        """Returns the URL and state of the API server a command uses, failing if it is down."""
+        url = self.server_url(flags)
+        server = self.state["servers"].get(url)
+        if server is None or not server.get("up", True):
+            raise CommandError(f"The connection to the server {url} was refused - "
+                               "did you specify the right host or port?")
+        return url, server
+
+    def add_server(self, url):
+        """Returns the state of the API server at url, adding an empty one if needed."""
+        return self.state["servers"].setdefault(url, {
+            "up": True, "namespaces": [], "secrets": [], "objects": {}, "cni": False, "nodes": [],
+        })
+
+    # Objects
+
+    @staticmethod
+    def key(kind, name):
+        """Returns the key of an object in a server's "objects", e.g. "Cluster/my-cluster"."""
+        return f"{kind}/{name}"
+
+    def objects_of_kind(self, server, kind):
+        """Returns the objects of a kind on a server, with Machines derived from their owners."""
+        if kind == "Machine":
+            return self.machines(server)
+        return [o for k, o in server["objects"].items() if k.split("/")[0] == kind]
+
+    def machines(self, server):
+        """Returns a Running Machine for each replica of every control plane and MachineDeployment."""
+        machines = []
+        control_planes = {c["spec"].get("controlPlaneRef", {}).get("name"): c["metadata"]["name"]
+                          for c in self.objects_of_kind(server, "Cluster")}
+        owners = self.objects_of_kind(server, "KubeadmControlPlane") + self.objects_of_kind(server, "MachineDeployment")
+        for owner in owners:
+            labels = dict(owner["metadata"].get("labels") or {})
+            cluster = owner["spec"].get("clusterName") or control_planes.get(owner["metadata"]["name"], "")
+            labels[CLUSTER_NAME_LABEL] = cluster
+            if owner["kind"] == "KubeadmControlPlane":
+                labels["cluster.x-k8s.io/control-plane-name"] = owner["metadata"]["name"]
+                labels["cluster.x-k8s.io/control-plane"] = ""
+            else:
+                labels["cluster.x-k8s.io/deployment-name"] = owner["metadata"]["name"]
+            for i in range(int(owner["spec"].get("replicas", 1) or 0)):
+                name = f"{owner['metadata']['name']}-sim{i}"
+                machines.append({
+                    "apiVersion": "cluster.x-k8s.io/v1beta1", "kind": "Machine",
+                    "metadata": {"name": name, "namespace": "default", "labels": labels},
+                    "spec": {"clusterName": cluster},
+                    "status": {"phase": "Running", "nodeRef": {"kind": "Node", "name": name},
+                               "conditions": [{"type": "Ready", "status": "True"}]},
+                })
+        return machines
+
+    def apply_documents(self, server, text):
+        """Stores the objects of a YAML stream on a server and returns "kubectl apply" output."""
+        lines = []
+        for document in yaml.safe_load_all(text):
+            if not document:
+                continue
+            kind, name = document.get("kind"), document.get("metadata", {}).get("name")
+            key = self.key(kind, name)
+            verb = "configured" if key in server["objects"] else "created"
+            document.setdefault("metadata", {}).setdefault("namespace", "default")
+            if kind == "Cluster":
+                document["metadata"].setdefault("creationTimestamp", "2022-05-27T20:58:06Z")
+                document["status"] = {"phase": "Provisioning", "conditions": [{"type": "Ready", "status": "False"}]}
+                self.state["kubeconfig_polls"][name] = 0
+            if kind == "DaemonSet" and name == "calico-node":
+                server["cni"] = True
+            if kind in ("KubeadmControlPlane", "MachineDeployment", "MachinePool"):
+                replicas = document.get("spec", {}).get("replicas", 1)
+                document["status"] = {"replicas": replicas, "readyReplicas": replicas, "phase": "Running"}
+            server["objects"][key] = document
+            lines.append(f"{kind.lower()}.{GROUPS.get(kind, '')}/{name} {verb}".replace("./", "/"))
+        return "\n".join(lines)
+
+
+def kubeconfig_for(name, server):
+    """Returns the admin kubeconfig of a simulated cluster as YAML."""
+    ca_data = base64.b64encode(f"sim-ca-{name}".encode()).decode()
+    return yaml.safe_dump({
+        "apiVersion": "v1", "kind": "Config", "current-context": f"{name}-admin@{name}",
+        "clusters": [{"name": name, "cluster": {"server": server, "certificate-authority-data": ca_data}}],
+        "contexts": [{"name": f"{name}-admin@{name}", "context": {"cluster": name, "user": f"{name}-admin"}}],
+        "users": [{"name": f"{name}-admin", "user": {"token": f"sim-token-{name}"}}],
+    })
+
+
+def update_default_kubeconfig(update):
+    """Calls update with the parsed $HOME/.kube/config and writes the result back."""
+    path = os.path.join(os.path.expanduser("~"), ".kube", "config")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(path, encoding="utf-8") as f:
+            document = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        document = {}
+    for section in ("clusters", "contexts", "users"):
+        document.setdefault(section, [])
+    update(document)
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(document, f)
+
+
+def add_kubeconfig_context(name, server):
+    """Adds a context for a cluster to $HOME/.kube/config and makes it current, like kind and az aks."""
+    def update(document):
+        generated = yaml.safe_load(kubeconfig_for(name, server))
+        for section in ("clusters", "contexts", "users"):
+            document[section] = [e for e in document[section] if e["name"] != generated[section][0]["name"]]
+            document[section].append(generated[section][0])
+        document["contexts"][-1]["name"] = name
+        document["current-context"] = name
+    update_default_kubeconfig(update)
+
+
+def remove_kubeconfig_context(name):
+    """Removes a cluster's context from $HOME/.kube/config, like "kind delete cluster"."""
+    def update(document):
+        for section in ("clusters", "contexts"):
+            document[section] = [e for e in document[section] if e["name"] != name]
+        document["users"] = [e for e in document["users"] if e["name"] != f"{name}-admin"]
+        if document.get("current-context") == name:
+            document["current-context"] = ""
+    update_default_kubeconfig(update)
+
+
+def kubectl(world, args):  # pylint: disable=too-many-return-statements,too-many-branches,too-many-statements
+    """Simulates the kubectl commands the extension runs."""
+    positional, flags = parse_args(args)
+    verb = positional[0] if positional else ""
+    if verb == "cluster-info":
+        url, _ = world.server(flags)
+        return (f"Kubernetes control plane is running at {url}\n"
+                f"CoreDNS is running at {url}/api/v1/namespaces/kube-system/services/kube-dns:dns/proxy\n")
+    url, server = world.server(flags)
+    output = flag(flags, "--output", "-o")
+    if verb == "get":
+        resource = positional[1] if len(positional) > 1 else ""
+        names = positional[2:]
+        if resource in ("namespaces", "namespace", "ns"):
+            namespace = names[0]
+            if namespace not in server["namespaces"]:
+                raise CommandError(f'Error from server (NotFound): namespaces "{namespace}" not found')
+            return f"NAME   STATUS   AGE\n{namespace}   Active   1m\n"
+        if resource in ("pods", "pod"):
+            namespace = flag(flags, "--namespace", "-n")
+            if namespace not in server["namespaces"]:
+                return f"No resources found in {namespace} namespace.\n"
+            pod = MANAGEMENT_NAMESPACES.get(namespace, namespace)
+            return f"NAME   READY   STATUS    RESTARTS   AGE\n{pod}-7d9f8c-sim   1/1     Running   0          1m\n"
+        if resource in ("nodes", "node"):
+            if output == "name":
+                return "".join(f"node/{n}\n" for n in server["nodes"])
+            return json.dumps({"apiVersion": "v1", "kind": "List", "items": [
+                {"kind": "Node", "metadata": {"name": n}} for n in server["nodes"]]})
+        if resource.startswith("endpoints"):
+            return json.dumps({"kind": "Endpoints", "subsets": [{"addresses": [{"ip": "10.0.0.1"}]}]})
+        kind = kind_of(resource)
+        if kind is None:
+            return ""
+        items = world.objects_of_kind(server, kind)
+        selector = flag(flags, "-l", "--selector")
+        if selector:
+            label, value = selector.split("=", 1)
+            items = [o for o in items if (o["metadata"].get("labels") or {}).get(label) == value]
+        if names:
+            items = [o for o in items if o["metadata"]["name"] in names]
+            if not items:
+                raise CommandError(f'Error from server (NotFound): {resource} "{names[0]}" not found')
+        if output == "name":
+            return "".join(f"{kind.lower()}.{GROUPS.get(kind, '')}/{o['metadata']['name']}\n" for o in items)
+        if names and len(names) == 1:
+            return json.dumps(items[0])
+        return json.dumps({"apiVersion": "v1", "kind": "List", "items": items, "metadata": {"resourceVersion": ""}})
+    if verb == "create" and positional[1:2] == ["secret"]:
+        name = positional[3]
+        if name in server["secrets"]:
+            raise CommandError(f'Error from server (AlreadyExists): secrets "{name}" already exists')
+        server["secrets"].append(name)
+        return f"secret/{name} created\n"
+    if verb == "apply":
+        source = flag(flags, "-f", "--filename")
+        if source.startswith("http://") or source.startswith("https://"):
+            server["cni"] = True
+            return "configmap/calico-config created\ndaemonset.apps/calico-node created\n"
+        if source == "-":
+            return world.apply_documents(server, world.stdin)
+        with open(source, encoding="utf-8") as f:
+            return world.apply_documents(server, f.read())
+    if verb == "wait":
+        refs = positional[1:]
+        condition = flag(flags, "--for", default="")
+        if condition == "delete":
+            return ""
+        if any(r.startswith("node") for r in refs) and not server["cni"]:
+            raise CommandError("error: timed out waiting for the condition on nodes")
+        return "".join(f"{r} condition met\n" for r in refs)
+    if verb == "delete":
+        resource = positional[1]
+        if resource in ("namespace", "namespaces"):
+            server["namespaces"] = [n for n in server["namespaces"] if n not in positional[2:]]
+            return ""
+        kind = kind_of(resource)
+        for name in positional[2:]:
+            cluster = server["objects"].get(World.key(kind, name))
+            if cluster is None:
+                raise CommandError(f'Error from server (NotFound): {resource} "{name}" not found')
+            if kind == "Cluster":
+                server["objects"] = {k: o for k, o in server["objects"].items()
+                                     if (o["metadata"].get("labels") or {}).get(CLUSTER_NAME_LABEL) != name
+                                     and o["metadata"]["name"] != name
+                                     and not o["metadata"]["name"].startswith(f"{name}-")}
+            else:
+                del server["objects"][World.key(kind, name)]
+        return "".join(f"{resource} \"{n}\" deleted\n" for n in positional[2:])
+    return ""
+
+
+def clusterctl(world, args):
+    """Simulates the clusterctl commands the extension runs."""
+    positional, flags = parse_args(args)
+    verb = positional[0] if positional else ""
+    if verb == "init":
+        _, server = world.server(flags)
+        server["namespaces"] = sorted(set(server["namespaces"]) | set(MANAGEMENT_NAMESPACES))
+        return "Your management cluster has been initialized successfully!\n"
+    if verb == "get" and positional[1:2] == ["kubeconfig"]:
+        name = positional[2]
+        _, server = world.server(flags)
+        cluster = server["objects"].get(World.key("Cluster", name))
+        polls = world.state["kubeconfig_polls"].get(name, 0)
+        world.state["kubeconfig_polls"][name] = polls + 1
+        if cluster is None or polls < world.config.get("kubeconfig_after", 0):
+            raise CommandError(f'Error: "{name}-kubeconfig" not found in namespace "default"')
+        cluster["status"] = {"phase": "Provisioned", "conditions": [{"type": "Ready", "status": "True"}]}
+        url = f"https://{name}.sim.local:6443"
+        workload = world.add_server(url)
+        machines = [m["metadata"]["name"] for m in world.machines(server) if m["spec"]["clusterName"] == name]
+        workload["nodes"] = machines or [f"{name}-control-plane-sim0"]
+        return kubeconfig_for(name, url)
+    if verb == "move":
+        _, source = world.server(flags)
+        _, target = world.server({"--kubeconfig": flag(flags, "--to-kubeconfig")})
+        target["objects"].update(source["objects"])
+        source["objects"] = {}
+        return "Performing move...\nMoving Cluster API objects Clusters=1\n"
+    if verb == "delete":
+        _, server = world.server(flags)
+        server["namespaces"] = []
+        return ""
+    return ""
+
+
+def kind_tool(world, args):
+    """Simulates creating and deleting kind clusters."""
+    positional, flags = parse_args(args)
+    name = flag(flags, "--name", default="kind")
+    url = world.config.get("kind_server", "https://127.0.0.1:6443")
+    if positional[:2] == ["create", "cluster"]:
+        world.add_server(url)
+        add_kubeconfig_context(f"kind-{name}", url)
+        return f'Creating cluster "{name}" ...\n'
+    if positional[:2] == ["delete", "cluster"]:
+        if url in world.state["servers"]:
+            world.state["servers"][url]["up"] = False
+        remove_kubeconfig_context(f"kind-{name}")
+        return f'Deleting cluster "{name}" ...\n'
+    return ""
+
+
+def az(world, args):
+    """Simulates the az commands the extension runs."""
+    positional, flags = parse_args(args)
+    if positional[:2] == ["group", "delete"]:
+        group = flag(flags, "-n", "--name")
+        for server in world.state["servers"].values():
+            azure_clusters = world.objects_of_kind(server, "AzureCluster")
+            if any(c.get("spec", {}).get("resourceGroup") == group for c in azure_clusters):
+                server["up"] = False
+        return ""
+    if positional[:2] == ["aks", "get-credentials"]:
+        name = flag(flags, "--name")
+        url = f"https://{name}.aks.sim.local:443"
+        world.add_server(url)
+        add_kubeconfig_context(name, url)
+        return ""
+    return ""
+
+
+TOOLS = {"kubectl": kubectl, "clusterctl": clusterctl, "kind": kind_tool, "az": az}
+
+
+def main(argv):
+    """Runs "fakecli.py <tool> <args...>" against the state file and returns the exit code."""
+    # fcntl is POSIX only, so it is imported here to keep this module importable on Windows
+    import fcntl  # pylint: disable=import-outside-toplevel
+    tool, args = os.path.basename(argv[1]), argv[2:]
+    root = os.environ["CAPI_SIMULATOR_DIR"]
+    command_line = " ".join([tool] + args)
+    stdin = sys.stdin.read() if "-" in args else ""
+    objects = [f"{d.get('kind')}/{d.get('metadata', {}).get('name')}" for d in yaml.safe_load_all(stdin) if d]
+    start = time.time()
+    with open(os.path.join(root, "state.lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        world = World(root)
+        delay = world.latency(command_line)
+    time.sleep(delay)
+    with open(os.path.join(root, "state.lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        world = World(root)
+        world.stdin = stdin
+        try:
+            world.inject(command_line, objects)
+            output, exit_code = TOOLS[tool](world, args), 0
+        except CommandError as err:
+            output, exit_code = f"{err}\n", 1
+        world.save()
+        with open(os.path.join(root, "calls.jsonl"), "a", encoding="utf-8") as log:
+            log.write(json.dumps({"tool": tool, "args": args, "objects": objects, "start": start,
+                                  "end": time.time(), "exit_code": exit_code}) + "\n")
+    (sys.stdout if exit_code == 0 else sys.stderr).write(output or "")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
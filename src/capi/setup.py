@@ -58,6 +58,6 @@ setup(
     classifiers=CLASSIFIERS,
     packages=find_packages(),
     install_requires=DEPENDENCIES,
-    package_data={'azext_capi': ['azext_metadata.json', 'templates/*']},
+    package_data={'azext_capi': ['azext_metadata.json', 'templates/*', 'manifests/*/*']},
     include_package_data=True,
 )